@@ -1,20 +1,51 @@
 from bisect import bisect
+from itertools import groupby
 from tqdm import tqdm
-import time
 import pickle
 import os
 
+import gspread
 import pandas as pd
 from numpy import nan
-import gspread
 from camel_tools.utils.charmap import CharMapper
 
+import sheets_client
+
 bw2ar = CharMapper.builtin_mapper('bw2ar')
 ar2bw = CharMapper.builtin_mapper('ar2bw')
 
 valid_radicals_ar = bw2ar("'AbtvjHxd*rzs$SDTZEgfqklmnhwy")
 
-sa = gspread.service_account("/Users/chriscay/.config/gspread/service_account.json")
+# Number of new rows sent (and checkpointed) per batchUpdate request
+BATCH_SIZE = 500
+
+
+# Final row index (0-based, header included) of each new row once merged into the sheet, which is sorted by root.
+# New rows go after the existing rows with the same root, in the order they were given.
+def merge_positions(sheet_roots, rows):
+    rows = sorted(rows, key=lambda x: x[1]['ROOT'])
+    return [(bisect(sheet_roots, row['ROOT']) + j + 1, i, row) for j, (i, row) in enumerate(rows)]
+
+
+# One insertDimension and one updateCells request per run of consecutive new rows, in ascending
+# order so that each run is inserted directly at its final position. As with insert_row, new rows
+# inherit the format of the row after them, never the one of the header.
+def insert_requests(sheet_id, header, positioned_rows):
+    requests = []
+    for _, run in groupby(enumerate(positioned_rows), key=lambda x: x[1][0] - x[0]):
+        run = [positioned_row for _, positioned_row in run]
+        start = run[0][0]
+        requests.append({'insertDimension': {
+            'range': {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': start, 'endIndex': start + len(run)},
+            'inheritFromBefore': False}})
+        requests.append({'updateCells': {
+            'rows': [{'values': [{'userEnteredValue': {'stringValue': row.get(h, '').strip()}} for h in header]}
+                     for _, _, row in run],
+            'fields': 'userEnteredValue',
+            'start': {'sheetId': sheet_id, 'rowIndex': start, 'columnIndex': 0}}})
+    return requests
+
+sa = sheets_client.service_account("/Users/chriscay/.config/gspread/service_account.json")
 sh = sa.open('PACL-Letter-Split')
 
 entries_to_add = pd.read_csv(
@@ -35,32 +66,31 @@ else:
     added_indexes = set()
 
 pbar = tqdm(total=sum(len(rows) for rows in radical2rows.values()))
-restart = False
 for first_radical, rows in radical2rows.items():
     pbar.set_description(first_radical)
     sheet = sh.worksheet(first_radical)
-    sheet_df = pd.DataFrame(sheet.get_all_records())
-    sheet_df = sheet_df.replace(nan, '', regex=True)
-    header = sheet.row_values(1)
-    for i, row in rows:
-        if i in added_indexes:
-            pbar.update(1)
-            continue
+    values = sheet.get_all_values()
+    header = values[0]
+    sheet_roots = [row[header.index('ROOT')] for row in values[1:]]
+    pbar.update(sum(1 for i, _ in rows if i in added_indexes))
+    rows = [(i, row) for i, row in rows if i not in added_indexes]
+    for _, row in rows:
         row['ID'] = 'Auto' if row['LEMMA_AR'].strip() else 'Auto-Shahd'
-        row_ = [row.get(h, '').strip() for h in header]
-        index = bisect(sheet_df['ROOT'].values.tolist(), row['ROOT'])
-        while True:
-            try:
-                sheet.insert_row(row_, max(2, index - 1))
-                break
-            except gspread.exceptions.APIError as e:
-                if 'Quota exceeded' in e.args[0]['message']:
-                    wait = 90
-                    print(f'Quota exceeded, waiting for {wait} seconds and then retrying...')
-                    time.sleep(wait)
-        added_indexes.add(i)
+    positioned_rows = merge_positions(sheet_roots, rows)
+    n_rows = len(values)
+    # Batches are applied top-down, the final positions of the rows of a batch only
+    # depend on the rows above them, which are all in the sheet by then
+    for start in range(0, len(positioned_rows), BATCH_SIZE):
+        batch = positioned_rows[start:start + BATCH_SIZE]
+        try:
+            sh.batch_update({'requests': insert_requests(sheet.id, header, batch)})
+        except gspread.exceptions.APIError:
+            # Inserts are not retried on server errors, which can come after the batch was applied
+            if len(sheet.get_all_values()) != n_rows + len(batch):
+                raise
+        n_rows += len(batch)
+        added_indexes.update(i for _, i, _ in batch)
         with open('added_lemmas.pkl', 'wb') as f:
             pickle.dump(added_indexes, f)
-        pbar.update(1)
+        pbar.update(len(batch))
 pbar.close()
-
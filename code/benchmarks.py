@@ -0,0 +1,175 @@
+import argparse
+import random
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from caphi import load_caphi2ipa
+from duplicates import DuplicateIndex
+from fake_sheets import FakeWorksheet
+from generate_latex_lexicon import build_entry, group_lexicon, sort_inflections
+from sheets_client import SheetsClient
+import utils
+
+RADICALS = list('ءبتثجحخدذرزسشصضطظعغفقكلمنهوي')
+CAPHI = ['b', 't', 'th', 'j', '7', 'x', 'd', 'dh', 'r', 'z', 's', 'sh', 's.', 'd.', '3',
+         'gh', 'f', 'q', 'k', 'l', 'm', 'n', 'h', 'w', 'y', '2', 'a', 'aa', 'i', 'ii', 'u', 'uu', 'ee', 'oo']
+ANALYSES = ['VERB:P', 'VERB:I', 'VERB:C', 'NOUN:MS', 'NOUN:FS', 'NOUN:P', 'ADJ:MS', 'ADJ:FP',
+            'ADV', 'NOUN:PHRASE', 'PHRASE']
+
+
+def synthetic_lexicon(size, seed=42):
+    """Random lexicon with the columns and the shape (roots shared by many lemmas,
+    lemmas shared by many forms) of the Maknuune sheet."""
+    rng = np.random.default_rng(seed)
+    roots = ['.'.join(r) for r in rng.choice(RADICALS, size=(max(size // 20, 1), 3))]
+    lemmas = [root.replace('.', 'َ') for root in roots]
+    root_index = rng.integers(0, len(roots), size)
+    lemma_suffix = rng.integers(0, 3, size).astype(str)
+    ntws = rng.random(size) < 0.03
+    caphi = [' '.join(c) for c in rng.choice(CAPHI, size=(size, 6))]
+    lexicon = pd.DataFrame({
+        'ID': np.arange(size).astype(str),
+        'ROOT': np.where(ntws, 'NTWS', np.array(roots)[root_index]),
+        'ROOT_NTWS': np.where(ntws, np.array(roots)[root_index], ''),
+        'LEMMA': np.char.add(np.array(lemmas)[root_index], lemma_suffix),
+        'FORM': np.char.add(np.array(lemmas)[root_index], rng.integers(0, 4, size).astype(str)),
+        'CAPHI++': caphi,
+        'ANALYSIS': rng.choice(ANALYSES, size),
+        'GLOSS': rng.choice(['house', 'to go;to leave', 'big', 'dog_[auto]'], size),
+        'GLOSS_MSA': rng.choice(['', 'بيت', 'كلب;قط'], size),
+        'SOURCE': rng.choice(['', 'Barghouti'], size),
+        'NOTES': rng.choice(['', 'loanword'], size),
+        'EXAMPLE_USAGE': rng.choice(['', 'مثال'], size)})
+    return lexicon.astype(str)
+
+
+def group_lexicon_iterrows(pacl):
+    # Row by row implementation that group_lexicon() replaced, kept as a reference
+    first_radical2root2lemmapos2type2form2rows = {}
+    for _, row in pacl.iterrows():
+        ntws = True if row['ROOT'] == 'NTWS' else False
+        root = row['ROOT'] if not ntws else row['ROOT_NTWS']
+        lemmapos_rows = first_radical2root2lemmapos2type2form2rows.setdefault(
+            root[0], {}).setdefault(
+                (root, ' (ntws)' if row['ROOT'] == 'NTWS' else ''), {}).setdefault(
+                    (row['LEMMA'], row['ANALYSIS'].split(':')[0].strip()), {'phrases': {}, 'other': {}})
+        
+        feats = row['ANALYSIS'].split(':')[1] if ':' in row['ANALYSIS'] else None
+        lemmapos_rows['phrases' if 'PHRASE' in row['ANALYSIS'] else 'other'].setdefault(
+            (row['FORM'], feats), []).append(row.to_dict())
+    return first_radical2root2lemmapos2type2form2rows
+
+
+def _flatten_grouping(first_radical2root2lemmapos2type2form2rows):
+    # Only the order of the forms within a (lemma, pos) is relevant, the other levels get sorted
+    return sorted((first_radical, root, lemmapos, type_, list(form2rows.items()))
+                  for first_radical, root2lemmapos2type2form2rows in first_radical2root2lemmapos2type2form2rows.items()
+                  for root, lemmapos2type2form2rows in root2lemmapos2type2form2rows.items()
+                  for lemmapos, type2form2rows in lemmapos2type2form2rows.items()
+                  for type_, form2rows in type2form2rows.items())
+
+
+def bench_grouping(lexicon):
+    times = {}
+    for name, func in [('iterrows', group_lexicon_iterrows), ('columnar', group_lexicon)]:
+        start = time.perf_counter()
+        grouping = func(lexicon)
+        times[name] = time.perf_counter() - start
+        flattened = _flatten_grouping(grouping)
+        if name == 'iterrows':
+            reference = flattened
+        else:
+            assert flattened == reference, 'Columnar grouping differs from the reference'
+    print(f"Grouping {len(lexicon.index)} rows: iterrows {times['iterrows']:.2f}s, "
+          f"columnar {times['columnar']:.2f}s ({times['iterrows'] / times['columnar']:.1f}x)")
+
+
+def bench_model_memory(lexicon):
+    load_caphi2ipa()
+    grouping = group_lexicon(lexicon)
+    lemmas = []
+    for root2lemmapos2type2form2rows in grouping.values():
+        for lemmapos2type2form2rows in root2lemmapos2type2form2rows.values():
+            for (lemma, pos), type2form2rows in lemmapos2type2form2rows.items():
+                form2rows = type2form2rows['other']
+                if not form2rows:
+                    continue
+                form2rows_ = [(form, rows) for form, rows in form2rows.items() if form == lemma]
+                form2rows_ += [(form, rows) for form, rows in form2rows.items() if form != lemma]
+                lemmas.append((sort_inflections(form2rows_, pos), type2form2rows['phrases']))
+    # A first build fills the CAPHI++ conversion cache so that only the model itself is measured
+    for form2rows, phrases in lemmas:
+        build_entry(form2rows, phrases)
+    tracemalloc.start()
+    start = time.perf_counter()
+    entries = [build_entry(form2rows, phrases) for form2rows, phrases in lemmas]
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Lexicon model of {len(entries)} entries: {current / 2**20:.1f} MB "
+          f"(peak {peak / 2**20:.1f} MB), built in {seconds:.2f}s")
+
+
+def bench_duplicates(lexicon):
+    start = time.perf_counter()
+    duplicate_index = DuplicateIndex(lexicon)
+    times = {'index': time.perf_counter() - start}
+    for kind in ['exact', 'normalized', 'near']:
+        start = time.perf_counter()
+        hits = getattr(duplicate_index, f'{kind}_duplicates')()
+        times[kind] = time.perf_counter() - start
+        times[f'{kind}_rows'] = len({index for index, _, _ in hits})
+    print(f"Duplicates over {len(lexicon.index)} rows: index {times['index']:.2f}s, " +
+          ', '.join(f"{kind} {times[kind]:.2f}s ({times[f'{kind}_rows']} rows)" for kind in ['exact', 'normalized', 'near']))
+
+
+def bench_sheets(lexicon, rounds=3, changed=0.01):
+    # Status write-backs to an in-memory worksheet that fails with a quota and a server error,
+    # on a simulated clock so that the throttling and backoff waits are reported, not slept
+    now = [0.0]
+    def sleep(seconds):
+        now[0] += seconds
+    client = SheetsClient(clock=lambda: now[0], sleep=sleep, rng=random.Random(0))
+    worksheet = FakeWorksheet([list(lexicon.columns) + ['STATUS_CHRIS']] + lexicon.values.tolist(), errors=[429, 503])
+    sheet = client.wrap(worksheet)
+    rng = np.random.default_rng(0)
+    messages = rng.choice(['', '', 'root-invalid', 'form:hamzat-wasl'], len(lexicon.index)).tolist()
+    cells, worksheet_states = [], {}
+    start = time.perf_counter()
+    for round_ in range(rounds):
+        if round_:
+            for i in rng.choice(len(messages), int(len(messages) * changed), replace=False):
+                messages[i] = 'caphi-invalid-seq' if messages[i] != 'caphi-invalid-seq' else ''
+        cells.append(utils.add_check_mark_online(lexicon, None, sheet, messages=messages, write='overwrite',
+                                                 status_col_name='STATUS_CHRIS', worksheet_states=worksheet_states))
+    seconds = time.perf_counter() - start
+    print(f"Status write-back of {len(lexicon.index)} rows x {rounds}: {seconds:.2f}s, cells written {cells}, "
+          f"requests {worksheet.requests}, {client.summary()} (simulated)")
+
+
+BENCHMARKS = {'grouping': bench_grouping,
+              'model_memory': bench_model_memory,
+              'duplicates': bench_duplicates,
+              'sheets': bench_sheets}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-size", default=100000,
+                        type=int, help="Number of rows of the synthetic lexicon.")
+    parser.add_argument("-maknuune_tabular", default='',
+                        type=str, help="Path to a tabular version of Maknuune to use instead of the synthetic lexicon.")
+    parser.add_argument("-bench", default=list(BENCHMARKS), nargs='+',
+                        choices=list(BENCHMARKS), help="Benchmarks to run (all by default).")
+    args = parser.parse_args()
+
+    if args.maknuune_tabular:
+        lexicon = pd.read_csv(args.maknuune_tabular).astype(str).replace('nan', '')
+    else:
+        lexicon = synthetic_lexicon(args.size)
+
+    for bench in args.bench:
+        BENCHMARKS[bench](lexicon)
@@ -0,0 +1,214 @@
+import re
+from collections import OrderedDict
+from itertools import islice, product
+from math import prod
+
+import pandas as pd
+
+CAPHI_DELIM_RE = re.compile(r'[,#]')
+CAPHI_SPECIAL_CHARS = {'Q', 'D', 'J', 'Z', 'T', 'S', 'Z.', 'D.', 'K'}
+# Default maximum number of alternative transcriptions generated from the alternation
+# slots of a single transcription, the number grows exponentially with the number of slots
+MAX_EXPANSIONS = 64
+
+caphi2ipa = {}
+transducer = None
+
+
+class ConversionCache:
+    """Bounded LRU cache shared by all the CAPHI++ conversion functions. Keys are
+    prefixed by the name of the conversion so that the functions do not collide."""
+
+    def __init__(self, maxsize=2 ** 16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def get(self, key, func, *args):
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        value = func(*args)
+        self._cache[key] = value
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.hits = self.misses = 0
+        self._cache.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+    def __repr__(self) -> str:
+        return f'ConversionCache(hits={self.hits}, misses={self.misses}, size={len(self._cache)}/{self.maxsize})'
+
+
+class CaphiTransducer:
+    """Tokenizer and converter of CAPHI++ transcriptions compiled once from the CAPHI
+    inventory. Symbols of a transcription are separated by spaces, alternative
+    transcriptions by `,` (or `#` for phrases) and alternative symbols by `||` (or `II`).
+    Validation is done by a single regex over the whole inventory instead of one dict
+    lookup per symbol, and whole columns can be converted at once with `map_column()`.
+    At most `max_expansions` alternative transcriptions are generated per transcription."""
+
+    def __init__(self, caphi2ipa=None, caphi2type=None, max_expansions=MAX_EXPANSIONS):
+        self.caphi2ipa = caphi2ipa if caphi2ipa is not None else {}
+        self.caphi2type = caphi2type if caphi2type is not None else {}
+        self.max_expansions = max_expansions
+        self.too_many_alternatives = 0
+        # Longest symbols first so that e.g. `aa.` is not matched as `aa` followed by `.`
+        symbols = sorted(self.caphi2type or self.caphi2ipa, key=lambda s: (-len(s), s))
+        symbol = '(?:' + '|'.join(re.escape(s) for s in symbols) + ')' if symbols else '(?!)'
+        token = f'{symbol}(?:\\|\\|{symbol})*'
+        self.valid_re = re.compile(f'(?:{token}(?: {token})*)?')
+
+    @classmethod
+    def from_table(cls, path='caphi_table_full.tsv', max_expansions=MAX_EXPANSIONS):
+        caphi_inventory = pd.read_csv(path, sep='\t')
+        caphi2ipa_ = _get_caphi2ipa(caphi_inventory)
+        caphi2type = {}
+        if 'Type' in caphi_inventory.columns:
+            caphi2type.update({c: t[0] for c, t in caphi_inventory[['CAPHI', 'Type']].values.tolist()
+                               if t in ('consonant', 'vowel')})
+            caphi2type.update({c: 'c' for c in CAPHI_SPECIAL_CHARS})
+            caphi2type['#'] = '#'
+        return cls(caphi2ipa_, caphi2type, max_expansions)
+
+    @staticmethod
+    def tokenize(caphi):
+        return [variant.split() for variant in CAPHI_DELIM_RE.split(normalize_caphi(caphi))]
+
+    @staticmethod
+    def _get_alternatives(tokens):
+        # Alternation slots holding the same alternatives are linked, i.e., the same
+        # alternative is chosen in all of them
+        ored = list(dict.fromkeys(t for t in tokens if '||' in t))
+        return ored, [t.split('||') for t in ored]
+
+    def count_expansions(self, tokens):
+        return prod(len(alternatives) for alternatives in self._get_alternatives(tokens)[1])
+
+    def has_too_many_expansions(self, tokens):
+        """Whether the transcription has more alternatives than `max_expansions`, such
+        transcriptions are counted in `too_many_alternatives`."""
+        if self.max_expansions is None or self.count_expansions(tokens) <= self.max_expansions:
+            return False
+        self.too_many_alternatives += 1
+        return True
+
+    def iter_expansions(self, tokens):
+        """Lazily yields the alternative transcriptions (cartesian product of the
+        alternation slots), at most `max_expansions` of them."""
+        ored, alternatives = self._get_alternatives(tokens)
+        if not ored:
+            yield tokens
+            return
+        for choice in islice(product(*alternatives), self.max_expansions):
+            t2choice = dict(zip(ored, choice))
+            yield [t2choice.get(t, t) for t in tokens]
+
+    def expand(self, tokens):
+        return list(self.iter_expansions(tokens))
+
+    def is_valid(self, caphi):
+        return all(self.valid_re.fullmatch(' '.join(tokens)) for tokens in self.tokenize(caphi))
+
+    def types(self, tokens):
+        # Only the first alternative of an alternation slot is considered
+        return ''.join([self.caphi2type[t.split('||', 1)[0]] for t in tokens])
+
+    def to_ipa(self, tokens, tipa=False):
+        ipa = ''.join([self.caphi2ipa.get(t, '\\#') for t in tokens])
+        return f"\\textipa{{{ipa}}}" if tipa else ipa
+
+    @staticmethod
+    def map_column(column, func):
+        # Transcriptions are heavily repeated within the lexicon so each distinct value
+        # is converted only once
+        uniques = pd.unique(column)
+        return column.map(dict(zip(uniques, map(func, uniques))))
+
+
+IPA_CACHE = ConversionCache()
+
+
+def load_caphi2ipa(path='caphi_table_full.tsv'):
+    caphi2ipa_ = _get_caphi2ipa(pd.read_csv(path, sep='\t'))
+    set_caphi2ipa(caphi2ipa_)
+    return caphi2ipa_
+
+
+def _get_caphi2ipa(caphi_inventory):
+    caphi2ipa_ = dict(zip(caphi_inventory['CAPHI'], caphi_inventory['IPA']))
+    
+    CAPHI_SPECIAL_CHARS_MAP = {
+        'Q': {'caphi':['q', 'k', '2', 'g'], 'tipa++': '(q)', 'ipa': '(q)'},
+        'D': {'caphi':['dh', 'd'], 'tipa++': '(d)', 'ipa': '(d)'},
+        'J': {'caphi':['j', 'dj'], 'tipa++': '(\\t{dZ})', 'ipa': f"({caphi2ipa_['dj']})"},
+        'Z': {'caphi':['z', 'dh'], 'tipa++': '(D)', 'ipa': f"({caphi2ipa_['dh']})"},
+        'T': {'caphi':['t', 'th'], 'tipa++': '(t)', 'ipa': '(t)'},
+        'S': {'caphi':['s', 'th'], 'tipa++': '(T)', 'ipa': f"({caphi2ipa_['th']})"},
+        'Z.': {'caphi':['z.', 'dh.'], 'tipa++': '(D\\super Q)', 'ipa': f"({caphi2ipa_['dh.']})"},
+        'D.': {'caphi':['d.', 'dh.'], 'tipa++': '(d\\super Q)', 'ipa': f"({caphi2ipa_['d.']})"},
+        'K': {'caphi':['k', 'tsh'], 'tipa++': '(k)', 'ipa': '(k)'}
+    }
+    return {**caphi2ipa_, **{k: v['ipa'] for k, v in CAPHI_SPECIAL_CHARS_MAP.items()}}
+
+
+def set_caphi2ipa(caphi2ipa_, max_expansions=MAX_EXPANSIONS):
+    global caphi2ipa, transducer
+    caphi2ipa = caphi2ipa_
+    transducer = CaphiTransducer(caphi2ipa, max_expansions=max_expansions)
+    # Conversions cached with the previous table are not valid anymore
+    IPA_CACHE.clear()
+
+
+def normalize_caphi(caphi):
+    return ' '.join(caphi.replace('II', '||').split())
+
+
+def get_sub_ipa(caphi_sub, ipapp=True, tipa=False):
+    return IPA_CACHE.get(('sub_ipa', tuple(caphi_sub), ipapp, tipa),
+                         _get_sub_ipa, caphi_sub, ipapp, tipa)
+
+
+def _get_sub_ipa(caphi_sub, ipapp=True, tipa=False):
+    if ipapp:
+        return transducer.to_ipa(caphi_sub, tipa=tipa)
+    chunk = []
+    char_ipa_prev = caphi_sub[0] not in CAPHI_SPECIAL_CHARS
+    ipa_output = []
+    for i, c in enumerate(caphi_sub):
+        char_ipa = c not in CAPHI_SPECIAL_CHARS
+        if char_ipa != char_ipa_prev and chunk:
+            ipa_ = ''.join(caphi2ipa.get(c, '\\#') if c != '.' else '.' for c in chunk)
+            ipa_output.append(f"\\textipa{{{ipa_}}}" if char_ipa_prev else ipa_)
+            chunk = []
+        # For gemination
+        elif c == caphi_sub[i - 1]:
+            chunk.append('.')
+        chunk.append(c)
+        char_ipa_prev = char_ipa
+    ipa_ = ''.join(caphi2ipa.get(c, '\\#') if c != '.' else '.' for c in chunk)
+    ipa_output.append(f"\\textipa{{{ipa_}}}" if char_ipa_prev else ipa_)
+    return ''.join(ipa_output)
+
+
+def caphipp2ipa(caphipp):
+    caphipp = normalize_caphi(caphipp)
+    return IPA_CACHE.get(('ipa', caphipp), _caphipp2ipa, caphipp)
+
+
+def _caphipp2ipa(caphipp):
+    assert not (',' in caphipp and '#' in caphipp)
+    ipa = []
+    for caphi_sub in transducer.tokenize(caphipp):
+        ipa.append(', '.join(get_sub_ipa(expansion) for expansion in transducer.iter_expansions(caphi_sub)))
+        if transducer.has_too_many_expansions(caphi_sub):
+            ipa[-1] += ', ...'
+    return f"{', ' if ',' in caphipp else ' '}".join(ipa)
@@ -4,6 +4,7 @@ from collections import Counter
 from camel_tools.utils.charmap import CharMapper
 
 import utils
+from caphi import CaphiTransducer
 from utils_old import AlignmentHandler
 from well_formedness import get_caphi_symbols_inventory
 
@@ -15,26 +16,13 @@ ar2bw = CharMapper.builtin_mapper('ar2bw')
 
 pacl = utils.read_pacl_as_df()
 caphi_inventory, _ = get_caphi_symbols_inventory()
+caphi_transducer = CaphiTransducer(caphi2type=caphi_inventory)
 
 # counts = {}
 # for _, row in pacl.iterrows():
 #     caphi = row['CAPHI++'].replace('II', '||')
 #     counts.setdefault(caphi.count('||'), []).append(caphi)
 
-def _expand_caphi(caphi_split):
-    expansions = [[]]
-    for c in caphi_split:
-        for expansion in expansions:
-            if '||' not in c:
-                expansion.append(c)
-            else:
-                expansions_ = []
-                for cc in c.split('||'):
-                    expansions_.append(expansions[-1][:] + [cc])
-                expansions = expansions_
-    return expansions
-
-
 def get_caphi(caphi):
     expansions = []
     for caphi_ in caphi.split(','):
@@ -43,16 +31,12 @@ def get_caphi(caphi):
         if '#' in caphi_ or sum('||' in c for c in caphi_split) > 1:
             discarded.append((form, caphi_))
             continue
-        
-        expansions_ = [caphi_split]
-        if '||' in caphi_:
-            expansions_ = _expand_caphi(caphi_split)
 
-        if not all(c in caphi_inventory for caphi_split in expansions_ for c in caphi_split):
+        if not caphi_transducer.is_valid(caphi_):
             discarded.append((form, caphi_))
             continue
 
-        expansions += expansions_
+        expansions += caphi_transducer.expand(caphi_split)
     
     return expansions
 
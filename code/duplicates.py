@@ -0,0 +1,184 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+AR_DIACRITICS = re.compile(r'[ًٌٍَُِّْـ]')
+HAMZA_NORMALIZE_MAP = str.maketrans({'أ': 'ء', 'إ': 'ء', 'ؤ': 'ء', 'ئ': 'ء', 'آ': 'ء', 'ٱ': 'ا'})
+
+MAX_DISTANCE = 1
+
+
+# Dediacritized and hamza-normalized version of a text, used as blocking key
+def normalize_key(text):
+    return AR_DIACRITICS.sub('', text).translate(HAMZA_NORMALIZE_MAP)
+
+
+# Every distinct text is normalized once
+def normalize_keys(column):
+    codes, uniques = pd.factorize(column)
+    return pd.Series(np.array([normalize_key(text) for text in uniques], dtype=object)[codes], index=column.index)
+
+
+# Roots and analyses the rows are blocked on. NTWS rows are blocked on their ROOT_NTWS when the sheet
+# has one, as in the PDF lexicon.
+def blocking_columns(lexicon):
+    roots = lexicon['ROOT']
+    if 'ROOT_NTWS' in lexicon.columns:
+        roots = roots.where((roots != 'NTWS') | (lexicon['ROOT_NTWS'] == ''), 'NTWS ' + lexicon['ROOT_NTWS'])
+    codes, uniques = pd.factorize(lexicon['ANALYSIS'])
+    analyses = pd.Series(np.array([':'.join(x.strip() for x in analysis.split(':')) for analysis in uniques],
+                                  dtype=object)[codes], index=lexicon.index)
+    return roots, analyses
+
+
+def edit_distance(a, b, max_distance=None):
+    """Levenshtein distance between the strings (or sequences) `a` and `b`, computed with Myers'
+    bit-parallel algorithm. If `max_distance` is given and the lengths alone show that it is exceeded,
+    `max_distance + 1` is returned right away."""
+    if max_distance is not None and abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if not a or not b:
+        return len(a) + len(b)
+    peq = {}
+    for i, symbol in enumerate(a):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+    full, last = (1 << len(a)) - 1, 1 << (len(a) - 1)
+    pv, mv, distance = full, 0, len(a)
+    for symbol in b:
+        eq = peq.get(symbol, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return distance
+
+
+class BKTree:
+    """Burkhard-Keller tree over the edit distance, answers "all items within distance k" queries
+    without comparing the query to every item."""
+    def __init__(self, items=()) -> None:
+        self.root = None
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if self.root is None:
+            self.root = (item, {})
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(item, node[0])
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (item, {})
+                return
+            node = node[1][distance]
+
+    def query(self, item, max_distance=MAX_DISTANCE):
+        matches = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_item, children = nodes.pop()
+            distance = edit_distance(item, node_item)
+            if distance <= max_distance:
+                matches.append((distance, node_item))
+            # Triangle inequality: only the subtrees at distance d +/- max_distance can hold matches
+            nodes.extend(child for child_distance, child in children.items()
+                         if distance - max_distance <= child_distance <= distance + max_distance)
+        return matches
+
+
+class DuplicateIndex:
+    """Duplicate detection over a whole lexicon without pairwise comparisons.
+
+    Rows are blocked on their (analysis, lemma, form) for exact and CAPHI++-only duplicates, and on
+    their dediacritized and hamza-normalized (analysis, lemma, form, CAPHI++) for spelling variants.
+    Near duplicates are looked up in a BK-tree per (analysis, normalized root) block, over the
+    normalized lemma and form of the rows, and must also be within `max_distance` CAPHI++ symbols. All methods return (index, code, reference index) hits.
+    """
+    def __init__(self, lexicon, max_distance=MAX_DISTANCE) -> None:
+        self.max_distance = max_distance
+        self.entry2indexes_caphi = {}
+        self.normalized2entries = {}
+        self.block2key2indexes = {}
+        self.index2caphi = {}
+        roots, analyses = blocking_columns(lexicon)
+        for i, root, lemma, form, analysis, caphi, root_norm, lemma_norm, form_norm in zip(
+                lexicon.index, roots, lexicon['LEMMA'], lexicon['FORM'], analyses, lexicon['CAPHI++'],
+                normalize_keys(roots), normalize_keys(lexicon['LEMMA']), normalize_keys(lexicon['FORM'])):
+            entry = (analysis, lemma, form)
+            self.entry2indexes_caphi.setdefault(entry, []).append((i, caphi))
+            normalized = (analysis, lemma_norm, form_norm, ' '.join(caphi.split()))
+            self.normalized2entries.setdefault(normalized, {}).setdefault(entry, []).append(i)
+            self.block2key2indexes.setdefault((analysis, root_norm), {}).setdefault(
+                f'{lemma_norm} {form_norm}', []).append(i)
+            self.index2caphi[i] = caphi.split()
+
+    def exact_duplicates(self):
+        hits = []
+        for entry, indexes_caphi in self.entry2indexes_caphi.items():
+            if len(indexes_caphi) > 1:
+                caphi2indexes = {}
+                for index, caphi in indexes_caphi:
+                    caphi2indexes.setdefault(caphi, []).append(index)
+
+                for caphi, indexes in caphi2indexes.items():
+                    if len(indexes) > 1:
+                        hits += [(index, 'possible-duplicates', indexes[0]) for index in indexes]
+
+                index_select = next(iter(caphi2indexes.values()))[0]
+                for caphi, indexes in caphi2indexes.items():
+                    if len(indexes) == 1:
+                        hits.append((indexes[0], 'possible-caphi-duplicates', index_select))
+        return hits
+
+    def normalized_duplicates(self):
+        hits = []
+        for entries in self.normalized2entries.values():
+            if len(entries) > 1:
+                indexes = sorted(index for indexes in entries.values() for index in indexes)
+                hits += [(index, 'possible-normalized-duplicates', indexes[0]) for index in indexes]
+        return hits
+
+    # Spelling neighbours are only near duplicates if they are also pronounced (almost) the same
+    def _close_caphi(self, indexes_a, indexes_b):
+        return any(edit_distance(self.index2caphi[a], self.index2caphi[b], self.max_distance) <= self.max_distance
+                   for a in indexes_a for b in indexes_b)
+
+    def near_duplicates(self):
+        hits = []
+        for key2indexes in self.block2key2indexes.values():
+            if len(key2indexes) < 2:
+                continue
+            # Keys within max_distance of each other are merged into clusters (union-find). Every key
+            # is looked up before being added to the tree, so that each pair is only compared once.
+            tree = BKTree()
+            parent = {key: key for key in key2indexes}
+            def find(key):
+                while parent[key] != key:
+                    parent[key] = parent[parent[key]]
+                    key = parent[key]
+                return key
+            for key in key2indexes:
+                for _, match in tree.query(key, self.max_distance):
+                    if self._close_caphi(key2indexes[key], key2indexes[match]):
+                        parent[find(match)] = find(key)
+                tree.add(key)
+            cluster2keys = {}
+            for key in key2indexes:
+                cluster2keys.setdefault(find(key), []).append(key)
+            for keys in cluster2keys.values():
+                if len(keys) > 1:
+                    indexes = sorted(index for key in keys for index in key2indexes[key])
+                    hits += [(index, 'possible-near-duplicates', indexes[0]) for index in indexes]
+        return hits
@@ -2,13 +2,10 @@ import re
 from itertools import permutations
 from tqdm import tqdm
 
-import pandas as pd
-from numpy import nan
-import gspread
-
 from camel_tools.utils.charmap import CharMapper
 
 import utils
+import sheets_client
 from well_formedness import diacritics_no_gem_ar, fatHa_ar, kasra_ar, Alif_ar, tanwyn_ar
 
 bw2ar = CharMapper.builtin_mapper('bw2ar')
@@ -16,7 +13,7 @@ ar2bw = CharMapper.builtin_mapper('ar2bw')
 
 valid_radicals_ar = bw2ar("'AbtvjHxd*rzs$SDTZEgfqklmnhwy")
 
-# sa = gspread.service_account("/Users/chriscay/.config/gspread/service_account.json")
+# sa = sheets_client.service_account("/Users/chriscay/.config/gspread/service_account.json")
 # sh = sa.open('PACL-Letter-Split')
 
 
@@ -24,10 +21,7 @@ def edit_column(col_names, mode=''):
     ambiguous = {}
     for sheet_name in tqdm(utils.sheet_names):
         sheet = sh.worksheet(sheet_name)
-        sheet_df = pd.DataFrame(sheet.get_all_records())
-        sheet_df_obj = sheet_df.select_dtypes(['object'])
-        sheet_df[sheet_df_obj.columns] = sheet_df_obj.apply(lambda x: x.str.strip())
-        sheet_df = sheet_df.replace(nan, '', regex=True)
+        sheet_df = utils.read_sheet_as_df(sh, sheet_name)
         header = list(sheet_df.columns)
         
         data = []
@@ -54,8 +48,7 @@ def edit_column(col_names, mode=''):
 
 def add_bw(sheet_name):
     sheet = sh.worksheet(sheet_name)
-    sheet_df = pd.DataFrame(sheet.get_all_records())
-    sheet_df = sheet_df.replace(nan, '', regex=True)
+    sheet_df = utils.read_sheet_as_df(sh, sheet_name, strip=False)
     header = list(sheet_df.columns)
     columns_bw_insert, columns_bw_update  = [], []
     for col_name in ['FORM', 'LEMMA']:
@@ -128,7 +121,7 @@ def _caphi_correction(sheet_df, col_name, col_letter):
     return data
 
 # pacl = utils.read_pacl_as_df()
-sa = gspread.service_account("/Users/chriscay/.config/gspread/service_account.json")
+sa = sheets_client.service_account("/Users/chriscay/.config/gspread/service_account.json")
 # sh = sa.open('PACL-Letter-Split')
 # sheet_names = utils.sheet_names
 sh = sa.open('Maknuune-Release-Camera-Ready')
@@ -0,0 +1,97 @@
+import gspread
+
+
+class _FakeResponse:
+    def __init__(self, code, message) -> None:
+        self.text = message
+        self._error = {'code': code, 'message': message, 'status': ''}
+
+    def json(self):
+        return {'error': self._error}
+
+
+class FakeWorksheet:
+    """In-memory stand-in for a gspread worksheet (cells as a list of rows of strings), for running the
+    write-back code offline. The codes in `errors` are raised, in order, by the next API calls."""
+    def __init__(self, values, title='Sheet1', errors=(), id=0) -> None:
+        self.values = [list(row) for row in values]
+        self.title = title
+        self.id = id
+        self.spreadsheet_id = 'fake'
+        self.errors = list(errors)
+        self.requests = []
+
+    def _request(self, name):
+        self.requests.append(name)
+        if self.errors:
+            code = self.errors.pop(0)
+            raise gspread.exceptions.APIError(_FakeResponse(
+                code, 'Quota exceeded for quota metric' if code == 429 else f'Error {code}'))
+
+    def _column(self, index):
+        return [row[index] if index < len(row) else '' for row in self.values]
+
+    def _set(self, row, col, value):
+        while len(self.values) < row:
+            self.values.append([])
+        cells = self.values[row - 1]
+        cells += [''] * (col - len(cells))
+        cells[col - 1] = value
+
+    def row_values(self, row):
+        self._request('row_values')
+        return list(self.values[row - 1]) if row <= len(self.values) else []
+
+    def col_values(self, col):
+        self._request('col_values')
+        column = self._column(col - 1)
+        while column and column[-1] == '':
+            column.pop()
+        return column
+
+    def get_all_values(self):
+        self._request('get_all_values')
+        return [list(row) for row in self.values]
+
+    def get_all_records(self):
+        self._request('get_all_records')
+        header = self.values[0]
+        return [dict(zip(header, row + [''] * (len(header) - len(row)))) for row in self.values[1:]]
+
+    def batch_get(self, ranges):
+        self._request('batch_get')
+        value_ranges = []
+        for range_ in ranges:
+            start, end = range_.split(':')
+            (row_start, col_start), (row_end, col_end) = [
+                gspread.utils.a1_to_rowcol(f'{cell}1' if cell.isalpha() else cell) for cell in (start, end)]
+            row_end = len(self.values) if end.isalpha() else row_end
+            rows = [[row[c] if c < len(row) else '' for c in range(col_start - 1, col_end)]
+                    for row in self.values[row_start - 1:row_end]]
+            value_ranges.append([row if any(row) else [] for row in rows])
+        return value_ranges
+
+    def batch_update(self, data):
+        self._request('batch_update')
+        for d in data:
+            row_start, col_start = gspread.utils.a1_to_rowcol(d['range'].split(':')[0])
+            for i, row in enumerate(d['values']):
+                for j, value in enumerate(row):
+                    self._set(row_start + i, col_start + j, value)
+
+    def update(self, range_name, values):
+        self.batch_update([{'range': range_name, 'values': values}])
+
+    def insert_row(self, values, index=1):
+        self._request('insert_row')
+        self.values.insert(index - 1, list(values))
+
+    def insert_rows(self, values, row=1):
+        self._request('insert_rows')
+        self.values[row - 1:row - 1] = [list(v) for v in values]
+
+    def insert_cols(self, values, col=1):
+        self._request('insert_cols')
+        for j, column in enumerate(values):
+            for i, row in enumerate(self.values):
+                row.insert(col - 1 + j, column[i] if i < len(column) else '')
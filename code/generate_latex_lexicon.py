@@ -1,18 +1,31 @@
 import re
+import sys
 import argparse
 import os
+import json
+import hashlib
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
-from numpy import nan
-import gspread
+import numpy as np
 
 GLOSS_DELIM_RE = re.compile(r'[;#]')
-CAPHI_DELIM_RE = re.compile(r'[,#]')
 LATIN_SCRIPT = re.compile(r'[a-zA-Z]')
 QUOTES = re.compile(r'"([^"]+)"')
+WRITE_BUFFER_SIZE = 1 << 20
+ANKI_CHUNK_SIZE = 10000
+# Bump whenever the rendered TeX, HTML or plain text changes, so that the sections of the build manifest get regenerated
+RENDER_VERSION = 2
 
 from camel_tools.utils.charmap import CharMapper
 
+import caphi
+from caphi import IPA_CACHE, caphipp2ipa, load_caphi2ipa, set_caphi2ipa
+import sheets_client
+import utils
+
 bw2ar = CharMapper.builtin_mapper('bw2ar')
 ar2bw = CharMapper.builtin_mapper('ar2bw')
 
@@ -27,7 +40,10 @@ FEATS_ORDER = {f: i
     for i, f in enumerate(['ms', 'fs', 'verb:p',  'verb:c', 'verb:i', 'p', 'mp', 'fp'])} 
 
 class SubEntry:
+    __slots__ = ('id', 'pos', 'ipa', 'feats', 'form', 'glosses', 'glosses_msa', 'notes', 'source', 'paradigms')
+
     def __init__(self,
+                 id=None,
                  pos=None,
                  feats=None,
                  form=None,
@@ -36,6 +52,7 @@ class SubEntry:
                  glosses_msa=None,
                  notes=None,
                  source=None) -> None:
+        self.id = id
         self.pos = pos
         self.ipa = ipa
         self.feats = feats
@@ -44,17 +61,19 @@ class SubEntry:
         self.glosses_msa = glosses_msa
         self.notes = notes
         self.source = source
-        self.paradigms = []
+        self.paradigms = ()
 
     def __repr__(self) -> str:
         return str((self.form, self.feats))
 
 
 class Entry:
+    __slots__ = ('inflections', 'phrases', 'examples')
+
     def __init__(self) -> None:
         self.inflections = []
         self.phrases = []
-        self.examples = []
+        self.examples = ()
 
     @staticmethod
     def _get_glosses_msa_latex_str(glosses_msa):
@@ -75,167 +94,41 @@ class Entry:
         return glosses_
 
 
-    def generate_lexeme_entry_latex_str(self, tipa=False):
-        entry = ''
+    # Walks the inflection/paradigm tree once, every renderer emitting its own format
+    def render(self, *renderers):
+        for renderer in renderers:
+            renderer.begin_entry(self)
         for i, inflection in enumerate(self.inflections):
-            if i:
-                entry += BULLET
-
-            entry += f"\\setlength\\topsep{{0pt}}\\textbf{{\\foreignlanguage{{arabic}}{{{inflection.form}}}}}"
-            if inflection.notes is not None:
-                entry += f"\\footnote{{{inflection.notes}}}\\ "
-            entry += '\\ '
-
-            ipa = inflection.ipa if tipa else f"{{\\sffamily {inflection.ipa}}}"
-            entry += f"{{\\color{{gray}}\\texttt{{/\\sffamily {{{ipa}}}/}}\\color{{black}}}}\\ "
-
-            entry += f'\\textsc{{{inflection.pos}}}\\ ' if i == 0 else ''
-            if inflection.feats:
-                entry += '[' + FEAT2FANCY.get(inflection.feats, inflection.feats) + ']\\ '
-            
-            for j, paradigm in enumerate([inflection] + inflection.paradigms):
-                if j and len(inflection.paradigms) > 0:
-                    entry += LOZENGE
-                    entry += f"\\setlength\\topsep{{0pt}}\\textbf{{\\foreignlanguage{{arabic}}{{{paradigm.form}}}}}\\ "
-
-                    if paradigm.notes is not None:
-                        entry += f"\\footnote{{{paradigm.notes}}}\\ "
-
-                if paradigm.ipa is not None and paradigm.ipa != inflection.ipa:
-                    entry += f"{{\\color{{gray}}\\texttt{{/{paradigm.ipa}/}}\\color{{black}}}}\\ "
-                
-                if paradigm.source is not None:
-                    entry += f'(src. \\color{{gray}}{paradigm.source}\\color{{black}})\\ '
-                
-                if paradigm.glosses_msa is not None:
-                    glosses_msa = Entry._get_glosses_msa_latex_str(paradigm.glosses_msa)
-                    entry += f'\\color{{gray}}(msa. {glosses_msa})\\color{{black}}\\ '
-                
-                if paradigm.glosses is not None:
-                    entry += f'{Entry._get_glosses_latex_str(paradigm.glosses)}\\ '
-            
-        return entry
-    
-    
-    def generate_phrases_latex_str(self, tipa=False):
-        entry = ''
-        for i, phrase in enumerate(self.phrases):
-            entry += f"\\textsc{{ph.}} \\color{{gray}} \\foreignlanguage{{arabic}}{{{phrase.form}}}\\color{{black}}\\ "
-            if phrase.notes is not None:
-                entry += f"\\footnote{{{phrase.notes}}}\\ "
-            ipa = phrase.ipa if tipa else f"{{\\sffamily {phrase.ipa}}}"
-            entry += f"{{\\color{{gray}}\\texttt{{/{ipa}/}}\\color{{black}}}}\\ "
-            if phrase.source is not None:
-                entry += f'\\color{{gray}}(src. {phrase.source})\\color{{black}}\\ '
-            if phrase.glosses_msa is not None:
-                    glosses_msa = Entry._get_glosses_msa_latex_str(phrase.glosses_msa)
-                    entry += f'\\color{{gray}} (msa. {glosses_msa})\\color{{black}}\\ '
-            if phrase.glosses is not None:
-                entry += f'{Entry._get_glosses_latex_str(phrase.glosses)}\\ '
-            entry += BULLET if i + 1 < len(self.phrases) else ''
-        
-        return entry
-    
-
-    def generate_examples_latex_str(self):
-        examples = []
-        for example in self.examples:
-            examples.append(f'{example}{BULLET}')
-
-        examples = f'\\foreignlanguage{{arabic}}{{\\textbf{{\\underline{{\\foreignlanguage{{arabic}}{{أمثلة}}}}}}: ' + \
-            ' '.join(reversed(examples))[:-len(BULLET)] + '}'
-        
-        entry = f" \\begin{{flushright}}\\color{{gray}}{examples}\\end{{flushright}}\\color{{black}}"
-        return entry
-    
-
-    def generate_root_entry_latex_str(self):
-        lexeme_str = self.generate_lexeme_entry_latex_str()
-        
-        root_entry = '{' + lexeme_str
-        
+            for renderer in renderers:
+                renderer.inflection(i, inflection)
+            for j, paradigm in enumerate((inflection, *inflection.paradigms)):
+                for renderer in renderers:
+                    renderer.paradigm(j, paradigm, inflection)
         if self.phrases:
-            root_entry += BULLET
-            root_entry += self.generate_phrases_latex_str()
-        
+            for renderer in renderers:
+                renderer.begin_phrases(self.phrases)
+        for i, phrase in enumerate(self.phrases):
+            for renderer in renderers:
+                renderer.phrase(i, phrase, len(self.phrases))
         if self.examples:
-            root_entry += self.generate_examples_latex_str()
-        
-        root_entry += '} \\vspace{2mm}'
+            for renderer in renderers:
+                renderer.examples(self.examples)
+        for renderer in renderers:
+            renderer.end_entry(self)
+        return [renderer.flush() for renderer in renderers]
 
-        return root_entry
-    
 
-    def generate_flashcard_inflections_html_str(self, tipa=False):
-        entry = '<body>'
-        for i, inflection in enumerate(self.inflections):
-            entry += f'<h2 style="border:2px solid MediumSeaGreen;">{inflection.form} /{inflection.ipa}/'
-            if inflection.feats:
-                entry += ' [' + FEAT2FANCY.get(inflection.feats, inflection.feats) + ']'
-            if i == 0:
-                entry += f' {inflection.pos.upper()}</h2>'
-            else:
-                entry += '</h2>'
-            if inflection.notes is not None:
-                entry += f'<p>{inflection.notes}</p>'
-            
-            for j, paradigm in enumerate([inflection] + inflection.paradigms):
-                if j and len(inflection.paradigms) > 0:
-                    entry += f'<h2 style="border:2px solid MediumSeaGreen;">{paradigm.form}'
-                    
-                if paradigm.ipa is not None and paradigm.ipa != inflection.ipa:
-                    entry += f' /{paradigm.ipa}/</h2>'
-                elif j and len(inflection.paradigms) > 0:
-                    entry += '</h2>'
-                
-                entry += '<p>'
-                if j and len(inflection.paradigms) > 0 and paradigm.notes is not None:
-                    entry += f'Notes: {paradigm.notes}'
-                
-                if paradigm.source is not None:
-                    entry += f'<br>Source: {paradigm.source}'
-                
-                entry += '</p>'
-                if entry[-7:] == '<p></p>':
-                    entry = entry[:-7]
-                
-                if paradigm.glosses is not None:
-                    entry += '<p>'
-                    entry += '<br>'.join(f'{i + 1}. {g}'for i, g in enumerate(paradigm.glosses))
-                    entry += '</p>'
+    def generate_root_entry_latex_str(self, tipa=False):
+        return ''.join(self.render(TexRenderer(tipa))[0])
 
-                if paradigm.glosses_msa is not None:
-                    entry += '<p>'
-                    entry += '<br>'.join(f'{DIGITS_MAP[str(i + 1)]}. {g}'for i, g in enumerate(paradigm.glosses_msa))
-                    entry += '</p>'
 
-        if self.phrases:
-            entry += '<h2 style="border:2px solid Violet;">Phrases</h2>'
-        for i, phrase in enumerate(self.phrases):
-            entry += f'<h2 style="border:2px solid MediumSeaGreen;">{phrase.form}<br>/{phrase.ipa}/</h2>'
-            if phrase.notes is not None:
-                entry += f'<br>Notes: {phrase.notes}'
-            if phrase.source is not None:
-                entry += f'<br>Source: {paradigm.source}'
-            if phrase.glosses is not None:
-                entry += '<p>'
-                entry += '<br>'.join(f'{i + 1}. {g}'for i, g in enumerate(phrase.glosses))
-                entry += '</p>'
-            if phrase.glosses_msa is not None:
-                entry += '<p>'
-                entry += '<br>'.join(f'{DIGITS_MAP[str(i + 1)]}. {g}'for i, g in enumerate(phrase.glosses_msa))
-                entry += '</p>'
-            entry += '</p>' if i + 1 < len(self.phrases) else ''
+    def generate_flashcard_inflections_html_str(self):
+        return ''.join(self.render(HtmlRenderer())[0])
 
-        if self.examples:
-            entry += '<h2 style="border:2px solid Violet;">Examples</h2>'
-        for example in self.examples:
-            entry += f'{example} •<br>'
 
-        entry += '</body>'
-            
-        return entry
-        
+    def generate_plain_text_str(self):
+        return ''.join(self.render(TextRenderer())[0])
+
 
 begin_document = """
 \\documentclass[10pt,a4paper,twoside]{article} % 10pt font size, A4 paper and two-sided margins
@@ -251,7 +144,6 @@ end_document = """
 
 BULLET = "\\ $\\bullet$\\ \\ "
 LOZENGE = "\\ $\\smblkdiamond$\\ \\ "
-CAPHI_SPECIAL_CHARS = {'Q', 'D', 'J', 'Z', 'T', 'S', 'Z.', 'D.', 'K'}
 
 NOTES_RE = re.compile(r'loanword|unit noun|collective noun|mass noun|approving|disapproving|taboo|impolite')
 
@@ -282,59 +174,247 @@ def text2latex_ar(text):
 
     return ' '.join(text)
 
-def get_sub_ipa(caphi_sub, ipapp=True, tipa=False):
-    if ipapp:
-        ipa_ = ''.join(caphi2ipa.get(c, '\\#') for c in caphi_sub)
-        return f"\\textipa{{{ipa_}}}" if tipa else ipa_
-    chunk = []
-    char_ipa_prev = caphi_sub[0] not in CAPHI_SPECIAL_CHARS
-    ipa_output = []
-    for i, c in enumerate(caphi_sub):
-        char_ipa = c not in CAPHI_SPECIAL_CHARS
-        if char_ipa != char_ipa_prev and chunk:
-            ipa_ = ''.join(caphi2ipa.get(c, '\\#') if c != '.' else '.' for c in chunk)
-            ipa_output.append(f"\\textipa{{{ipa_}}}" if char_ipa_prev else ipa_)
-            chunk = []
-        # For gemination
-        elif c == caphi_sub[i - 1]:
-            chunk.append('.')
-        chunk.append(c)
-        char_ipa_prev = char_ipa
-    ipa_ = ''.join(caphi2ipa.get(c, '\\#') if c != '.' else '.' for c in chunk)
-    ipa_output.append(f"\\textipa{{{ipa_}}}" if char_ipa_prev else ipa_)
-    return ''.join(ipa_output)
+class Renderer:
+    """Collects the fragments of one output format while `Entry.render` walks an entry.
+
+    Templates are compiled once, as bound `str.format` methods, when the class is defined.
+    """
+    def __init__(self) -> None:
+        self.fragments = []
+
+    def begin_entry(self, entry):
+        pass
+
+    def inflection(self, i, inflection):
+        pass
+
+    def paradigm(self, j, paradigm, inflection):
+        pass
+
+    def begin_phrases(self, phrases):
+        pass
+
+    def phrase(self, i, phrase, n_phrases):
+        pass
+
+    def examples(self, examples):
+        pass
+
+    def end_entry(self, entry):
+        pass
+
+    def flush(self):
+        fragments, self.fragments = self.fragments, []
+        return fragments
+
+
+class TexRenderer(Renderer):
+    HEAD = "\\setlength\\topsep{{0pt}}\\textbf{{\\foreignlanguage{{arabic}}{{{}}}}}".format
+    FOOTNOTE = "\\footnote{{{}}}\\ ".format
+    SFFAMILY = "{{\\sffamily {}}}".format
+    INFLECTION_IPA = "{{\\color{{gray}}\\texttt{{/\\sffamily {{{}}}/}}\\color{{black}}}}\\ ".format
+    POS = "\\textsc{{{}}}\\ ".format
+    FEATS = "[{}]\\ ".format
+    PARADIGM_HEAD = "\\setlength\\topsep{{0pt}}\\textbf{{\\foreignlanguage{{arabic}}{{{}}}}}\\ ".format
+    IPA = "{{\\color{{gray}}\\texttt{{/{}/}}\\color{{black}}}}\\ ".format
+    PARADIGM_SOURCE = "(src. \\color{{gray}}{}\\color{{black}})\\ ".format
+    PARADIGM_MSA = "\\color{{gray}}(msa. {})\\color{{black}}\\ ".format
+    GLOSSES = "{}\\ ".format
+    PHRASE_HEAD = "\\textsc{{ph.}} \\color{{gray}} \\foreignlanguage{{arabic}}{{{}}}\\color{{black}}\\ ".format
+    PHRASE_SOURCE = "\\color{{gray}}(src. {})\\color{{black}}\\ ".format
+    PHRASE_MSA = "\\color{{gray}} (msa. {})\\color{{black}}\\ ".format
+    EXAMPLES_HEAD = (" \\begin{flushright}\\color{gray}"
+                     "\\foreignlanguage{arabic}{\\textbf{\\underline{\\foreignlanguage{arabic}{أمثلة}}}: ")
+    EXAMPLES_TAIL = "}\\end{flushright}\\color{black}"
+
+    def __init__(self, tipa=False) -> None:
+        super().__init__()
+        self.tipa = tipa
+
+    def begin_entry(self, entry):
+        self.fragments.append('{')
+
+    def inflection(self, i, inflection):
+        if i:
+            self.fragments.append(BULLET)
+        self.fragments.append(self.HEAD(inflection.form))
+        if inflection.notes is not None:
+            self.fragments.append(self.FOOTNOTE(inflection.notes))
+        self.fragments.append('\\ ')
+        self.fragments.append(self.INFLECTION_IPA(inflection.ipa if self.tipa else self.SFFAMILY(inflection.ipa)))
+        if i == 0:
+            self.fragments.append(self.POS(inflection.pos))
+        if inflection.feats:
+            self.fragments.append(self.FEATS(FEAT2FANCY.get(inflection.feats, inflection.feats)))
+
+    def paradigm(self, j, paradigm, inflection):
+        if j:
+            self.fragments.append(LOZENGE)
+            self.fragments.append(self.PARADIGM_HEAD(paradigm.form))
+            if paradigm.notes is not None:
+                self.fragments.append(self.FOOTNOTE(paradigm.notes))
+        if paradigm.ipa is not None and paradigm.ipa != inflection.ipa:
+            self.fragments.append(self.IPA(paradigm.ipa))
+        if paradigm.source is not None:
+            self.fragments.append(self.PARADIGM_SOURCE(paradigm.source))
+        if paradigm.glosses_msa is not None:
+            self.fragments.append(self.PARADIGM_MSA(Entry._get_glosses_msa_latex_str(paradigm.glosses_msa)))
+        if paradigm.glosses is not None:
+            self.fragments.append(self.GLOSSES(Entry._get_glosses_latex_str(paradigm.glosses)))
+
+    def begin_phrases(self, phrases):
+        self.fragments.append(BULLET)
+
+    def phrase(self, i, phrase, n_phrases):
+        self.fragments.append(self.PHRASE_HEAD(phrase.form))
+        if phrase.notes is not None:
+            self.fragments.append(self.FOOTNOTE(phrase.notes))
+        self.fragments.append(self.IPA(phrase.ipa if self.tipa else self.SFFAMILY(phrase.ipa)))
+        if phrase.source is not None:
+            self.fragments.append(self.PHRASE_SOURCE(phrase.source))
+        if phrase.glosses_msa is not None:
+            self.fragments.append(self.PHRASE_MSA(Entry._get_glosses_msa_latex_str(phrase.glosses_msa)))
+        if phrase.glosses is not None:
+            self.fragments.append(self.GLOSSES(Entry._get_glosses_latex_str(phrase.glosses)))
+        if i + 1 < n_phrases:
+            self.fragments.append(BULLET)
+
+    def examples(self, examples):
+        # Examples are written right to left, separated by bullets
+        self.fragments.append(self.EXAMPLES_HEAD)
+        for i, example in enumerate(reversed(examples)):
+            if i:
+                self.fragments.append(f'{BULLET} ')
+            self.fragments.append(example)
+        self.fragments.append(self.EXAMPLES_TAIL)
+
+    def end_entry(self, entry):
+        self.fragments.append('} \\vspace{2mm}')
+
+
+class HtmlRenderer(Renderer):
+    HEAD = '<h2 style="border:2px solid MediumSeaGreen;">{} /{}/'.format
+    PARADIGM_HEAD = '<h2 style="border:2px solid MediumSeaGreen;">{}'.format
+    PHRASE_HEAD = '<h2 style="border:2px solid MediumSeaGreen;">{}<br>/{}/</h2>'.format
+    SECTION = '<h2 style="border:2px solid Violet;">{}</h2>'.format
+    PARAGRAPH = '<p>{}</p>'.format
+    GLOSS = '{}. {}'.format
+
+    def begin_entry(self, entry):
+        self.fragments.append('<body>')
+
+    def _glosses(self, glosses, digits=str):
+        self.fragments.append(self.PARAGRAPH('<br>'.join(self.GLOSS(digits(i), g)
+                                                         for i, g in enumerate(glosses, start=1))))
+
+    def inflection(self, i, inflection):
+        self.fragments.append(self.HEAD(inflection.form, inflection.ipa))
+        if inflection.feats:
+            self.fragments.append(' [' + FEAT2FANCY.get(inflection.feats, inflection.feats) + ']')
+        self.fragments.append(f' {inflection.pos.upper()}</h2>' if i == 0 else '</h2>')
+        if inflection.notes is not None:
+            self.fragments.append(self.PARAGRAPH(inflection.notes))
+
+    def paradigm(self, j, paradigm, inflection):
+        if j:
+            self.fragments.append(self.PARADIGM_HEAD(paradigm.form))
+        if paradigm.ipa is not None and paradigm.ipa != inflection.ipa:
+            self.fragments.append(f' /{paradigm.ipa}/</h2>')
+        elif j:
+            self.fragments.append('</h2>')
+        notes = f'Notes: {paradigm.notes}' if j and paradigm.notes is not None else ''
+        notes += f'<br>Source: {paradigm.source}' if paradigm.source is not None else ''
+        if notes:
+            self.fragments.append(self.PARAGRAPH(notes))
+        if paradigm.glosses is not None:
+            self._glosses(paradigm.glosses)
+        if paradigm.glosses_msa is not None:
+            self._glosses(paradigm.glosses_msa, digits_map)
+
+    def begin_phrases(self, phrases):
+        self.fragments.append(self.SECTION('Phrases'))
+
+    def phrase(self, i, phrase, n_phrases):
+        self.fragments.append(self.PHRASE_HEAD(phrase.form, phrase.ipa))
+        if phrase.notes is not None:
+            self.fragments.append(f'<br>Notes: {phrase.notes}')
+        if phrase.source is not None:
+            self.fragments.append(f'<br>Source: {phrase.source}')
+        if phrase.glosses is not None:
+            self._glosses(phrase.glosses)
+        if phrase.glosses_msa is not None:
+            self._glosses(phrase.glosses_msa, digits_map)
+        if i + 1 < n_phrases:
+            self.fragments.append('</p>')
+
+    def examples(self, examples):
+        self.fragments.append(self.SECTION('Examples'))
+        self.fragments.extend(f'{example} •<br>' for example in examples)
+
+    def end_entry(self, entry):
+        self.fragments.append('</body>')
+
+
+class TextRenderer(Renderer):
+    LINE = '{}{}\n'.format
+
+    def _line(self, text, indent=0):
+        self.fragments.append(self.LINE('  ' * indent, text))
+
+    @staticmethod
+    def _glosses(glosses):
+        return '; '.join(f'{i}. {g.strip()}' for i, g in enumerate(glosses, start=1))
+
+    def inflection(self, i, inflection):
+        line = f'{inflection.form} /{inflection.ipa}/'
+        if i == 0:
+            line += f' {inflection.pos.upper()}'
+        if inflection.feats:
+            line += f' [{FEAT2FANCY.get(inflection.feats, inflection.feats)}]'
+        self._line(line)
+        if inflection.notes is not None:
+            self._line(f'notes: {inflection.notes}', indent=1)
+
+    def paradigm(self, j, paradigm, inflection):
+        indent = 2 if j else 1
+        if j:
+            self._line(f'~ {paradigm.form}', indent=1)
+            if paradigm.notes is not None:
+                self._line(f'notes: {paradigm.notes}', indent=indent)
+        if paradigm.ipa is not None and paradigm.ipa != inflection.ipa:
+            self._line(f'/{paradigm.ipa}/', indent=indent)
+        if paradigm.source is not None:
+            self._line(f'src: {paradigm.source}', indent=indent)
+        if paradigm.glosses_msa is not None:
+            self._line(f'msa: {self._glosses(paradigm.glosses_msa)}', indent=indent)
+        if paradigm.glosses is not None:
+            self._line(self._glosses(paradigm.glosses), indent=indent)
+
+    def phrase(self, i, phrase, n_phrases):
+        self._line(f'ph. {phrase.form} /{phrase.ipa}/', indent=1)
+        if phrase.notes is not None:
+            self._line(f'notes: {phrase.notes}', indent=2)
+        if phrase.source is not None:
+            self._line(f'src: {phrase.source}', indent=2)
+        if phrase.glosses_msa is not None:
+            self._line(f'msa: {self._glosses(phrase.glosses_msa)}', indent=2)
+        if phrase.glosses is not None:
+            self._line(self._glosses(phrase.glosses), indent=2)
+
+    def examples(self, examples):
+        for example in examples:
+            self._line(f'ex. {example}', indent=1)
+
+    def end_entry(self, entry):
+        self.fragments.append('\n')
+
 
 def get_ipa(caphis):
-    ipa = []
-    for caphi in set(caphis):
-        assert not (',' in caphi and '#' in caphi)
-        ipa.append([])
-        for caphi_sub in CAPHI_DELIM_RE.split(caphi):
-            ipa[-1].append([])
-            caphi_sub = caphi_sub.strip().split()
-            ored_char_indexes = [i for i, c in enumerate(caphi_sub) if '||' in c]
-            if len(ored_char_indexes) >= 1:
-                if len(set([caphi_sub[i] for i in ored_char_indexes])) == 1:
-                    pass
-                else:
-                    raise NotImplementedError
-            if ored_char_indexes:
-                caphi_subs = []
-                for c in caphi_sub[ored_char_indexes[0]].split('||'):
-                    caphi_subs.append(get_sub_ipa(
-                        ''.join(
-                            ''.join(caphi_sub[(ored_char_indexes[i - 1] if i > 0 else 0):or_index] + [c] +
-                                    caphi_sub[or_index + 1: (ored_char_indexes[i + 1] if i + 1 < len(ored_char_indexes) else 100)])
-                            for i, or_index in enumerate(ored_char_indexes))))
-                ipa[-1][-1] = ', '.join(caphi_subs)
-            else:
-                ipa[-1][-1] = get_sub_ipa(caphi_sub)
-        ipa[-1] = f"{', ' if ',' in caphi else ' '}".join(ipa[-1])
-    
-    return ', '.join(ipa)
+    return ', '.join(caphipp2ipa(caphi) for caphi in dict.fromkeys(caphis))
 
 
-def generate_entry(form2rows, phrases, tipa=False):
+# Builds the in-memory model of a lemma entry, its inflections, paradigms, phrases and examples
+def build_entry(form2rows, phrases):
     index = 1
     examples = []
     entry_class = Entry()
@@ -343,9 +423,7 @@ def generate_entry(form2rows, phrases, tipa=False):
     msa_lemma = GLOSS_DELIM_RE.split(form2rows[0][1][0]['GLOSS_MSA'].replace('_[auto]', '').replace('_', ' '))
     used_notes = set()
     for i_form, (_, rows) in enumerate(form2rows):
-        inflection = SubEntry(feats='')
-        inflection.id = rows[0]['ID']
-        inflection.form = rows[0]['FORM']
+        inflection = SubEntry(id=rows[0]['ID'], feats='', form=rows[0]['FORM'])
         if rows[0]['NOTES'] and NOTES_RE.search(rows[0]['NOTES']):
             used_notes.add(rows[0]['NOTES'])
             inflection.notes = rows[0]['NOTES'].replace('_', ' ').capitalize()
@@ -385,13 +463,13 @@ def generate_entry(form2rows, phrases, tipa=False):
                     inflection_.source = source
 
                 if row['GLOSS_MSA']:
-                    msa_glosses = [x for x in GLOSS_DELIM_RE.split(QUOTES.sub(r'»\1«', row['GLOSS_MSA'].replace('_', ' ')))
-                                   if i_form == 0 or x not in msa_lemma]
+                    msa_glosses = tuple(x for x in GLOSS_DELIM_RE.split(QUOTES.sub(r'»\1«', row['GLOSS_MSA'].replace('_', ' ')))
+                                   if i_form == 0 or x not in msa_lemma)
                     if msa_glosses:
                         inflection_.glosses_msa = msa_glosses
                 
-                glosses = [x for x in GLOSS_DELIM_RE.split(row['GLOSS'].replace('_[auto]', '').replace('_', ' '))
-                           if i_form == 0 or x not in gloss_lemma]
+                glosses = tuple(x for x in GLOSS_DELIM_RE.split(row['GLOSS'].replace('_[auto]', '').replace('_', ' '))
+                           if i_form == 0 or x not in gloss_lemma)
                 if glosses:
                     inflection_.glosses = glosses
                 
@@ -400,12 +478,12 @@ def generate_entry(form2rows, phrases, tipa=False):
                     if examples_:
                         for example_ in examples_:
                             index += 1
-                            examples.append(example_)
+                            examples.append(sys.intern(example_))
                 
                 paradigms.append(inflection_)
             
             if len(paradigms) > 1:
-                inflection.paradigms = paradigms[1:]
+                inflection.paradigms = tuple(paradigms[1:])
             
         entry_class.inflections.append(inflection)
 
@@ -425,13 +503,13 @@ def generate_entry(form2rows, phrases, tipa=False):
                     phrase.source = source
                 
                 if row['GLOSS_MSA']:
-                    msa_glosses = [x for x in GLOSS_DELIM_RE.split(QUOTES.sub(r'»\1«', row['GLOSS_MSA'].replace('_', ' ')))
-                                   if i_form == 0 or x not in msa_lemma]
+                    msa_glosses = tuple(x for x in GLOSS_DELIM_RE.split(QUOTES.sub(r'»\1«', row['GLOSS_MSA'].replace('_', ' ')))
+                                   if i_form == 0 or x not in msa_lemma)
                     if msa_glosses:
                         phrase.glosses_msa = msa_glosses
                     
-                glosses = [x for x in GLOSS_DELIM_RE.split(row['GLOSS'].replace('_[auto]', '').replace('_', ' '))
-                           if i_form == 0 or x not in gloss_lemma]
+                glosses = tuple(x for x in GLOSS_DELIM_RE.split(row['GLOSS'].replace('_[auto]', '').replace('_', ' '))
+                           if i_form == 0 or x not in gloss_lemma)
                 if glosses:
                     phrase.glosses = glosses
                 
@@ -440,19 +518,31 @@ def generate_entry(form2rows, phrases, tipa=False):
                     if examples_:
                         for example_ in examples_:
                             index += 1
-                            examples.append(example_)
+                            examples.append(sys.intern(example_))
 
                 entry_class.phrases.append(phrase)
 
     if examples:
-        entry_class.examples = examples
+        entry_class.examples = tuple(examples)
     
+    return entry_class
+
+
+# Returns the TeX of an entry, its flashcard inflections and base lemma ID being added to the
+# accumulators of the section (and its plain text if `section_text` is not None)
+def generate_entry(form2rows, phrases, base_lemma_ids, id2inflections, section_text=None, tipa=False):
+    entry_class = build_entry(form2rows, phrases)
     base_lemma_id = entry_class.inflections[0].id
     base_lemma_ids.add(base_lemma_id)
-    entry = entry_class.generate_root_entry_latex_str()
-    id2inflections[base_lemma_id] = entry_class.generate_flashcard_inflections_html_str()
+    renderers = [TexRenderer(tipa), HtmlRenderer()]
+    if section_text is not None:
+        renderers.append(TextRenderer())
+    tex, html, *text = entry_class.render(*renderers)
+    id2inflections[base_lemma_id] = ''.join(html)
+    if text:
+        section_text.extend(text[0])
     
-    return entry
+    return tex
 
 
 def sort_inflections(form2rows, pos):
@@ -465,9 +555,181 @@ def sort_inflections(form2rows, pos):
     form2rows_ = sorted(form2rows_,
         key=lambda form_feat_rows: FEATS_ORDER.get(form_feat_rows[0][1], 10))
     return form2rows_
+
+
+def init_worker(caphi2ipa_):
+    set_caphi2ipa(caphi2ipa_)
+
+
+# Letters are independent from each other so this can run in a separate process; the
+# flashcard inflections generated along the way are returned to be merged by the caller.
+# Yields the TeX of a letter section as string fragments, in file order
+def iter_letter_section_latex(first_radical, root2lemmapos2type2form2rows, errors, base_lemma_ids, id2inflections,
+                              section_text=None, tipa=False):
+    yield begin_document + '\n'
+    yield f"\\begin{{figure*}}[t!]\\centering\\includegraphics[width=0.15\\linewidth]{{letter_images/{first_radical}.png}}\\end{{figure*}}\n"
+    yield "\\color{white}\n"
+    section = f"\\section*{{\\foreignlanguage{{arabic}}{{{first_radical}}}}}" if first_radical != 'N' else "\\section*{NTWS}"
+    yield f"\n {section} \n \\begin{{multicols}}{{2}} \n\n"
+    yield f"\\addcontentsline{{toc}}{{section}}{{\\protect\\numberline{{}}\\foreignlanguage{{arabic}}{{{first_radical}}}}}%\n"
+    yield "\\color{black}\n"
+    root2lemmapos2type2form2rows = dict(sorted(root2lemmapos2type2form2rows.items(), key=lambda x: x[0]))
+    for (root, ntws), lemmapos2type2form2rows in root2lemmapos2type2form2rows.items():
+        root_ = f"\\color{{blue}}\\foreignlanguage{{arabic}}{{{root}}}\\color{{blue}}{{{ntws if ntws else ''}}}"
+        yield '\\vspace{-3mm}\n'
+        yield f"\\markboth{{{root_}}}{{{root_}}}\\subsection*{{{root_}\\index{{{root_}}}}} \n\n"
+        lemmapos2type2form2rows = dict(sorted(lemmapos2type2form2rows.items(), key=lambda x: x[0]))
+        for (lemma, pos), type2form2rows in lemmapos2type2form2rows.items():
+            form2rows = type2form2rows['other']
+            if not form2rows:
+                errors.append(form2rows)
+                continue
+            form2rows_ = []
+            form2rows_ += [(form, rows) for form, rows in form2rows.items() if form == lemma]
+            form2rows_ += [(form, rows) for form, rows in form2rows.items() if form != lemma]
+            form2rows_ = sort_inflections(form2rows_, pos)
+            yield from generate_entry(form2rows_, type2form2rows['phrases'], base_lemma_ids, id2inflections, section_text, tipa)
+            yield '\n\n'
+    yield "\\end{multicols}\n"
+    yield end_document + '\n'
+
+
+def generate_letter_section(first_radical, root2lemmapos2type2form2rows, save_dir, profile=False, plain_text=False, tipa=False):
+    base_lemma_ids, id2inflections = set(), {}
+    section_text = [] if plain_text else None
+    errors = []
+    ipa_cache_stats = IPA_CACHE.stats()
+    too_many_alternatives = caphi.transducer.too_many_alternatives
+    if profile:
+        tracemalloc.start()
+        start = time.perf_counter()
+    fragments = iter_letter_section_latex(first_radical, root2lemmapos2type2form2rows, errors,
+                                          base_lemma_ids, id2inflections, section_text, tipa)
+    with open(os.path.join(save_dir, f'{first_radical}.tex'), 'w', buffering=WRITE_BUFFER_SIZE) as f:
+        f.writelines(fragments)
+    if plain_text:
+        with open(os.path.join(save_dir, f'{first_radical}.txt'), 'w', buffering=WRITE_BUFFER_SIZE) as f:
+            f.writelines(section_text)
+    anki_path = os.path.join(save_dir, f'{first_radical}.anki.csv')
+    save_anki_fragment(anki_path, id2inflections)
+    if profile:
+        profile = {'seconds': time.perf_counter() - start,
+                   'peak_mb': tracemalloc.get_traced_memory()[1] / 2**20}
+        tracemalloc.stop()
+
+    return {'first_radical': first_radical,
+            'base_lemma_ids': base_lemma_ids,
+            'id2inflections': id2inflections,
+            'anki': anki_path,
+            'errors': errors,
+            'ipa_cache': {k: IPA_CACHE.stats()[k] - ipa_cache_stats[k] for k in ['hits', 'misses']},
+            'too_many_alternatives': caphi.transducer.too_many_alternatives - too_many_alternatives,
+            'profile': profile or None}
     
 
 
+# Builds the first radical -> root -> (lemma, pos) -> phrases/other -> (form, feats) -> rows
+# index with a single sort and group-by over precomputed key columns.
+def group_lexicon(pacl):
+    ntws = (pacl['ROOT'] == 'NTWS').to_numpy()
+    analysis = pacl['ANALYSIS'].str.split(':')
+    keys = pd.DataFrame({
+        'ROOT': np.where(ntws, pacl.get('ROOT_NTWS', pacl['ROOT']), pacl['ROOT']),
+        'NTWS': np.where(ntws, ' (ntws)', ''),
+        'LEMMA': pacl['LEMMA'].to_numpy(),
+        'POS': analysis.str[0].str.strip().to_numpy(),
+        'TYPE': np.where(pacl['ANALYSIS'].str.contains('PHRASE', regex=False), 'phrases', 'other'),
+        'FORM': pacl['FORM'].to_numpy(),
+        'FEATS': analysis.str[1].to_numpy()}, index=np.arange(len(pacl.index)))
+    keys.insert(0, 'FIRST_RADICAL', keys['ROOT'].str[0])
+    # The sort is stable so that forms keep their order of appearance within a (lemma, pos)
+    keys = keys.sort_values(['FIRST_RADICAL', 'ROOT', 'NTWS', 'LEMMA', 'POS'], kind='stable')
+    group_ids = keys.groupby(list(keys.columns), sort=False, dropna=False).ngroup().to_numpy()
+
+    order = np.argsort(group_ids, kind='stable')
+    group_ids, positions = group_ids[order], keys.index.to_numpy()[order]
+    starts = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+
+    columns = list(pacl.columns)
+    records = [dict(zip(columns, row)) for row in pacl.itertuples(index=False, name=None)]
+    first_radical2root2lemmapos2type2form2rows = {}
+    for (first_radical, root, ntws, lemma, pos, type_, form, feats), start, end in zip(
+            keys.iloc[order[starts]].itertuples(index=False, name=None), starts, ends):
+        first_radical2root2lemmapos2type2form2rows.setdefault(
+            first_radical, {}).setdefault(
+                (root, ntws), {}).setdefault(
+                    (lemma, pos), {'phrases': {}, 'other': {}})[type_][
+                        (form, feats if isinstance(feats, str) else None)] = [records[i] for i in positions[start:end]]
+
+    return first_radical2root2lemmapos2type2form2rows
+
+
+def _hash(obj):
+    return hashlib.md5(repr(obj).encode('utf-8')).hexdigest()
+
+
+def get_section_hashes(root2lemmapos2type2form2rows):
+    # Roots are sorted before rendering, so only the order of the rows within a root matters
+    root2hash = {f'{root}{ntws}': _hash(lemmapos2type2form2rows)
+                 for (root, ntws), lemmapos2type2form2rows in root2lemmapos2type2form2rows.items()}
+    return _hash(sorted(root2hash.items())), root2hash
+
+
+# Flashcard inflections (HTML) of the base lemmas of a section, kept next to its TeX so that the
+# Anki CSV can be assembled without rendering the sections which did not change
+def save_anki_fragment(path, id2inflections):
+    pd.DataFrame({'ID': list(id2inflections), 'INFLECTIONS': list(id2inflections.values())}).to_csv(path, index=False)
+
+
+def load_anki_fragment(path):
+    fragment = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return dict(zip(fragment['ID'], fragment['INFLECTIONS']))
+
+
+# Anything besides the input rows that changes the output of all the sections: the renderer,
+# the CAPHI table (pronunciations) and the render options
+def get_build_key(caphi2ipa, options):
+    return _hash((RENDER_VERSION, sorted(caphi2ipa.items()), sorted(options.items())))
+
+
+def load_build_manifest(path, build_key):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('key') != build_key:
+        return {}
+    return manifest['letters']
+
+
+# Sections which were not part of the run (e.g., with -test) are kept as they were
+def save_build_manifest(path, build_key, results, first_radical2hashes, kept_letters=None):
+    letters = dict(kept_letters or {})
+    for result in results:
+        first_radical = result['first_radical']
+        letter_hash, root2hash = first_radical2hashes[first_radical]
+        letters[first_radical] = {
+            'hash': letter_hash,
+            'roots': root2hash,
+            'anki': result['anki']}
+    manifest = {'key': build_key, 'letters': dict(sorted(letters.items()))}
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(f'{path}.tmp', path)
+
+
+def report_dirty_sections(dirty_letters, first_radical2hashes, manifest, total):
+    print(f'{len(dirty_letters)}/{total} sections to regenerate')
+    for first_radical, _ in dirty_letters:
+        root2hash = first_radical2hashes[first_radical][1]
+        root2hash_old = manifest.get(first_radical, {}).get('roots', {})
+        changed = [root for root, hash_ in root2hash.items() if root2hash_old.get(root) != hash_]
+        deleted = [root for root in root2hash_old if root not in root2hash]
+        print(f'\t{first_radical}: {len(changed)} new or edited root(s), {len(deleted)} deleted root(s)'
+              + (f" ({' '.join(changed[:10])}{' ...' if len(changed) > 10 else ''})" if changed else ''))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-test", default=False,
@@ -480,98 +742,115 @@ if __name__ == "__main__":
                         type=str, help="Path of the JSON file containing the information about the service account used for the Google API.")
     parser.add_argument("-sheet", default='', nargs=2,
                         type=str, help="Spreadsheet and sheet (2 args) to download holding the tabular format of Maknuune.")
+    parser.add_argument("-refresh", default=False,
+                        action='store_true', help="Download the sheet even if the local snapshot of it is up to date.")
+    parser.add_argument("-jobs", default=1,
+                        type=int, help="Number of processes used to generate the letter sections in parallel.")
+    parser.add_argument("-manifest", default='',
+                        type=str, help="Path of the build manifest used to only regenerate the sections whose input rows changed (defaults to <save_dir>/build_manifest.json).")
+    parser.add_argument("-force", default=False,
+                        action='store_true', help="Regenerate all sections regardless of the build manifest.")
+    parser.add_argument("-anki", default='data_release/maknuune-v1.0.2/maknuune-v1.0.2-anki.csv',
+                        type=str, help="Path of the Anki flashcards CSV.")
+    parser.add_argument("-profile", default=False,
+                        action='store_true', help="Report wall time and peak memory of each generated section.")
+    parser.add_argument("-plain_text", default=False,
+                        action='store_true', help="Also write a plain text version of each generated section.")
+    parser.add_argument("-tipa", default=False,
+                        action='store_true', help="Write the IPA of the TeX sections with TIPA rather than in a sans serif font.")
     args = parser.parse_args()
-    caphi_inventory = pd.read_csv('caphi_table_full.tsv', sep='\t')
-    caphi2ipa = {}
-    for _, row in caphi_inventory.iterrows():
-        caphi2ipa[row['CAPHI']] = row['IPA']
-    
-    CAPHI_SPECIAL_CHARS_MAP = {
-        'Q': {'caphi':['q', 'k', '2', 'g'], 'tipa++': '(q)', 'ipa': '(q)'},
-        'D': {'caphi':['dh', 'd'], 'tipa++': '(d)', 'ipa': '(d)'},
-        'J': {'caphi':['j', 'dj'], 'tipa++': '(\\t{dZ})', 'ipa': f"({caphi2ipa['dj']})"},
-        'Z': {'caphi':['z', 'dh'], 'tipa++': '(D)', 'ipa': f"({caphi2ipa['dh']})"},
-        'T': {'caphi':['t', 'th'], 'tipa++': '(t)', 'ipa': '(t)'},
-        'S': {'caphi':['s', 'th'], 'tipa++': '(T)', 'ipa': f"({caphi2ipa['th']})"},
-        'Z.': {'caphi':['z.', 'dh.'], 'tipa++': '(D\\super Q)', 'ipa': f"({caphi2ipa['dh.']})"},
-        'D.': {'caphi':['d.', 'dh.'], 'tipa++': '(d\\super Q)', 'ipa': f"({caphi2ipa['d.']})"},
-        'K': {'caphi':['k', 'tsh'], 'tipa++': '(k)', 'ipa': '(k)'}
-    }
-    caphi2ipa = {**caphi2ipa, **{k: v['ipa'] for k, v in CAPHI_SPECIAL_CHARS_MAP.items()}}
+    caphi2ipa = load_caphi2ipa()
 
     if args.service_account:
-        sa = gspread.service_account(args.service_account)
+        sa = sheets_client.service_account(args.service_account)
         sh = sa.open(args.sheet[0])
-        sheet = sh.worksheet(args.sheet[1])
-        pacl = pd.DataFrame(sheet.get_all_records()).astype(str)
+        pacl = utils.read_sheet_as_df(sh, args.sheet[1], refresh=args.refresh)
     else:
-        pacl = pd.read_csv(args.maknuune_tabular).astype(str)
-    
-    pacl_obj = pacl.select_dtypes(['object'])
-    pacl[pacl_obj.columns] = pacl_obj.apply(lambda x: x.str.strip())
-    pacl = pacl.replace(nan, '', regex=True)
+        pacl = utils.normalize_sheet_df(pd.read_csv(args.maknuune_tabular))
     pacl['CAPHI++'] = pacl.apply(lambda row: re.sub(r'II', '||', row['CAPHI++']), axis=1)
     pacl = pacl.replace('\"', '', regex=True)
     pacl = pacl.replace('%', '\\%', regex=True)
 
-    first_radical2root2lemmapos2type2form2rows = {}
-    for _, row in pacl.iterrows():
-        ntws = True if row['ROOT'] == 'NTWS' else False
-        root = row['ROOT'] if not ntws else row['ROOT_NTWS']
-        lemmapos_rows = first_radical2root2lemmapos2type2form2rows.setdefault(
-            root[0], {}).setdefault(
-                (root, ' (ntws)' if row['ROOT'] == 'NTWS' else ''), {}).setdefault(
-                    (row['LEMMA'], row['ANALYSIS'].split(':')[0].strip()), {'phrases': {}, 'other': {}})
-        
-        feats = row['ANALYSIS'].split(':')[1] if ':' in row['ANALYSIS'] else None
-        lemmapos_rows['phrases' if 'PHRASE' in row['ANALYSIS'] else 'other'].setdefault(
-            (row['FORM'], feats), []).append(row.to_dict())
-
+    first_radical2root2lemmapos2type2form2rows = group_lexicon(pacl)
     first_radical2root2lemmapos2type2form2rows = dict(sorted(first_radical2root2lemmapos2type2form2rows.items(), key=lambda x: x[0]))
 
+    letters = [(first_radical, root2lemmapos2type2form2rows)
+               for first_radical, root2lemmapos2type2form2rows in first_radical2root2lemmapos2type2form2rows.items()
+               if not args.test or first_radical in 'ء']
+
+    manifest_path = args.manifest if args.manifest else os.path.join(args.save_dir, 'build_manifest.json')
+    build_key = get_build_key(caphi2ipa, {'plain_text': args.plain_text, 'tipa': args.tipa})
+    manifest = load_build_manifest(manifest_path, build_key)
+    first_radical2hashes = {first_radical: get_section_hashes(root2lemmapos2type2form2rows)
+                            for first_radical, root2lemmapos2type2form2rows in letters}
+    dirty_letters = [(first_radical, root2lemmapos2type2form2rows)
+                     for first_radical, root2lemmapos2type2form2rows in letters
+                     if args.force or
+                        first_radical not in manifest or
+                        manifest[first_radical]['hash'] != first_radical2hashes[first_radical][0] or
+                        not os.path.exists(os.path.join(args.save_dir, f'{first_radical}.tex')) or
+                        (args.plain_text and not os.path.exists(os.path.join(args.save_dir, f'{first_radical}.txt'))) or
+                        not os.path.exists(manifest[first_radical]['anki'])]
+    report_dirty_sections(dirty_letters, first_radical2hashes, manifest, len(letters))
+
+    if args.jobs > 1 and len(dirty_letters) > 1:
+        # Submit the biggest letters first so that they do not end up being the tail of the pool
+        with ProcessPoolExecutor(max_workers=args.jobs,
+                                 initializer=init_worker,
+                                 initargs=(caphi2ipa,)) as executor:
+            futures = {first_radical: executor.submit(generate_letter_section, first_radical,
+                                                      root2lemmapos2type2form2rows, args.save_dir, args.profile, args.plain_text, args.tipa)
+                       for first_radical, root2lemmapos2type2form2rows in sorted(
+                           dirty_letters, key=lambda x: -sum(len(v) for v in x[1].values()))}
+            first_radical2result = {first_radical: future.result() for first_radical, future in futures.items()}
+    else:
+        first_radical2result = {first_radical: generate_letter_section(first_radical, root2lemmapos2type2form2rows, args.save_dir, args.profile, args.plain_text, args.tipa)
+                                for first_radical, root2lemmapos2type2form2rows in dirty_letters}
+
+    # Sections which did not change are not rendered again, their flashcards come from their Anki fragment
+    for first_radical, _ in letters:
+        if first_radical not in first_radical2result:
+            id2inflections = load_anki_fragment(manifest[first_radical]['anki'])
+            first_radical2result[first_radical] = {
+                'first_radical': first_radical,
+                'base_lemma_ids': set(id2inflections),
+                'id2inflections': id2inflections,
+                'anki': manifest[first_radical]['anki'],
+                'errors': [],
+                'ipa_cache': {'hits': 0, 'misses': 0},
+                'too_many_alternatives': 0,
+                'profile': None}
+    # Merge in letter order so that the output is identical to a serial run
+    results = [first_radical2result[first_radical] for first_radical, _ in letters]
+    kept_letters = {first_radical: entry for first_radical, entry in manifest.items()
+                    if first_radical in first_radical2root2lemmapos2type2form2rows and first_radical not in first_radical2result}
+    save_build_manifest(manifest_path, build_key, results, first_radical2hashes, kept_letters)
+
     errors = []
     base_lemma_ids = set()
     id2inflections = {}
-    
-    for first_radical, root2lemmapos2type2form2rows in first_radical2root2lemmapos2type2form2rows.items():
-        with open(os.path.join(args.save_dir, f'{first_radical}.tex'), 'w') as f:
-            if args.test and first_radical not in 'ء':
-                continue
-            print(begin_document, file=f)
-            print(f"\\begin{{figure*}}[t!]\\centering\\includegraphics[width=0.15\\linewidth]{{letter_images/{first_radical}.png}}\\end{{figure*}}", file=f)
-            print(f"\\color{{white}}", file=f)
-            print('\n', f"\\section*{{\\foreignlanguage{{arabic}}{{{first_radical}}}}}" if first_radical != 'N' else f"\\section*{{NTWS}}", '\n', f"\\begin{{multicols}}{{2}}", '\n', file=f)
-            print(f"\\addcontentsline{{toc}}{{section}}{{\\protect\\numberline{{}}\\foreignlanguage{{arabic}}{{{first_radical}}}}}%", file=f)
-            print(f"\\color{{black}}", file=f)
-            root2lemmapos2type2form2rows = dict(sorted(root2lemmapos2type2form2rows.items(), key=lambda x: x[0]))
-            for (root, ntws), lemmapos2type2form2rows in root2lemmapos2type2form2rows.items():
-                if root == 'NTWS':
-                    raise NotImplementedError
-                if root != 'NTWS':
-                    root_ = f"\\color{{blue}}\\foreignlanguage{{arabic}}{{{root}}}\\color{{blue}}{{{ntws if ntws else ''}}}"
-                    print('\\vspace{-3mm}', file=f)
-                    print(f"\\markboth{{{root_}}}{{{root_}}}\\subsection*{{{root_}\\index{{{root_}}}}}", '\n', file=f)
-                lemmapos2type2form2rows = dict(sorted(lemmapos2type2form2rows.items(), key=lambda x: x[0]))
-                for (lemma, pos), type2form2rows in lemmapos2type2form2rows.items():
-                    form2rows = type2form2rows['other']
-                    if not form2rows:
-                        errors.append(form2rows)
-                        continue
-                    form2rows_ = []
-                    form2rows_ += [(form, rows) for form, rows in form2rows.items() if form == lemma]
-                    form2rows_ += [(form, rows) for form, rows in form2rows.items() if form != lemma]
-                    form2rows_ = sort_inflections(form2rows_, pos)
-                    lemma_entry = generate_entry(form2rows_, type2form2rows['phrases'])
-                    print(lemma_entry, file=f)
-                    print(file=f)
-            print(f"\\end{{multicols}}", file=f)
-            print(end_document, file=f)
-
-    pacl['INFLECTIONS'] = ''
-    for i, row in pacl.iterrows():
-        if row['ID'] in base_lemma_ids:
-            pacl.loc[i, 'INFLECTIONS'] = id2inflections[row['ID']]
-    pacl.to_csv('data_release/maknuune-v1.0.2/maknuune-v1.0.2-anki.csv')
+    for result in results:
+        errors += result['errors']
+        base_lemma_ids |= result['base_lemma_ids']
+        id2inflections.update(result['id2inflections'])
+    ipa_cache_hits = sum(result['ipa_cache']['hits'] for result in results)
+    ipa_cache_misses = sum(result['ipa_cache']['misses'] for result in results)
+    print(f'CAPHI++ conversion cache: {ipa_cache_hits} hits, {ipa_cache_misses} misses')
+    too_many_alternatives = sum(result['too_many_alternatives'] for result in results)
+    if too_many_alternatives:
+        print(f'CAPHI++ transcriptions truncated to their first {caphi.transducer.max_expansions} '
+              f'alternatives: {too_many_alternatives}')
+    if args.profile:
+        for result in results:
+            if result['profile'] is not None:
+                print(f"{result['first_radical']}: {result['profile']['seconds']:.2f}s, "
+                      f"peak {result['profile']['peak_mb']:.1f} MB")
+
+    pacl['INFLECTIONS'] = pacl['ID'].map(id2inflections).fillna('')
+    if os.path.dirname(args.anki):
+        os.makedirs(os.path.dirname(args.anki), exist_ok=True)
+    with open(args.anki, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+        pacl.to_csv(f, chunksize=ANKI_CHUNK_SIZE)
 
 
     pass
\ No newline at end of file
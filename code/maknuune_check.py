@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import utils
+import well_formedness
+from root_matcher import RootMatcher
+from well_formedness import LexiconIndex, normalize_lemmas, root_inventory, run_checks, run_checks_incremental
+
+RULE_GROUPS = ['root', 'caphi', 'diacritics', 'aspect_paradigm', 'nom_paradigm', 'lemma_form',
+               'duplicates', 'near_duplicates']
+REPORT_COLUMNS = ['index', 'ID', 'LEMMA', 'FORM', 'code', 'detail', 'severity']
+# Malformed cells, which make the exit code nonzero. The other rules (uncertain spellings, roots missing from
+# MSA, empty cells, incomplete paradigms, duplicates) flag rows to review and are reported as warnings.
+ERROR_CODES = {'root-invalid', 'faulty-analysis', 'caphi-invalid-char', 'caphi-invalid-seq',
+               'caphi-too-many-alternatives', 'lemma-missing', 'form-missing', 'consecutive-diacritics'}
+
+
+def read_lexicon(path):
+    if path.endswith('.parquet'):
+        lexicon = pd.read_parquet(path)
+    else:
+        lexicon = pd.read_csv(path, sep='\t' if path.endswith('.tsv') else ',',
+                              dtype=str, keep_default_na=False)
+    # Same frame as the one read from the sheet by well_formedness.py
+    lexicon = utils.normalize_sheet_df(lexicon, strip=False).reset_index(drop=True)
+    lexicon['LEMMA_NORM'] = normalize_lemmas(lexicon['LEMMA'])
+    return lexicon
+
+
+# Diacritization codes are prefixed with the column they were found in (form: or lemma:)
+def get_severity(code):
+    return 'error' if code.split(':')[-1] in ERROR_CODES else 'warning'
+
+
+# One record per (row, code), in the order of the rows, then of the STATUS messages. Root/lemma mismatches
+# come with the candidate roots of the lemma if a `root_matcher` is given.
+def build_report(lexicon, checks, hits, root_matcher=None):
+    records = []
+    rows, cols = np.nonzero(checks.values)
+    for i, j in zip(rows, cols):
+        code = checks.columns[j]
+        detail = ''
+        if root_matcher is not None and code == 'possible-root-lemma-mismatch':
+            detail = ' '.join(root_matcher.candidates(lexicon['LEMMA_NORM'].iloc[i]))
+        records.append((i, code, detail))
+    for index, code in hits:
+        code, detail = code.split(':', 1)
+        records.append((index, code, detail))
+    records.sort(key=lambda record: record[0])
+
+    columns = {c: lexicon[c].values if c in lexicon.columns else None for c in ['ID', 'LEMMA', 'FORM']}
+    return [{'index': int(i),
+             **{c: values[i] for c, values in columns.items() if values is not None},
+             'code': code,
+             'detail': detail,
+             'severity': get_severity(code)} for i, code, detail in records]
+
+
+def write_report(report, path, report_format):
+    f = open(path, 'w') if path != '-' else sys.stdout
+    try:
+        if report_format == 'jsonl':
+            for record in report:
+                print(json.dumps(record, ensure_ascii=False), file=f)
+        else:
+            report = pd.DataFrame(report, columns=[c for c in REPORT_COLUMNS
+                                                   if not report or c in report[0]])
+            report.to_csv(f, sep='\t', index=False)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the well-formedness rules over a local copy of the lexicon.")
+    parser.add_argument("-lexicon", required=True,
+                        type=str, help="Path of the lexicon (CSV, TSV or Parquet).")
+    parser.add_argument("-msa_roots", default='',
+                        type=str, help="Path of the MSA roots table (CSV with a ROOT column) or of a morphology index built by morph_index.py, required by the root rules.")
+    parser.add_argument("-caphi_table", default=well_formedness.CAPHI_TABLE_PATH,
+                        type=str, help="Path of the CAPHI table used by the CAPHI++ rules.")
+    parser.add_argument("-report", default='-',
+                        type=str, help="Path of the report (standard output by default).")
+    parser.add_argument("-format", default='', choices=['', 'jsonl', 'tsv'],
+                        type=str, help="Format of the report (deduced from its extension by default, else JSONL).")
+    parser.add_argument("-skip", default=[], nargs='+', choices=RULE_GROUPS,
+                        help="Rules not to run.")
+    parser.add_argument("-fingerprints", default='',
+                        type=str, help="Path of a fingerprint store, to only check again the rows which changed since the last run.")
+    parser.add_argument("-strict", default=False,
+                        action='store_true', help="Also exit with a nonzero code when only warnings are found.")
+    args = parser.parse_args()
+
+    if 'root' not in args.skip and not args.msa_roots:
+        parser.error('-msa_roots is required unless the root rules are skipped (-skip root)')
+    report_format = args.format or ('tsv' if args.report.endswith('.tsv') else 'jsonl')
+
+    start = time.perf_counter()
+    well_formedness.load_resources(args.msa_roots, args.caphi_table if 'caphi' not in args.skip else None,
+                                   roots=None if args.msa_roots else ())
+    lexicon = read_lexicon(args.lexicon)
+    rules = {group: False for group in args.skip}
+    if args.fingerprints:
+        checks, hits, (n_row, n_cross_row) = run_checks_incremental(lexicon, args.fingerprints, **rules)
+        print(f"{n_row} rows checked by the row rules, {n_cross_row} by the cross-row rules", file=sys.stderr)
+    else:
+        checks, hits = run_checks(lexicon, LexiconIndex(lexicon), **rules)
+    report = build_report(lexicon, checks, hits,
+                          RootMatcher(root_inventory(lexicon)) if 'root' not in args.skip else None)
+    if os.path.dirname(args.report):
+        os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    write_report(report, args.report, report_format)
+
+    errors = sum(record['severity'] == 'error' for record in report)
+    warnings = len(report) - errors
+    print(f"{len(lexicon.index)} rows checked in {time.perf_counter() - start:.2f}s: {errors} errors, "
+          f"{warnings} warnings, in {len({record['index'] for record in report})} rows", file=sys.stderr)
+    # Counted from the report rather than by the transducer, which only sees the rows checked again with -fingerprints
+    too_many_alternatives = sum(record['code'] == 'caphi-too-many-alternatives' for record in report)
+    if too_many_alternatives:
+        print(f"{too_many_alternatives} rows with a CAPHI++ transcription of more than "
+              f"{well_formedness.caphi_transducer.max_expansions} alternatives", file=sys.stderr)
+    sys.exit(1 if errors or (args.strict and warnings) else 0)
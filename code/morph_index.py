@@ -0,0 +1,196 @@
+import re
+import os
+import json
+import argparse
+from bisect import bisect_left
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from numpy import nan
+
+MAGIC = b'MKNIDX01'
+MORPH_INDEX_PATH = 'data/morph_index.bin'
+MSA_DB_PATH = '/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/camel_morph/eval_files/calima-msa-s31_0.4.2.utf8.db'
+EGY_DB_PATH = '/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/camel_morph/eval_files/calima-egy-c044_0.2.0.utf8.db'
+MSA_ROOTS_PATH = '/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/camel_morph/misc_files/Roots.csv'
+
+AR_DIACRITICS = re.compile(r'[ًٌٍَُِْ]')
+HAMZA_NORMALIZE_MAP = str.maketrans({'أ': 'ء', 'إ': 'ء', 'ؤ': 'ء', 'ئ': 'ء'})
+
+
+# Dediacritized (shadda kept) and hamza-normalized lemma, the key of the lemma/gloss index
+def normalize_lemma(lemma):
+    return AR_DIACRITICS.sub('', lemma).translate(HAMZA_NORMALIZE_MAP)
+
+
+def is_morph_index(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def pack_strings(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+class StringTable:
+    """Strings stored back to back in a UTF-8 buffer, the i-th one being `buffer[offsets[i]:offsets[i + 1]]`.
+    Only the strings which are accessed get decoded, and those of a sorted table are searched in place."""
+    def __init__(self, buffer, offsets) -> None:
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.buffer[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def find(self, text):
+        i = bisect_left(self, text)
+        return i if i < len(self) and self[i] == text else -1
+
+    def __contains__(self, text):
+        return self.find(text) >= 0
+
+
+class MorphIndex:
+    """Read-only view of an index file written by `build_index`, memory-mapped so that opening it does
+    not read it. The file holds named arrays after a JSON header giving their dtype, offset and length:
+
+    - `roots`: sorted MSA roots (radicals without dots, as in Roots.csv),
+    - `glosses`: sorted "<normalized lemma>\\t<pos>" keys of the MSA database, with the offsets (`glosses.keys`)
+      of their (lemma, gloss) entries (`glosses.lemmas` and `glosses.glosses`),
+    - `lex.<name>`: the (lex, pos) pairs of the analyses of a database, with their number of analyses.
+    """
+    def __init__(self, path=MORPH_INDEX_PATH) -> None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No morphology index at {path}, build it with: python code/morph_index.py -output {path}')
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path} is not a morphology index')
+        header_length = int(data[len(MAGIC):len(MAGIC) + 8].view('<u8')[0])
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(data[start:start + header_length]).decode('utf-8'))
+        start += header_length
+        self.sources = header['sources']
+        self.arrays = {name: data[start + offset:start + offset + length * np.dtype(dtype).itemsize].view(dtype)
+                       for name, (dtype, offset, length) in header['arrays'].items()}
+
+    def strings(self, name):
+        if f'{name}.offsets' not in self.arrays:
+            raise KeyError(f'{name} is not in the index, see the sources it was built from: {self.sources}')
+        return StringTable(self.arrays[f'{name}.buffer'], self.arrays[f'{name}.offsets'])
+
+    @property
+    def roots(self):
+        return self.strings('roots')
+
+    # CALIMA lemmas (mapped to their glosses) whose normalized form and POS are the given ones
+    def lemma_glosses(self, lemma_norm, pos):
+        i = self.strings('glosses').find(f'{lemma_norm}\t{pos}')
+        if i == -1:
+            return {}
+        lemma2glosses = {}
+        lemmas, glosses, offsets = self.strings('glosses.lemmas'), self.strings('glosses.glosses'), self.arrays['glosses.keys']
+        for j in range(offsets[i], offsets[i + 1]):
+            lemma2glosses.setdefault(lemmas[j], []).append(glosses[j])
+        return lemma2glosses
+
+    # (lex, pos) pairs of a database, each one as many times as it has analyses
+    def lex_pos(self, name):
+        lexes, poses = self.strings(f'lex.{name}.lex'), self.strings(f'lex.{name}.pos')
+        return [(lexes[i], poses[i]) for i, count in enumerate(self.arrays[f'lex.{name}.counts']) for _ in range(count)]
+
+
+def write_index(path, arrays, sources):
+    header, offset = {}, 0
+    for name, array in arrays.items():
+        header[name] = (array.dtype.str, offset, len(array))
+        offset += -(-array.nbytes // 8) * 8
+    header = json.dumps({'sources': sources, 'arrays': header}, ensure_ascii=False).encode('utf-8')
+    # Padded so that the arrays, whose offsets are relative to the end of the header, are aligned on 8 bytes
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % 8)
+    with open(f'{path}.tmp', 'wb') as f:
+        f.write(MAGIC + np.array([len(header)], dtype='<u8').tobytes() + header)
+        for array in arrays.values():
+            f.write(array.tobytes())
+            f.write(b'\0' * (-array.nbytes % 8))
+    os.replace(f'{path}.tmp', path)
+
+
+def _add_strings(arrays, name, strings):
+    arrays[f'{name}.buffer'], arrays[f'{name}.offsets'] = pack_strings(strings)
+
+
+def _load_db(path):
+    # camel_tools is only needed to build the sections of the databases
+    from camel_tools.morphology.database import MorphologyDB
+    return MorphologyDB(path, flags='g')
+
+
+def build_index(path, msa_db_path=None, egy_db_path=None, msa_roots_path=None):
+    """Writes the index of the MSA roots table and of the lemmas of the MSA and EGY morphological
+    databases, each section being only written if its source is given."""
+    arrays, sources = {}, {}
+    if msa_roots_path:
+        roots = pd.read_csv(msa_roots_path).replace(nan, '', regex=True)['ROOT']
+        _add_strings(arrays, 'roots', sorted(set(roots.values.tolist())))
+        sources['roots'] = msa_roots_path
+
+    db_msa = _load_db(msa_db_path) if msa_db_path else None
+    if db_msa is not None:
+        key2lemma2glosses = {}
+        for lemma, analyses in db_msa.lemma_hash.items():
+            for analysis in analyses:
+                key2lemma2glosses.setdefault(f"{normalize_lemma(lemma)}\t{analysis['pos']}", {}).setdefault(
+                    lemma, set()).add(analysis['gloss'])
+        keys = sorted(key2lemma2glosses)
+        entries = [(lemma, gloss) for key in keys for lemma, glosses in sorted(key2lemma2glosses[key].items())
+                   for gloss in sorted(glosses)]
+        _add_strings(arrays, 'glosses', keys)
+        arrays['glosses.keys'] = np.zeros(len(keys) + 1, dtype=np.int64)
+        arrays['glosses.keys'][1:] = np.cumsum([sum(len(glosses) for glosses in key2lemma2glosses[key].values())
+                                                for key in keys])
+        _add_strings(arrays, 'glosses.lemmas', [lemma for lemma, _ in entries])
+        _add_strings(arrays, 'glosses.glosses', [gloss for _, gloss in entries])
+        sources['glosses'] = msa_db_path
+
+    # Only the EGY analyses coming from CALIMA are evaluated against
+    db_egy = _load_db(egy_db_path) if egy_db_path else None
+    for name, db, db_path, keep in [('msa', db_msa, msa_db_path, lambda analysis: True),
+                                    ('egy', db_egy, egy_db_path, lambda analysis: analysis['gloss'].endswith('_[CALIMA]'))]:
+        if db is None:
+            continue
+        lexpos2count = Counter((analysis['lex'], analysis['pos']) for analyses in db.lemma_hash.values()
+                               for analysis in analyses if keep(analysis))
+        _add_strings(arrays, f'lex.{name}.lex', [lex for lex, _ in lexpos2count])
+        _add_strings(arrays, f'lex.{name}.pos', [pos for _, pos in lexpos2count])
+        arrays[f'lex.{name}.counts'] = np.array(list(lexpos2count.values()), dtype=np.uint32)
+        sources[f'lex.{name}'] = db_path
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_index(path, arrays, sources)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the index of the MSA roots and of the MSA and EGY lemmas used by well_formedness.py, msa_glosses.py and evaluation.py.")
+    parser.add_argument("-output", default=MORPH_INDEX_PATH,
+                        type=str, help="Path of the index.")
+    parser.add_argument("-msa_db", default=MSA_DB_PATH,
+                        type=str, help="Path of the CALIMA MSA morphological database (empty to skip it).")
+    parser.add_argument("-egy_db", default=EGY_DB_PATH,
+                        type=str, help="Path of the CALIMA EGY morphological database (empty to skip it).")
+    parser.add_argument("-msa_roots", default=MSA_ROOTS_PATH,
+                        type=str, help="Path of the MSA roots table (empty to skip it).")
+    args = parser.parse_args()
+
+    build_index(args.output, args.msa_db, args.egy_db, args.msa_roots)
+    print(f'Index written to {args.output} ({os.path.getsize(args.output) / 2**20:.1f} MB)')
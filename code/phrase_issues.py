@@ -7,11 +7,11 @@ from collections import Counter
 
 import pandas as pd
 from numpy import nan
-import gspread
 
 from camel_tools.utils.charmap import CharMapper
 
 import utils
+import sheets_client
 
 bw2ar = CharMapper.builtin_mapper('bw2ar')
 ar2bw = CharMapper.builtin_mapper('ar2bw')
@@ -69,7 +69,7 @@ def add_pos_to_phrase_lemmas_annot():
 
 
 def add_pos_to_phrase_lemmas_online():
-    sa = gspread.service_account("/Users/chriscay/.config/gspread/service_account.json")
+    sa = sheets_client.service_account("/Users/chriscay/.config/gspread/service_account.json")
     sh = sa.open('PACL-Letter-Split')
 
     entries_to_add = pd.read_csv('/Users/chriscay/Downloads/PACL-Letter-Split - Phrase-Lemma-POS-Annot.csv')
@@ -81,11 +81,8 @@ def add_pos_to_phrase_lemmas_online():
     fails = []
     for first_radical, rows in radical2rows.items():
         sheet = sh.worksheet(first_radical)
-        sheet_df = pd.DataFrame(sheet.get_all_records())
+        sheet_df = utils.read_sheet_as_df(sh, first_radical)
         assert sheet.row_values(1)[6] == 'ANALYSIS'
-        sheet_df = sheet_df.replace(nan, '', regex=True)
-        sheet_df_obj = sheet_df.select_dtypes(['object'])
-        sheet_df[sheet_df_obj.columns] = sheet_df_obj.apply(lambda x: x.str.strip())
         
         data = []
         for i, row in rows:
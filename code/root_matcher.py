@@ -0,0 +1,103 @@
+SHADDA = 'ّ'
+DIACRITICS = set('ًٌٍَُِْـ')
+# Weak radicals and hamzas are often dropped or changed in a lemma (e.g., قال from ق.و.ل, كُل from ء.ك.ل),
+# so they match anything, including nothing
+WILDCARD_RADICALS = set('ويءأإؤئآ')
+
+N_CANDIDATES = 3
+
+
+# Radicals a lemma of the root must contain, in the order of the root
+def radical_pattern(root):
+    return tuple(r for r in root.split('.') if r not in WILDCARD_RADICALS)
+
+
+# Letters of a text without its diacritics, a letter followed by a shadda counting twice
+def letters(text):
+    letters_ = []
+    for c in text:
+        if c == SHADDA:
+            letters_ += letters_[-1:]
+        elif c not in DIACRITICS:
+            letters_.append(c)
+    return letters_
+
+
+def next_positions(text):
+    """Per-letter position table of a text: `table[i][letter]` is the first position of `letter` from
+    position `i` on (see `letters`). Built once per text, it matches a pattern of k radicals in k lookups."""
+    letters_ = letters(text)
+    table = [{}]
+    for j in range(len(letters_) - 1, -1, -1):
+        table.append({**table[-1], letters_[j]: j})
+    return table[::-1]
+
+
+def is_subsequence(pattern, table):
+    position = 0
+    for radical in pattern:
+        position = table[position].get(radical)
+        if position is None:
+            return False
+        position += 1
+    return True
+
+
+def _common_subsequence_length(a, b):
+    lengths = [0] * (len(b) + 1)
+    for x in a:
+        diagonal = 0
+        for j, y in enumerate(b):
+            above = lengths[j + 1]
+            lengths[j + 1] = diagonal + 1 if x == y else max(above, lengths[j])
+            diagonal = above
+    return lengths[-1]
+
+
+class RootMatcher:
+    """Candidate roots of a lemma, drawn from an inventory of roots (mapped to their number of rows).
+
+    The radical patterns (see `radical_pattern`) of the inventory are stored in a trie, which is walked along
+    the position table of the lemma, so that only the roots matching the lemma are visited. Candidates are
+    ranked by the number of their radicals (wildcards included) found in order in the lemma, then by their
+    number of radicals missing from it, then by their frequency.
+    """
+    def __init__(self, root2count, n_candidates=N_CANDIDATES) -> None:
+        self.root2count = dict(root2count)
+        self.n_candidates = n_candidates
+        self.trie = {}
+        self.lemma2candidates = {}
+        for root in self.root2count:
+            pattern = radical_pattern(root)
+            # Roots made of wildcards only would match every lemma
+            if not pattern:
+                continue
+            node = self.trie
+            for radical in pattern:
+                node = node.setdefault(radical, {})
+            node.setdefault(None, []).append(root)
+
+    def matches(self, lemma):
+        table = next_positions(lemma)
+        roots, nodes = [], [(self.trie, 0)]
+        while nodes:
+            node, position = nodes.pop()
+            for radical, child in node.items():
+                if radical is None:
+                    roots += child
+                    continue
+                next_position = table[position].get(radical)
+                if next_position is not None:
+                    nodes.append((child, next_position + 1))
+        return roots
+
+    def candidates(self, lemma):
+        if lemma not in self.lemma2candidates:
+            letters_ = letters(lemma)
+            ranked = []
+            for root in self.matches(lemma):
+                radicals = root.split('.')
+                found = _common_subsequence_length(radicals, letters_)
+                ranked.append((-found, len(radicals) - found, -self.root2count[root], root))
+            self.lemma2candidates[lemma] = [root for *_, root in sorted(ranked)[:self.n_candidates]]
+        return self.lemma2candidates[lemma]
@@ -0,0 +1,150 @@
+import random
+import threading
+import time
+
+import gspread
+
+# Google Sheets allows 60 read and 60 write requests per minute and per user
+REQUESTS_PER_MINUTE = 60
+BURST = 5
+MAX_RETRIES = 8
+BASE_DELAY = 2
+MAX_DELAY = 120
+QUOTA_CODE = 429
+SERVER_ERROR_CODES = {500, 502, 503, 504}
+# Calls which change the layout of a sheet. A server error can come after such a change was applied, so
+# they are only retried on quota errors (rejected before being applied); reads and value overwrites are
+# safe to repeat. The batch_update of a spreadsheet (structural requests) is told apart from the one of
+# a worksheet (values) in `SheetsClient.is_idempotent`.
+NON_IDEMPOTENT_METHODS = {'insert_row', 'insert_rows', 'insert_cols', 'append_row', 'append_rows', 'add_rows',
+                          'add_cols', 'delete_rows', 'delete_columns', 'add_worksheet', 'duplicate_sheet',
+                          'del_worksheet', 'create', 'copy'}
+
+
+class TokenBucket:
+    """Token bucket rate limiter. Refills at `rate` tokens per second up to `capacity` tokens,
+    `acquire` blocks until a token is available and returns the time it waited."""
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # The token is taken right away, a negative balance is the time to wait for it
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            wait = -self.tokens / self.rate
+        self.sleep(wait)
+        return wait
+
+
+class SheetsClient:
+    """Routes gspread calls through a token bucket tuned to the Sheets per-minute quota, and retries
+    quota and server errors with jittered exponential backoff, up to `max_retries` times per call.
+    Calls which are not idempotent (see `NON_IDEMPOTENT_METHODS`) are only retried on quota errors.
+    Other API errors, and the last error once the retry budget is spent, are raised.
+
+    Objects returned by `wrap` (and the clients, spreadsheets and worksheets their methods return)
+    behave like the gspread ones, but every method call goes through `call`. The clock, sleep and
+    random number generator can be swapped, e.g., to run against an in-memory worksheet without waiting.
+    """
+    def __init__(self,
+                 requests_per_minute=REQUESTS_PER_MINUTE,
+                 burst=BURST,
+                 max_retries=MAX_RETRIES,
+                 base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY,
+                 clock=time.monotonic,
+                 sleep=time.sleep,
+                 rng=None) -> None:
+        # The burst is taken out of the refill rate, so that no 60 seconds window exceeds the quota
+        self.bucket = TokenBucket((requests_per_minute - burst) / 60, burst, clock=clock, sleep=sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.rng = rng if rng is not None else random.Random()
+        self.metrics = {'calls': 0, 'retries': 0, 'failures': 0, 'throttle_wait': 0, 'backoff_wait': 0}
+        self.metrics_lock = threading.Lock()
+
+    # Calls can come from several threads, e.g., the STATUS uploader of well_formedness
+    def _count(self, metric, value=1):
+        with self.metrics_lock:
+            self.metrics[metric] += value
+
+    @staticmethod
+    def is_retryable(error, idempotent=True):
+        info = error.args[0] if error.args and isinstance(error.args[0], dict) else {}
+        if info.get('code') == QUOTA_CODE or 'Quota exceeded' in info.get('message', ''):
+            return True
+        return idempotent and info.get('code') in SERVER_ERROR_CODES
+
+    @staticmethod
+    def is_idempotent(obj, name):
+        if name == 'batch_update':
+            return not isinstance(obj, gspread.Spreadsheet)
+        return name not in NON_IDEMPOTENT_METHODS
+
+    def call(self, func, *args, idempotent=True, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._count('throttle_wait', self.bucket.acquire())
+            self._count('calls')
+            try:
+                return func(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if not self.is_retryable(e, idempotent) or attempt == self.max_retries:
+                    self._count('failures')
+                    raise
+                # Full jitter, so that several scripts hitting the quota do not retry in lockstep
+                wait = self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                print(f'{e.args[0].get("message", "API error")}, retrying in {wait:.1f} seconds '
+                      f'({attempt + 1}/{self.max_retries})...')
+                self.sleep(wait)
+                self._count('retries')
+                self._count('backoff_wait', wait)
+
+    def wrap(self, obj):
+        return _Throttled(self, obj)
+
+    def service_account(self, filename):
+        return self.wrap(gspread.service_account(filename))
+
+    def summary(self):
+        return (f"{self.metrics['calls']} API calls, {self.metrics['retries']} retries, "
+                f"{self.metrics['failures']} failures, {self.metrics['throttle_wait']:.1f}s throttled, "
+                f"{self.metrics['backoff_wait']:.1f}s backing off")
+
+
+class _Throttled:
+    WRAPPED_TYPES = (gspread.Client, gspread.Spreadsheet, gspread.Worksheet)
+
+    def __init__(self, client, obj) -> None:
+        self._client = client
+        self._obj = obj
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+
+        def throttled(*args, **kwargs):
+            result = self._client.call(attr, *args, idempotent=self._client.is_idempotent(self._obj, name), **kwargs)
+            return self._client.wrap(result) if isinstance(result, self.WRAPPED_TYPES) else result
+        return throttled
+
+
+# Shared by all the scripts of a process, since the quota is per user
+default_client = SheetsClient()
+
+
+def service_account(filename):
+    return default_client.service_account(filename)
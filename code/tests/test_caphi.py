@@ -0,0 +1,95 @@
+import pytest
+
+import caphi
+import well_formedness
+from caphi import MAX_EXPANSIONS, CaphiTransducer, ConversionCache
+
+CAPHI2TYPE = {'k': 'c', 't': 'c', 'b': 'c', 'd': 'c', 'r': 'c', 's': 'c', 'a': 'v', 'aa': 'v', 'i': 'v', 'u': 'v'}
+CAPHI2IPA = {'k': 'k', 't': 't', 'b': 'b', 'd': 'd', 'r': 'r', 's': 's', 'a': 'a', 'aa': 'aː', 'i': 'i', 'u': 'u'}
+
+
+@pytest.fixture
+def transducer():
+    return CaphiTransducer(CAPHI2IPA, CAPHI2TYPE)
+
+
+def test_tokenize(transducer):
+    assert transducer.tokenize('k a  t aIIi b, k i t aa b') == [['k', 'a', 't', 'a||i', 'b'],
+                                                                   ['k', 'i', 't', 'aa', 'b']]
+
+
+def test_is_valid(transducer):
+    assert transducer.is_valid('k aa t i b, k u t u b')
+    assert transducer.is_valid('k a||u t b')
+    # `aa` is a symbol of its own, `aaa` is not
+    assert not transducer.is_valid('k aaa t')
+    assert not transducer.is_valid('k a x')
+    assert not transducer.is_valid('k a||x t')
+
+
+def test_linked_alternatives_are_expanded_together(transducer):
+    tokens = 'k a||i t a||i b||d'.split()
+    assert transducer.count_expansions(tokens) == 4
+    assert transducer.expand(tokens) == [['k', 'a', 't', 'a', 'b'], ['k', 'a', 't', 'a', 'd'],
+                                         ['k', 'i', 't', 'i', 'b'], ['k', 'i', 't', 'i', 'd']]
+    assert transducer.expand(['k', 'a']) == [['k', 'a']]
+    assert not transducer.has_too_many_expansions(tokens)
+
+
+def test_expansions_are_capped(transducer):
+    assert transducer.max_expansions == MAX_EXPANSIONS == 64
+    # 7 slots of 2 alternatives each, 128 expansions
+    tokens = ['k||t', 'a||i', 'b||d', 'aa||u', 'r||s', 'a||u', 't||d']
+    assert transducer.count_expansions(tokens) == 128
+    assert len(transducer.expand(tokens)) == 64
+    assert transducer.has_too_many_expansions(tokens)
+    assert transducer.too_many_alternatives == 1
+
+    small = CaphiTransducer(CAPHI2IPA, CAPHI2TYPE, max_expansions=2)
+    assert small.expand('k a||i b||d'.split()) == [['k', 'a', 'b'], ['k', 'a', 'd']]
+    assert small.has_too_many_expansions('k a||i b||d'.split())
+
+
+def test_caphipp2ipa_marks_truncated_alternatives():
+    caphi.set_caphi2ipa(CAPHI2IPA, max_expansions=2)
+    try:
+        assert caphi.caphipp2ipa('k a||i b') == 'kab, kib'
+        assert caphi.caphipp2ipa('k a||i b||d') == 'kab, kad, ...'
+        assert caphi.caphipp2ipa('k aa, b u') == 'kaː, bu'
+        assert caphi.transducer.too_many_alternatives == 1
+    finally:
+        caphi.set_caphi2ipa({})
+
+
+@pytest.mark.parametrize('caphi_, code', [
+    ('k a t a b', ''),
+    ('k a x', 'caphi-invalid-char'),
+    ('k t b r a', 'caphi-invalid-seq'),
+    ('k a aa b', 'caphi-invalid-seq'),
+    # Only the second alternative has two vowels in a row
+    ('k a b||i i', 'caphi-invalid-seq'),
+    ('k a t a b, k aa a', 'caphi-invalid-seq'),
+    ('k||t a||i b||d aa||u r||s a||u t||d', 'caphi-too-many-alternatives'),
+])
+def test_caphi_well_formedness(caphi_, code):
+    well_formedness.init_worker(set(), CAPHI2TYPE)
+    assert well_formedness._caphi_well_formedness_check(caphi_) == code
+
+
+def test_conversion_cache_evicts_the_least_recently_used():
+    cache = ConversionCache(maxsize=2)
+    calls = []
+    def convert(text):
+        calls.append(text)
+        return text.upper()
+    assert cache.get('a', convert, 'a') == 'A'
+    assert cache.get('b', convert, 'b') == 'B'
+    assert cache.get('a', convert, 'a') == 'A'
+    # `b` is the least recently used and is evicted
+    assert cache.get('c', convert, 'c') == 'C'
+    assert cache.get('a', convert, 'a') == 'A'
+    assert cache.get('b', convert, 'b') == 'B'
+    assert calls == ['a', 'b', 'c', 'b']
+    assert cache.stats() == {'hits': 2, 'misses': 4, 'size': 2}
+    cache.clear()
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'size': 0}
@@ -0,0 +1,145 @@
+import random
+
+import pandas as pd
+import pytest
+
+from duplicates import BKTree, DuplicateIndex, edit_distance, normalize_key
+
+
+def levenshtein(a, b):
+    distances = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        previous, distances[0] = distances[0], i
+        for j, y in enumerate(b, 1):
+            previous, distances[j] = distances[j], min(distances[j] + 1, distances[j - 1] + 1, previous + (x != y))
+    return distances[-1]
+
+
+def random_strings(rng, n, alphabet='abcd', max_length=8):
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, max_length))) for _ in range(n)]
+
+
+def test_edit_distance_matches_levenshtein():
+    rng = random.Random(0)
+    strings = random_strings(rng, 60) + ['', 'a', 'كَتَب', 'كتاب']
+    for a in strings:
+        for b in strings:
+            assert edit_distance(a, b) == levenshtein(a, b), (a, b)
+    # Sequences of symbols, as the CAPHI++ transcriptions
+    assert edit_distance('k a t a b'.split(), 'k aa t i b'.split()) == 2
+    # Longer than a machine word
+    a, b = 'ab' * 50, 'ba' * 50
+    assert edit_distance(a, b) == levenshtein(a, b)
+
+
+def test_edit_distance_cutoff():
+    assert edit_distance('abcdef', 'a', max_distance=1) == 2
+    assert edit_distance('abc', 'abd', max_distance=1) == 1
+
+
+def test_bk_tree_matches_brute_force():
+    rng = random.Random(1)
+    items = list(dict.fromkeys(random_strings(rng, 200)))
+    tree = BKTree(items)
+    for query in random_strings(rng, 50):
+        for max_distance in [0, 1, 2]:
+            expected = sorted((levenshtein(query, item), item) for item in items
+                              if levenshtein(query, item) <= max_distance)
+            assert sorted(tree.query(query, max_distance)) == expected
+
+
+def test_normalize_key():
+    assert normalize_key('أَكَل') == normalize_key('إكل') == 'ءكل'
+
+
+def make_lexicon(rows):
+    return pd.DataFrame(rows, columns=['ROOT', 'LEMMA', 'FORM', 'CAPHI++', 'ANALYSIS'])
+
+
+def test_exact_duplicates():
+    lexicon = make_lexicon([
+        ['ك.ت.ب', 'كَتَب', 'كَتَب', 'k a t a b', 'VERB:P'],
+        ['ك.ت.ب', 'كَتَب', 'كَتَب', 'k a t a b', 'VERB:P'],
+        ['ك.ت.ب', 'كَتَب', 'كَتَب', 'k a t a b', 'VERB: P'],
+        ['ك.ت.ب', 'كَتَب', 'كَتَب', 'k i t i b', 'VERB:P'],
+        ['ك.ت.ب', 'كَتَب', 'كَتَب', 'k a t a b', 'NOUN:MS'],
+    ])
+    assert sorted(DuplicateIndex(lexicon).exact_duplicates()) == [
+        (0, 'possible-duplicates', 0), (1, 'possible-duplicates', 0), (2, 'possible-duplicates', 0),
+        (3, 'possible-caphi-duplicates', 0)]
+
+
+def test_normalized_duplicates():
+    lexicon = make_lexicon([
+        ['ء.ك.ل', 'أَكَل', 'أَكَل', 'k a l', 'VERB:P'],
+        ['ء.ك.ل', 'اكل', 'إكل', 'k a  l', 'VERB:P'],
+        ['ء.ك.ل', 'أَكَل', 'أَكَل', 'k i l', 'VERB:P'],
+        ['ء.ك.ل', 'أَكْل', 'أَكْل', 'k a l', 'NOUN:MS'],
+    ])
+    assert DuplicateIndex(lexicon).normalized_duplicates() == []
+    lexicon.loc[1, 'LEMMA'] = 'أكل'
+    assert sorted(DuplicateIndex(lexicon).normalized_duplicates()) == [
+        (0, 'possible-normalized-duplicates', 0), (1, 'possible-normalized-duplicates', 0)]
+
+
+# Every pair of distinct (lemma, form) keys of a block is compared, rows sharing a key go together
+def near_duplicates_brute_force(lexicon, max_distance=1):
+    caphis = [caphi.split() for caphi in lexicon['CAPHI++']]
+    block2key2indexes = {}
+    for i, (root, lemma, form, analysis) in enumerate(zip(lexicon['ROOT'], lexicon['LEMMA'], lexicon['FORM'],
+                                                         lexicon['ANALYSIS'])):
+        block2key2indexes.setdefault((analysis, normalize_key(root)), {}).setdefault(
+            f'{normalize_key(lemma)} {normalize_key(form)}', []).append(i)
+    hits = []
+    for key2indexes in block2key2indexes.values():
+        keys = list(key2indexes)
+        parent = list(range(len(keys)))
+        def find(k):
+            while parent[k] != k:
+                k = parent[k]
+            return k
+        for a in range(len(keys)):
+            for b in range(a):
+                if levenshtein(keys[a], keys[b]) <= max_distance and any(
+                        levenshtein(caphis[i], caphis[j]) <= max_distance
+                        for i in key2indexes[keys[a]] for j in key2indexes[keys[b]]):
+                    parent[find(a)] = find(b)
+        clusters = {}
+        for k in range(len(keys)):
+            clusters.setdefault(find(k), []).append(k)
+        for cluster in clusters.values():
+            if len(cluster) > 1:
+                indexes = [i for k in cluster for i in key2indexes[keys[k]]]
+                hits += [(i, 'possible-near-duplicates', min(indexes)) for i in indexes]
+    return sorted(hits)
+
+
+def test_near_duplicates():
+    lexicon = make_lexicon([
+        ['ك.ت.ب', 'مَكْتَبِة', 'مَكْتَبِة', 'm a k t a b e', 'NOUN:FS'],
+        ['ك.ت.ب', 'مَكْتَبِة', 'مَكْتَبِه', 'm a k t a b e', 'NOUN:FS'],
+        ['ك.ت.ب', 'مَكْتَبِة', 'مَكْتَبِة', 'm a k t a b a', 'NOUN:FS'],
+        # Close spelling, but pronounced differently
+        ['ك.ت.ب', 'مَكْتَبِة', 'مَكْتَبِت', 'm a k t a b i t', 'NOUN:FS'],
+        # Other block
+        ['ك.ت.ب', 'مَكْتَبِة', 'مَكْتَبِه', 'm a k t a b e', 'NOUN:MS'],
+    ])
+    assert sorted(DuplicateIndex(lexicon).near_duplicates()) == [
+        (0, 'possible-near-duplicates', 0), (1, 'possible-near-duplicates', 0), (2, 'possible-near-duplicates', 0)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_near_duplicates_match_brute_force(seed):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(80):
+        # Forms one or two random edits away from their lemma, so that some of them are near each other
+        lemma = rng.choice(['كتب', 'كتاب', 'بلل'])
+        form = list(lemma)
+        for _ in range(rng.randint(0, 2)):
+            position = rng.randrange(len(form) + 1)
+            form[position:position + rng.randint(0, 1)] = rng.choice(['', 'ك', 'ت', 'ب'])
+        caphi = ' '.join(rng.choice(['k', 't', 'b', 'a']) for _ in range(rng.randint(2, 3)))
+        rows.append([rng.choice(['ك.ت.ب', 'ب.ل']), lemma, ''.join(form), caphi, rng.choice(['NOUN:MS', 'VERB:P'])])
+    lexicon = make_lexicon(rows)
+    assert sorted(DuplicateIndex(lexicon).near_duplicates()) == near_duplicates_brute_force(lexicon)
@@ -0,0 +1,80 @@
+import random
+from itertools import combinations
+
+from root_matcher import RootMatcher, is_subsequence, letters, next_positions, radical_pattern
+
+RADICALS = list('كتبلقوي')
+
+
+def is_subsequence_brute_force(pattern, letters_):
+    return any(tuple(letters_[i] for i in positions) == tuple(pattern)
+               for positions in combinations(range(len(letters_)), len(pattern)))
+
+
+def common_subsequence_length_brute_force(a, b):
+    return max(n for n in range(len(a) + 1) if any(is_subsequence_brute_force(sub, b) for sub in combinations(a, n)))
+
+
+def random_lemma(rng):
+    return ''.join(rng.choice(RADICALS + ['َ', 'ِ', 'ّ', 'ا']) for _ in range(rng.randint(1, 7)))
+
+
+def random_roots(rng, n):
+    return list(dict.fromkeys('.'.join(rng.choice(RADICALS) for _ in range(rng.randint(2, 4))) for _ in range(n)))
+
+
+def test_letters():
+    assert letters('كَتَّب') == list('كتتب')
+    assert letters('مْدَرِّس') == list('مدررس')
+
+
+def test_radical_pattern():
+    assert radical_pattern('ق.و.ل') == ('ق', 'ل')
+    assert radical_pattern('ء.ك.ل') == ('ك', 'ل')
+    assert radical_pattern('و.ي') == ()
+
+
+def test_is_subsequence_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(300):
+        lemma = random_lemma(rng)
+        table, letters_ = next_positions(lemma), letters(lemma)
+        for _ in range(5):
+            pattern = [rng.choice(RADICALS) for _ in range(rng.randint(0, 3))]
+            assert is_subsequence(pattern, table) == is_subsequence_brute_force(pattern, letters_), (lemma, pattern)
+
+
+def test_matches_are_the_roots_whose_pattern_is_a_subsequence():
+    rng = random.Random(1)
+    roots = random_roots(rng, 80)
+    matcher = RootMatcher({root: 1 for root in roots})
+    for _ in range(200):
+        lemma = random_lemma(rng)
+        expected = [root for root in roots
+                    if radical_pattern(root) and is_subsequence_brute_force(radical_pattern(root), letters(lemma))]
+        assert sorted(matcher.matches(lemma)) == sorted(expected), lemma
+
+
+def test_candidates_match_brute_force_ranking():
+    rng = random.Random(2)
+    root2count = {root: rng.randint(1, 5) for root in random_roots(rng, 60)}
+    matcher = RootMatcher(root2count, n_candidates=3)
+    for _ in range(200):
+        lemma = random_lemma(rng)
+        letters_ = letters(lemma)
+        ranked = []
+        for root, count in root2count.items():
+            pattern = radical_pattern(root)
+            if pattern and is_subsequence_brute_force(pattern, letters_):
+                radicals = root.split('.')
+                found = common_subsequence_length_brute_force(radicals, letters_)
+                ranked.append((-found, len(radicals) - found, -count, root))
+        assert matcher.candidates(lemma) == [root for *_, root in sorted(ranked)[:3]], lemma
+
+
+def test_candidates_rank_by_radicals_found_then_frequency():
+    matcher = RootMatcher({'ك.ت.ب': 1, 'ت.ب': 10, 'ك.ب': 5, 'ق.و.ل': 3})
+    assert matcher.candidates('كَتَب') == ['ك.ت.ب', 'ت.ب', 'ك.ب']
+    # Weak radicals match anything, they still count when found
+    assert matcher.candidates('قال') == ['ق.و.ل']
+    assert matcher.candidates('دَرَس') == []
@@ -0,0 +1,120 @@
+import random
+
+import gspread
+import pytest
+
+from fake_sheets import FakeWorksheet
+from sheets_client import SheetsClient, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_client(clock, **kwargs):
+    return SheetsClient(clock=clock, sleep=clock.sleep, rng=random.Random(0), **kwargs)
+
+
+def make_sheet(errors):
+    return FakeWorksheet([['ID', 'STATUS'], ['1', '']], errors=errors)
+
+
+@pytest.mark.parametrize('code', [429, 500, 503])
+def test_retryable_errors_are_retried(code):
+    clock = FakeClock()
+    client = make_client(clock)
+    worksheet = make_sheet([code, code])
+    assert client.wrap(worksheet).row_values(2) == ['1', '']
+    assert worksheet.requests == ['row_values'] * 3
+    assert client.metrics['retries'] == 2
+    assert client.metrics['failures'] == 0
+
+
+@pytest.mark.parametrize('code', [400, 403, 404])
+def test_other_errors_are_raised(code):
+    clock = FakeClock()
+    client = make_client(clock)
+    worksheet = make_sheet([code])
+    with pytest.raises(gspread.exceptions.APIError):
+        client.wrap(worksheet).row_values(2)
+    assert worksheet.requests == ['row_values']
+    assert client.metrics['retries'] == 0
+    assert client.metrics['failures'] == 1
+
+
+def test_non_idempotent_calls_are_not_retried_on_server_errors():
+    clock = FakeClock()
+    client = make_client(clock)
+    worksheet = make_sheet([503])
+    with pytest.raises(gspread.exceptions.APIError):
+        client.wrap(worksheet).insert_row(['2', ''], index=3)
+    assert worksheet.requests == ['insert_row']
+    assert worksheet.values == [['ID', 'STATUS'], ['1', '']]
+
+
+def test_non_idempotent_calls_are_retried_on_quota_errors():
+    clock = FakeClock()
+    client = make_client(clock)
+    worksheet = make_sheet([429])
+    client.wrap(worksheet).insert_row(['2', ''], index=3)
+    assert worksheet.requests == ['insert_row'] * 2
+    assert worksheet.values == [['ID', 'STATUS'], ['1', ''], ['2', '']]
+
+
+def test_idempotent_flag():
+    worksheet = make_sheet([])
+    assert SheetsClient.is_idempotent(worksheet, 'batch_update')
+    assert SheetsClient.is_idempotent(worksheet, 'row_values')
+    assert not SheetsClient.is_idempotent(worksheet, 'insert_rows')
+    assert not SheetsClient.is_idempotent(worksheet, 'append_row')
+
+
+def test_backoff_is_bounded():
+    clock = FakeClock()
+    client = make_client(clock, max_retries=4, base_delay=2, max_delay=5)
+    worksheet = make_sheet([503] * 5)
+    with pytest.raises(gspread.exceptions.APIError):
+        client.wrap(worksheet).get_all_values()
+    # One call and max_retries retries, then the last error is raised
+    assert worksheet.requests == ['get_all_values'] * 5
+    assert client.metrics['retries'] == 4
+    assert client.metrics['failures'] == 1
+    # The calls fit in the burst, so the only waits are the backoffs
+    backoffs = clock.sleeps
+    assert len(backoffs) == 4
+    for attempt, wait in enumerate(backoffs):
+        assert 0 <= wait <= min(5, 2 * 2 ** attempt)
+    assert client.metrics['backoff_wait'] == pytest.approx(sum(backoffs))
+
+
+def test_token_bucket_burst_then_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    # Each further token comes half a second after the previous one
+    assert bucket.acquire() == pytest.approx(0.5)
+    clock.now += 10
+    # Refilled up to the capacity, not beyond
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() > 0
+
+
+def test_client_throttles_to_the_quota():
+    clock = FakeClock()
+    client = make_client(clock, requests_per_minute=60, burst=5)
+    sheet = client.wrap(make_sheet([]))
+    for _ in range(60):
+        sheet.row_values(1)
+    # The burst is taken out of the refill rate: 55 requests per minute once it is spent
+    assert clock.now == pytest.approx(55 * 60 / 55)
+    assert client.metrics['throttle_wait'] == pytest.approx(clock.now)
@@ -0,0 +1,72 @@
+import pandas as pd
+
+import utils
+from fake_sheets import FakeWorksheet
+
+
+def write_sheet(directory, sheet_name, text):
+    (directory / f'{sheet_name}.csv').write_text(text, encoding='utf-8')
+
+
+def test_read_pacl_as_df_repairs_multiline_cells(tmp_path, capsys):
+    write_sheet(tmp_path, 'ب', 'ID,LEMMA,GLOSS,STATUS\n'
+                               '1, بَنْك ,"to\n write",\n'
+                               '2,بِنّ,coffee," ok "\n')
+    write_sheet(tmp_path, 'ت', 'ID,LEMMA,GLOSS,STATUS\n'
+                               '3,تَمْر,dates,\n')
+    pacl = utils.read_pacl_as_df(str(tmp_path), ['ب', 'ت'])
+    assert pacl['GLOSS'].tolist() == ['towrite', 'coffee', 'dates']
+    assert pacl['LEMMA'].tolist() == ['بَنْك', 'بِنّ', 'تَمْر']
+    assert pacl['STATUS'].tolist() == ['', 'ok', '']
+    assert capsys.readouterr().out == 'WARNING: New line in sheet <ب>, cell C2\n'
+
+
+def test_read_pacl_as_dfs_strips_text_columns(tmp_path):
+    write_sheet(tmp_path, 'ب', 'ID,LEMMA,GLOSS\n1, بَنْك ,"bank "\n')
+    sheet2pacl = utils.read_pacl_as_dfs(str(tmp_path), ['ب'])
+    pd.testing.assert_frame_equal(
+        sheet2pacl['ب'], pd.DataFrame({'ID': [1], 'LEMMA': ['بَنْك'], 'GLOSS': ['bank']}), check_dtype=False)
+
+
+def make_worksheet(lemmas, status):
+    return FakeWorksheet([['ID', 'LEMMA', 'STATUS']] + [[str(i), lemma, s] for i, (lemma, s) in enumerate(zip(lemmas, status))])
+
+
+def test_add_check_mark_online_sends_changed_cells():
+    worksheet = make_worksheet(['a', 'b', 'c'], ['', 'x', 'y'])
+    rows = pd.DataFrame({'LEMMA': ['a', 'b', 'c']})
+    written = utils.add_check_mark_online(rows, None, worksheet, messages=['z', 'x', ''], write='overwrite')
+    assert written == 2
+    assert [row[2] for row in worksheet.values[1:]] == ['z', 'x', '']
+    assert worksheet.requests == ['row_values', 'batch_get', 'batch_update']
+
+
+def test_add_check_mark_online_reads_the_sheet_again_without_states():
+    worksheet = make_worksheet(['a', 'b'], ['', ''])
+    rows = pd.DataFrame({'LEMMA': ['a', 'b']})
+    utils.add_check_mark_online(rows, None, worksheet, messages=['x', 'y'], write='overwrite')
+    # Edited by hand between two write-backs
+    worksheet.values[1][2] = 'edited'
+    utils.add_check_mark_online(rows, None, worksheet, messages=['x', 'y'], write='overwrite')
+    assert [row[2] for row in worksheet.values[1:]] == ['x', 'y']
+
+
+def test_add_check_mark_online_reuses_the_states_of_the_caller():
+    worksheet = make_worksheet(['a', 'b'], ['', ''])
+    rows = pd.DataFrame({'LEMMA': ['a', 'b']})
+    worksheet_states = {}
+    utils.add_check_mark_online(rows, None, worksheet, messages=['x', 'y'], write='overwrite',
+                                worksheet_states=worksheet_states)
+    worksheet.requests.clear()
+    assert utils.add_check_mark_online(rows, None, worksheet, messages=['x', 'z'], write='overwrite',
+                                       worksheet_states=worksheet_states) == 1
+    assert worksheet.requests == ['batch_update']
+
+    # A row was inserted since, the states are read again rather than written to the wrong rows
+    worksheet.values.insert(1, ['2', 'c', 'w'])
+    rows = pd.DataFrame({'LEMMA': ['c', 'a', 'b']})
+    worksheet.requests.clear()
+    utils.add_check_mark_online(rows, None, worksheet, messages=['v', 'x', 'z'], write='overwrite',
+                                worksheet_states=worksheet_states)
+    assert worksheet.requests == ['row_values', 'batch_get', 'batch_update']
+    assert [row[2] for row in worksheet.values[1:]] == ['v', 'x', 'z']
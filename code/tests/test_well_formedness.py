@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+
+import utils
+import well_formedness
+from well_formedness import LexiconIndex, normalize_lemmas, render_status, run_checks, run_checks_incremental
+
+COLUMNS = ['ID', 'ROOT', 'ROOT_NTWS', 'LEMMA', 'FORM', 'CAPHI++', 'ANALYSIS', 'GLOSS']
+ROWS = [
+    ['1', 'ك.ت.ب', '', 'كَتَب', 'كَتَب', 'k a t a b', 'VERB:P', 'write'],
+    ['2', 'ك.ت.ب', '', 'كَتَب', 'يِكْتِب', '', 'VERB:I', 'write'],
+    ['3', 'ك.ت.ب', '', 'كَتَب', 'كَتَب', 'k a t a b', 'VERB:P', 'write'],
+    ['4', 'ك.ت.ب', '', 'كِتاب', 'كِتاب', 'k i t aa b', 'NOUN:MS', 'book'],
+    ['5', 'ك.ت.ب', '', 'كِتاب', 'كُتُب', '', 'NOUN:PL', 'books'],
+    ['6', 'ك.ت.ب', '', 'مَكْتَب', 'مَكاتِب', '', 'NOUN:PL', 'offices'],
+    ['7', 'ك.ت.ب', '', 'مَكْتَبِة', 'مَكْتَبِة', '', 'NOUN:FS', 'library'],
+    ['8', 'ك.ت.ب', '', 'مَكْتبِة', 'مَكْتبِة', '', 'NOUN:FS', 'library'],
+    ['9', 'د.ر.س', '', 'دَرَس', 'دَرَس', 'd a r a x', 'VERB:P', 'study'],
+    ['10', 'د.ر.س', '', 'دَرَس', 'اُدْرُس', 'd r s k', 'VERB:C', 'study'],
+    ['11', 'NTWS', 'ب.ن.ك', 'بَنْك', 'بَنْك', '', 'NOUN:MS', 'bank'],
+    ['12', 'NTWS', 'ب.ن.ك', 'بَنْك', 'بُنُوك', '', 'NOUN:PL', 'banks'],
+    ['13', 'ب.ن', '', 'بِنّ', 'بِنّ', '', 'NOUN:MS', 'coffee'],
+]
+
+
+@pytest.fixture(autouse=True)
+def resources():
+    caphi_inventory = {'k': 'c', 't': 'c', 'b': 'c', 'd': 'c', 'r': 'c', 's': 'c', 'a': 'v', 'i': 'v', 'aa': 'v'}
+    well_formedness.init_worker({'كتب', 'درس'}, caphi_inventory)
+
+
+# Same frame as the one read by maknuune_check.py
+def make_lexicon(rows):
+    lexicon = utils.normalize_sheet_df(pd.DataFrame(rows, columns=COLUMNS), strip=False)
+    lexicon['LEMMA_NORM'] = normalize_lemmas(lexicon['LEMMA'])
+    return lexicon
+
+
+def edit(rows, id_, column, value):
+    return [row[:COLUMNS.index(column)] + [value] + row[COLUMNS.index(column) + 1:] if row[0] == id_ else row
+            for row in rows]
+
+
+def delete(rows, *ids):
+    return [row for row in rows if row[0] not in ids]
+
+
+def move(rows, id_, position):
+    row = next(row for row in rows if row[0] == id_)
+    rows = delete(rows, id_)
+    return rows[:position] + [row] + rows[position:]
+
+
+def test_run_checks_incremental_matches_run_checks(tmp_path):
+    versions = [ROWS]
+    # Edit a form, and a lemma so that the row leaves its group
+    versions.append(edit(edit(versions[-1], '2', 'FORM', 'بِكْتِب'), '5', 'LEMMA', 'كُتُب'))
+    # Delete the row the references of the more-than-one and duplicates hits point to
+    versions.append(delete(versions[-1], '1'))
+    # Move rows within and across groups, the first row of a group changes
+    versions.append(move(move(move(versions[-1], '3', 5), '12', 0), '8', 1))
+    # Add a row which duplicates the ID of another one
+    versions.append(versions[-1] + [['9', 'د.ر.س', '', 'دَرَس', 'بِدْرُس', '', 'VERB:I', 'study']])
+    # Edit one of the rows sharing an ID, then move it
+    versions.append(versions[-1][:-1] + edit(versions[-1][-1:], '9', 'CAPHI++', 'b i d r s'))
+    versions.append(move(versions[-1], '9', 2))
+    # Fix the lemma back, delete a whole group and add a new row
+    versions.append(delete(edit(versions[-1], '5', 'LEMMA', 'كِتاب'), '7', '8') +
+                    [['14', 'ك.ت.ب', '', 'كاتِب', 'كاتِب', '', 'NOUN:MS', 'writer']])
+    # Nothing changed
+    versions.append(versions[-1])
+
+    fingerprints = str(tmp_path / 'fingerprints.json')
+    n_checked = []
+    for rows in versions:
+        lexicon = make_lexicon(rows)
+        checks, hits = run_checks(lexicon, LexiconIndex(lexicon))
+        checks_incremental, hits_incremental, n_checked_ = run_checks_incremental(lexicon, fingerprints)
+        assert render_status(checks_incremental, hits_incremental) == render_status(checks, hits)
+        assert sorted(hits_incremental) == sorted(hits)
+        n_checked.append(n_checked_)
+    assert n_checked[0] == (len(ROWS), len(ROWS))
+    assert n_checked[-1] == (0, 0)
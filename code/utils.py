@@ -1,13 +1,16 @@
+import io
 import os
 import re
+import json
 from collections import Counter
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 from camel_tools.utils.charmap import CharMapper
 
 import gspread
 import pandas as pd
-from numpy import nan
+
+import sheets_client
 
 bw2ar = CharMapper.builtin_mapper('bw2ar')
 ar2bw = CharMapper.builtin_mapper('ar2bw')
@@ -15,6 +18,44 @@ ar2bw = CharMapper.builtin_mapper('ar2bw')
 sheet_names = ['ء', 'ب', 'ت', 'ث', 'ج', 'ح', 'خ', 'د', 'ذ', 'ر', 'ز', 'س', 'ش', 'ص',
                'ض', 'ط', 'ظ', 'ع', 'غ', 'ف', 'ق', 'ك', 'ل', 'م', 'ن', 'ه', 'و', 'ي']
 
+SNAPSHOT_DIR = 'data/snapshots'
+
+
+def _column_letter(index):
+    return gspread.utils.rowcol_to_a1(1, index + 1)[:-1]
+
+
+# Header and last known column values of a worksheet, kept in `worksheet_states` (owned by the caller) under
+# (spreadsheet id, worksheet id). A state whose LEMMA column does not have `n_rows` rows anymore is read again.
+def _get_worksheet_state(worksheet, col_names, worksheet_states, n_rows):
+    key = (worksheet.spreadsheet_id, worksheet.id)
+    state = worksheet_states.get(key)
+    if state is None or len(state['columns'].get('LEMMA', [])) != n_rows:
+        state = worksheet_states[key] = {'header': worksheet.row_values(1), 'columns': {}}
+    missing = [col_name for col_name in col_names
+               if col_name in state['header'] and col_name not in state['columns']]
+    if missing:
+        ranges = [f"{column_letter}:{column_letter}"
+                  for column_letter in (_column_letter(state['header'].index(col_name)) for col_name in missing)]
+        for col_name, values in zip(missing, worksheet.batch_get(ranges)):
+            state['columns'][col_name] = [row[0] if row else '' for row in values][1:]
+    return state
+
+
+# Groups the changed rows of a column into contiguous ranges, for a single batch_update
+def _get_changed_ranges(column_letter, values_old, values_new):
+    data, start = [], None
+    for i in range(len(values_new) + 1):
+        changed = i < len(values_new) and values_new[i] != values_old[i]
+        if changed and start is None:
+            start = i
+        elif not changed and start is not None:
+            data.append({'range': f'{column_letter}{start + 2}:{column_letter}{i + 1}',
+                         'values': [[value] for value in values_new[start:i]]})
+            start = None
+    return data
+
+
 def add_check_mark_online(rows,
                           spreadsheet,
                           sheet,
@@ -24,6 +65,7 @@ def add_check_mark_online(rows,
                           mode=None,
                           write='append',
                           status_col_name='STATUS',
+                          worksheet_states=None,
                           service_account='/Users/chriscay/.config/gspread/service_account.json'):
     assert bool(error_cases) ^ bool(indexes) ^ bool(messages)
     if error_cases is not None:
@@ -31,7 +73,7 @@ def add_check_mark_online(rows,
         indexes = filtered.index
 
     if type(spreadsheet) is str:
-        sa = gspread.service_account(service_account)
+        sa = sheets_client.service_account(service_account)
         spreadsheet = sa.open(spreadsheet)
 
     if type(sheet) is str:
@@ -39,23 +81,25 @@ def add_check_mark_online(rows,
     else:
         worksheet = sheet
 
-    header = worksheet.row_values(1)
+    # Without states kept by the caller across write-backs, the worksheet is read on every call
+    worksheet_states = worksheet_states if worksheet_states is not None else {}
+    state = _get_worksheet_state(worksheet, [status_col_name, 'LEMMA'], worksheet_states, len(rows['LEMMA']))
+    header = state['header']
     header_count = header.count(status_col_name)
     if header_count == 0:
         worksheet.insert_cols([[status_col_name]])
-        header = worksheet.row_values(1)
+        header.insert(0, status_col_name)
+        state['columns'][status_col_name] = []
     elif header_count > 1:
         raise NotImplementedError
 
     status_column_index = header.index(status_col_name)
-    column_letter = (chr(ord('A') + status_column_index // 27) if status_column_index >= 26 else '') + \
-        chr(ord('A') + status_column_index % 26)
+    column_letter = _column_letter(status_column_index)
 
-    status_old = worksheet.col_values(status_column_index + 1)[1:]
-    lemmas = worksheet.col_values(header.index('LEMMA') + 1)[1:]
+    status_old = state['columns'][status_col_name]
+    lemmas = state['columns']['LEMMA']
     status_old += [''] * (len(lemmas) - len(status_old))
     assert len(lemmas) == len(status_old) == len(rows['LEMMA'])
-    col_range = f'{column_letter}2:{len(rows.index) + 1}'
 
     if indexes:
         if mode:
@@ -63,59 +107,116 @@ def add_check_mark_online(rows,
         else:
             check, ok = 'CHECK', 'OK'
         assert set(status_old) <= {check, ok, ''}
-        status_new = [[check] if i in indexes else ([ok] if status_old[i] != check else [check])
+        status_new = [check if i in indexes else (ok if status_old[i] != check else check)
                       for i in range(len(rows['LEMMA']))]
     elif messages:
         assert len(status_old) == len(lemmas) == len(messages)
         if write == 'overwrite':
-            status_new = [[f'{message}'] if message else ['']
-                          for message in messages]
+            status_new = [f'{message}' if message else '' for message in messages]
         elif write == 'append':
-            status_new = [[f"{s}{' ' if s else ''}" + f'{message}'] if message else [s + '']
+            status_new = [f"{s}{' ' if s else ''}" + f'{message}' if message else s + ''
                           for s, message in zip(status_old, messages)]
     else:
         raise NotImplementedError
 
-    worksheet.update(col_range, status_new)
-
-
-def read_pacl_as_df(directory='data/letter_split', sheet_names=sheet_names):
-    pacl = pd.DataFrame([])
-    for sheet_name in sheet_names:
-        path = os.path.join(directory, f'{sheet_name}.csv')
-        sheet_lines_, rewrite = [], False
-        with open(path) as f:
-            for i, line in enumerate(f.readlines()):
-                if re.match(r'\d+', line) or i == 0:
-                    sheet_lines_.append(line.strip())
-                else:
-                    rewrite = True
-                    status_column_index = line.count(',') - 1
-                    col_letter = (chr(ord('A') + status_column_index // 27) if status_column_index >= 26 else '') + \
-                                  chr(ord('A') + status_column_index % 26)
-                    print(f'WARNING: New line in sheet <{sheet_name}>, cell {col_letter}{i}')
-                    sheet_lines_[-1] += line.strip()
-        
-        if rewrite:
-            with open(path, 'w') as f:
-                for line in sheet_lines_:
-                    print(line, file=f)
-
-        pacl = pd.concat([pacl, pd.read_csv(path)], ignore_index=True)
-    
-    pacl_obj = pacl.select_dtypes(['object'])
-    pacl[pacl_obj.columns] = pacl_obj.apply(lambda x: x.str.strip())
-    pacl = pacl.replace(nan, '')
-    return pacl
-
-def read_pacl_as_dfs(directory='data/letter_split', sheet_names=sheet_names):
-    pacl = {}
-    for sheet_name in sheet_names:
-        pacl[sheet_name] = pd.read_csv(os.path.join(directory, f'{sheet_name}.csv'))
-        pacl[sheet_name] = pacl[sheet_name].replace(nan, '')
-        pacl_obj = pacl[sheet_name].select_dtypes(['object'])
-        pacl[sheet_name][pacl_obj.columns] = pacl_obj.apply(lambda x: x.str.strip())
-    return pacl
+    data = _get_changed_ranges(column_letter, status_old, status_new)
+    if data:
+        worksheet.batch_update(data)
+    # Only updated once the write went through, so that a failed write is diffed again on retry
+    state['columns'][status_col_name] = status_new
+    return sum(len(d['values']) for d in data)
+
+
+# Same clean-up as the scripts used to apply to get_all_records(): everything as (stripped) strings
+def normalize_sheet_df(sheet_df, strip=True):
+    # Empty cells read from a CSV or Parquet file are NaN or None, which str() would turn into text
+    sheet_df = sheet_df.fillna('').astype(str)
+    if strip:
+        sheet_df = sheet_df.apply(lambda x: x.str.strip())
+    return sheet_df
+
+
+def _write_snapshot(sheet_df, path):
+    try:
+        sheet_df.to_parquet(f'{path}.parquet.tmp', index=False)
+        os.replace(f'{path}.parquet.tmp', f'{path}.parquet')
+        return f'{path}.parquet'
+    except ImportError:
+        # No Parquet engine (pyarrow or fastparquet) installed
+        sheet_df.to_pickle(f'{path}.pkl')
+        return f'{path}.pkl'
+
+
+def read_sheet_as_df(spreadsheet, sheet_name, snapshot_dir=SNAPSHOT_DIR, refresh=False, strip=True):
+    """Reads a worksheet as a normalized frame (see `normalize_sheet_df`) through a local snapshot.
+    The snapshot is keyed by the modified time of the spreadsheet, so it is only downloaded again
+    when the spreadsheet changed since, or when `refresh` is set."""
+    modified_time = spreadsheet.get_lastUpdateTime()
+    path = os.path.join(snapshot_dir, f'{spreadsheet.id}-{sheet_name}')
+    if not refresh and os.path.exists(f'{path}.json'):
+        with open(f'{path}.json') as f:
+            snapshot = json.load(f)
+        if snapshot['modified_time'] == modified_time and os.path.exists(snapshot['path']):
+            if snapshot['path'].endswith('.parquet'):
+                return normalize_sheet_df(pd.read_parquet(snapshot['path']), strip=strip)
+            return normalize_sheet_df(pd.read_pickle(snapshot['path']), strip=strip)
+
+    # Snapshots are stored unstripped, so that they serve both kinds of reads
+    sheet_df = normalize_sheet_df(pd.DataFrame(spreadsheet.worksheet(sheet_name).get_all_records()), strip=False)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot = {'spreadsheet': spreadsheet.title, 'sheet': sheet_name,
+                'modified_time': modified_time, 'path': _write_snapshot(sheet_df, path)}
+    with open(f'{path}.json', 'w') as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    return normalize_sheet_df(sheet_df, strip=strip)
+
+
+# Cells with line breaks are quoted in the CSV exports, they are parsed as such and the line breaks
+# (with the spaces around them) removed, as was done when the files were repaired line by line
+def _read_sheet_csv(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    sheet_df = pd.read_csv(io.BytesIO(data))
+    cells = []
+    # As many lines as rows (and header): no cell has a line break, no need to look for them
+    if data.count(b'\n') + (not data.endswith(b'\n')) - 1 <= len(sheet_df.index):
+        return sheet_df, cells
+    for j, col_name in enumerate(sheet_df.columns):
+        column = sheet_df[col_name]
+        # Text columns are `str` under pandas 3 and `object` before
+        if pd.api.types.is_string_dtype(column) or pd.api.types.is_object_dtype(column):
+            multiline = column.str.contains('\n', regex=False, na=False)
+            if multiline.any():
+                cells += [f'{_column_letter(j)}{i + 2}' for i in sheet_df.index[multiline]]
+                sheet_df[col_name] = column.where(~multiline, column.str.replace(r'\s*\n\s*', '', regex=True))
+    return sheet_df, cells
+
+
+def _read_sheet_csvs(directory, sheet_names, max_workers=8):
+    paths = [os.path.join(directory, f'{sheet_name}.csv') for sheet_name in sheet_names]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_read_sheet_csv, paths))
+    for sheet_name, (_, cells) in zip(sheet_names, results):
+        for cell in cells:
+            print(f'WARNING: New line in sheet <{sheet_name}>, cell {cell}')
+    return [sheet_df for sheet_df, _ in results]
+
+
+# The text columns are stripped as a single flattened column, rather than column by column
+def _normalize_pacl(pacl):
+    pacl_obj = pacl.select_dtypes(['object', 'string'])
+    pacl[pacl_obj.columns] = pd.Series(pacl_obj.to_numpy().ravel(), dtype=object).str.strip().to_numpy().reshape(pacl_obj.shape)
+    return pacl.fillna('')
+
+
+def read_pacl_as_df(directory='data/letter_split', sheet_names=sheet_names, max_workers=8):
+    pacl = pd.concat(_read_sheet_csvs(directory, sheet_names, max_workers), ignore_index=True)
+    return _normalize_pacl(pacl)
+
+
+def read_pacl_as_dfs(directory='data/letter_split', sheet_names=sheet_names, max_workers=8):
+    return {sheet_name: _normalize_pacl(sheet_df)
+            for sheet_name, sheet_df in zip(sheet_names, _read_sheet_csvs(directory, sheet_names, max_workers))}
 
 
 def lexpos2lexpostype(lexpos):
@@ -195,14 +296,3 @@ def preprocessing_pacl(pacl):
 def index2letter(index):
     return (chr(ord('A') + index // 27) if index >= 26 else '') + chr(ord('A') + index % 26)
 
-
-def try_google_api_until_succeded(func, *args):
-    while True:
-        try:
-            func(*args)
-            break
-        except gspread.exceptions.APIError as e:
-            if 'Quota exceeded' in e.args[0]['message']:
-                wait = 90
-                print(f'Quota exceeded, waiting for {wait} seconds and then retrying...')
-                time.sleep(wait)
\ No newline at end of file
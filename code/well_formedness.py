@@ -1,13 +1,23 @@
 import re
+import os
+import json
+import hashlib
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
+import numpy as np
 import pandas as pd
 from numpy import nan
-import gspread
 
 from camel_tools.utils.charmap import CharMapper
 
 import utils
+import sheets_client
+from caphi import CaphiTransducer
+from duplicates import DuplicateIndex, blocking_columns, normalize_keys
+from root_matcher import is_subsequence, next_positions, radical_pattern
+from morph_index import MORPH_INDEX_PATH, MorphIndex, is_morph_index
 
 bw2ar = CharMapper.builtin_mapper('bw2ar')
 ar2bw = CharMapper.builtin_mapper('ar2bw')
@@ -46,230 +56,606 @@ POS = {"ABBREV", "ADJ", "ADJ_COMP", "ADJ_NUM", "ADV", "ADV_INTERROG", "ADV_REL",
 
 essential_columns = ['ROOT', 'LEMMA', 'FORM', 'CAPHI++', 'ANALYSIS', 'GLOSS']
 
-def _root_well_formedness_check(root, lemma_norm):
-    if not root:
-        return 'root-empty'
+ROW_RULE_GROUPS = ['root', 'caphi', 'diacritics']
+CROSS_ROW_RULE_GROUPS = ['aspect_paradigm', 'nom_paradigm', 'lemma_form', 'duplicates', 'near_duplicates']
+
+ROOT_RULES = ['root-invalid', 'possible-root-lemma-mismatch', 'root-not-msa']
+CAPHI_RULES = ['caphi-invalid-char', 'caphi-too-many-alternatives', 'caphi-invalid-seq']
+DIACRITIZATION_RULES = ['more-than-2-consec-cons', 'consecutive-diacritics', 'defective-no-diac', 'hamzat-wasl',
+                        'oo-possible-mistake', 'ee-possible-mistake', 'possible-final-gem-missing']
+
+# One bit per consonant, so that the radicals of a root and the consonants of a lemma are compared as bitmasks
+RADICAL_BITS = {radical: 1 << i for i, radical in enumerate(consonants_ar)}
+hamza_normalize_map = str.maketrans({hamza: bw2ar("'") for hamza in hamzas_ar})
+
+# Every pattern consumes a single character (the rest of its context is looked ahead) and patterns starting
+# with the same character are mutually exclusive, so one finditer() pass reports the hits of all of them
+DIACRITIZATION_PATTERNS = [
+    ('consec_cons', f'[{consonants_no_def_madda_ar}](?=[{consonants_no_def_madda_ar}])'),
+    ('consec_diac', f'[{diacritics_no_gem_ar}](?=[{diacritics_no_gem_ar}])'),
+    ('ay', f'{fatHa_ar}(?=ي(?!{sukuwn_ar}))'),
+    ('aw', f'{fatHa_ar}(?=و(?!{sukuwn_ar}))'),
+    ('iA', f'{kasra_ar}(?={Alif_ar}(?!{sukuwn_ar}))'),
+    ('defective_ya', f'(?<!{kasra_ar})ي(?=[{consonants_no_def_ar}])'),
+    ('ya', 'ي'),
+    ('defective_waw', f'(?<!{Damma_ar})و(?=[{consonants_no_def_ar}])'),
+    ('waw', 'و'),
+    ('alif', Alif_ar),
+    ('hamzat_wasl', f'^{hamzat_wasl_ar}'),
+]
+DIACRITIZATION_PATTERN_BITS = {name: 1 << i for i, (name, _) in enumerate(DIACRITIZATION_PATTERNS)}
+diacritization_scanner = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in DIACRITIZATION_PATTERNS))
+
+# Columns read by the rules, a row is checked again by run_checks_incremental() when one of them changed
+FINGERPRINT_COLUMNS = ['ROOT', 'ROOT_NTWS', 'LEMMA', 'FORM', 'CAPHI++', 'ANALYSIS', 'GLOSS']
+# Cross-row rules whose codes end with a reference to another row
+REF_CODES = {'more-than-one', 'missing-singular', 'missing-lemma-form', 'possible-duplicates',
+             'possible-caphi-duplicates', 'possible-normalized-duplicates', 'possible-near-duplicates'}
+# Codes which are only reported (e.g., by maknuune_check.py) and not written to the STATUS column, until
+# they have been checked against the sheet: one edit apart spellings also match legitimate paradigm neighbours
+REPORT_ONLY_CODES = {'possible-near-duplicates'}
+FINGERPRINT_DIR = 'data/fingerprints'
+# To be increased when a rule changes, so that the results kept in the fingerprint stores are not reused
+RULES_VERSION = 2
+
+MSA_ROOTS_PATH = '/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/camel_morph/misc_files/Roots.csv'
+CAPHI_TABLE_PATH = 'caphi_table.csv'
+
+# Resources of the root and CAPHI++ rules, see load_resources()
+msa_roots = set()
+caphi_inventory, caphi_transducer = None, None
+
+
+def radical_mask(text):
+    mask = 0
+    for c in set(text):
+        mask |= RADICAL_BITS.get(c, 0)
+    return mask
+
+
+# Validity (2 to 4 consonants), radical pattern (see root_matcher), bitmask of the pattern and MSA membership
+# of each distinct root. The mask is -1 when a radical of the pattern is not a single consonant, the pattern
+# is then looked up as substrings.
+def _root_table(roots):
+    valid, patterns, required, msa = [], [], [], []
+    for root in roots:
+        radicals = root.split('.')
+        valid.append(2 <= len(radicals) <= 4 and all(r in RADICAL_BITS for r in radicals))
+        patterns.append(radical_pattern(root))
+        required.append(radical_mask(patterns[-1]) if all(r in RADICAL_BITS for r in patterns[-1]) else -1)
+        msa.append(root.replace('.', '') in msa_roots)
+    return np.array(valid, dtype=bool), patterns, np.array(required, dtype=np.int64), np.array(msa, dtype=bool)
+
+
+# The rules are computed once per distinct root, lemma or (root, lemma) pair, then spread over the rows
+def _root_well_formedness_checks(root, lemma_norm):
+    checks = pd.DataFrame(False, index=root.index, columns=ROOT_RULES)
+    checked = ((root != '') & (root != 'NTWS')).values
+    root_codes, roots = pd.factorize(root)
+    lemma_codes, lemmas = pd.factorize(lemma_norm)
+    valid, patterns, required, msa = _root_table(roots)
+    valid, required, msa = valid[root_codes], required[root_codes], msa[root_codes]
+    lemma_masks = np.array([radical_mask(lemma) for lemma in lemmas], dtype=np.int64)[lemma_codes]
+    # The bitmasks rule out the lemmas missing a radical, the others must have the radicals in the root order
+    mismatch = (required & ~lemma_masks) != 0
+    n_lemmas = len(lemmas)
+    ordered = np.flatnonzero(checked & (required >= 0) & ~mismatch)
+    pairs, pair_codes = np.unique(root_codes[ordered] * n_lemmas + lemma_codes[ordered], return_inverse=True)
+    lemma2table = {lemma_code: next_positions(lemmas[lemma_code]) for lemma_code in np.unique(pairs % n_lemmas)}
+    mismatch[ordered] = np.array([not is_subsequence(patterns[pair // n_lemmas], lemma2table[pair % n_lemmas])
+                                  for pair in pairs], dtype=bool)[pair_codes]
+    fallback = np.flatnonzero(checked & (required < 0))
+    mismatch[fallback] = [not all(r in lemma_norm_ for r in radical_pattern(root_))
+                          for root_, lemma_norm_ in zip(root.values[fallback], lemma_norm.values[fallback])]
+    checks['root-invalid'] = checked & ~valid
+    checks['possible-root-lemma-mismatch'] = checked & mismatch
+    checks['root-not-msa'] = checked & ~msa
+    return checks
+
+
+# Inventory candidate roots are drawn from: the valid roots of the lexicon (with their number of rows) and the MSA roots
+def root_inventory(lexicon):
+    roots = lexicon['ROOT'].where(lexicon['ROOT'] != 'NTWS', lexicon.get('ROOT_NTWS', ''))
+    root2count = {'.'.join(root): 0 for root in msa_roots}
+    root2count.update(roots.value_counts().to_dict())
+    valid = _root_table(root2count)[0]
+    return {root: count for (root, count), valid_ in zip(root2count.items(), valid) if valid_}
 
-    message = ''
-    if root != 'NTWS':
-        if not bool(re.match(f'^([{consonants_ar}]\\.)' + '{1,3}' + f'[{consonants_ar}]$', root)):
-            message += 'root-invalid'
-        
-        if not all(r in lemma_norm for r in root.split('.') if r not in defective):
-            message += (' ' if message else '') + 'possible-root-lemma-mismatch'
 
-        if root.replace('.', '') not in msa_roots:
-            message += (' ' if message else '') + 'root-not-msa'
-
-    return message
+def _caphi_well_formedness_check(caphi):
+    if not caphi_transducer.is_valid(caphi):
+        return 'caphi-invalid-char'
 
+    for caphi_split in caphi_transducer.tokenize(caphi):
+        if caphi_transducer.has_too_many_expansions(caphi_split):
+            return 'caphi-too-many-alternatives'
+        # Expansions are generated lazily so the check stops at the first invalid one
+        for expansion in caphi_transducer.iter_expansions(caphi_split):
+            if re.search(r'c{4,}|v{2,}', caphi_transducer.types(expansion)):
+                return 'caphi-invalid-seq'
 
-def _caphi_well_formedness_check(caphi):
-    expansions = _get_caphi(caphi.replace('II', '||'))
-    for caphi_split in expansions:
-        if not all(cc in caphi_inventory for c in caphi_split for cc in c.split('||')):
-            return 'caphi-invalid-char'
-
-        tags = ''.join(caphi_inventory[c.split('||')[0]] if '||' in c else caphi_inventory[c]
-                        for c in caphi_split)
-        match = re.search(r'c{4,}|v{2,}', tags)
-        if match:
-            return 'caphi-invalid-seq'
-    
     return ''
 
-def _get_caphi(caphi):
-    expansions = []
-    for caphi_ in caphi.split(','):
-        caphi_ = caphi_.strip()
-        caphi_split = caphi_.split()
-        expansions_ = [caphi_split]
-        if '||' in caphi_:
-            expansions_ = _expand_caphi(caphi_split)
-        expansions += expansions_
-    
-    return expansions
-
-def _expand_caphi(caphi_split):
-    expansions = [[]]
-    for c in caphi_split:
-        for expansion in expansions:
-            if '||' not in c:
-                expansion.append(c)
-            else:
-                expansions_ = []
-                for cc in c.split('||'):
-                    expansions_.append(expansions[-1][:] + [cc])
-                expansions = expansions_
-    return expansions
-
-
-def _aspect_paradigm_completion_well_formedness_check(lexicon_split, status_split):
-    aspect2lemmas = {}
-    for i, row in lexicon_split.iterrows():
-        if re.match(r'^VERB:[PIC]$', row['ANALYSIS'].strip()):
-            aspect2lemmas.setdefault(row['ANALYSIS'], {}).setdefault(row['LEMMA'], []).append(i)
-    
-    for asp, lemmas in aspect2lemmas.items():
-        for lemma, indexes in lemmas.items():
+
+def _caphi_well_formedness_checks(caphi):
+    caphi_status = caphi_transducer.map_column(caphi, _caphi_well_formedness_check)
+    checks = pd.DataFrame({code: (caphi != '') & (caphi_status == code) for code in CAPHI_RULES},
+                          index=caphi.index)
+    return checks
+
+
+class LexiconIndex:
+    """Lemma/analysis index of a lexicon, built in a single pass and shared by the cross-row rules.
+
+    The lexicon may be the concatenation of several sheets (see `well_formedness_sheets`), in which
+    case its index labels are (sheet, row) pairs and references to other rows name their sheet.
+    """
+    def __init__(self, lexicon):
+        self.lemma2rows = {}
+        self.lemma2analysis2indexes = {}
+        self.lemma2forms = {}
+        for i, lemma, analysis, form in zip(lexicon.index, lexicon['LEMMA'], lexicon['ANALYSIS'], lexicon['FORM']):
+            analysis = ':'.join(x.strip() for x in analysis.split(':'))
+            self.lemma2rows.setdefault(lemma, []).append((analysis, i))
+            self.lemma2analysis2indexes.setdefault(lemma, {}).setdefault(analysis, []).append(i)
+            self.lemma2forms.setdefault(lemma, set()).add(form)
+
+    @staticmethod
+    def ref(index):
+        return f'{index[0]}!{index[1]}' if isinstance(index, tuple) else f'{index}'
+
+
+def _aspect_paradigm_completion_well_formedness_check(lexicon_index):
+    hits = []
+    for analysis2indexes in lexicon_index.lemma2analysis2indexes.values():
+        aspect2indexes = {aspect: analysis2indexes[aspect]
+                          for aspect in ['VERB:P', 'VERB:I', 'VERB:C'] if aspect in analysis2indexes}
+        for indexes in aspect2indexes.values():
             if len(indexes) > 1:
-                for index in indexes:
-                    status_split[index] += (' ' if status_split[index] else '') + f"more-than-one:{indexes[0]}"
-    
-    aspect2lemmas['VERB:IC'] = {}
-    for aspect2lemmas_ in [aspect2lemmas['VERB:I'], aspect2lemmas['VERB:C']]:
-        for lemma, indexes in aspect2lemmas_.items():
-            x = aspect2lemmas['VERB:IC'].setdefault(lemma, [])
-            x += indexes
-
-    for perm in [('VERB:C', 'VERB:I'), ('VERB:I', 'VERB:C'), ('VERB:P', 'VERB:IC'), ('VERB:IC', 'VERB:P')]:
-        for lemma in set(aspect2lemmas[perm[0]]) - set(aspect2lemmas[perm[1]]):
-            indexes = aspect2lemmas[perm[0]][lemma]
-            for index in indexes:
-                status_split[index] += (' ' if status_split[index] else '') + f"missing:{perm[1]}"
-
-
-def _nom_paradigm_completion_well_formedness_check(lexicon_split, status_split):
-    lemma2info = {}
-    for i, row in lexicon_split.iterrows():
-        if re.match(r'NOUN:', row['ANALYSIS']):
-            lemma2info.setdefault(row['LEMMA'], []).append((row['ANALYSIS'], i))
-    
-    missing_cases = [[row[1] for row in info]
-                     for info in lemma2info.values()
-                     if 'NOUN:PL' in info[0] and len({'NOUN:MS', 'NOUN:FS'} & set(info[0])) == 0]
-
-    for missing_case in missing_cases:
-        for index in missing_case:
-            status_split[index] += (' ' if status_split[index] else '') + f"missing-singular:{missing_case[0]}"
-    pass
-
-
-def _lemma_form_well_formedness_check(lexicon_split, status_split):
-    lemma2forms = {}
-    for i, row in lexicon_split.iterrows():
-        lemma2forms.setdefault(row['LEMMA'], []).append((row['FORM'], i))
-
-    missing_cases = [[row[1] for row in forms]
-                     for lemma, forms in lemma2forms.items() if lemma not in [form[0] for form in forms]]
-
-    for missing_case in missing_cases:
-        for index in missing_case:
-            status_split[index] += (' ' if status_split[index] else '') + f"missing-lemma-form:{missing_case[0]}"
-    pass
+                hits += [(index, f"more-than-one:{lexicon_index.ref(indexes[0])}") for index in indexes]
+
+        if 'VERB:I' in aspect2indexes or 'VERB:C' in aspect2indexes:
+            aspect2indexes['VERB:IC'] = aspect2indexes.get('VERB:I', []) + aspect2indexes.get('VERB:C', [])
+        for perm in [('VERB:C', 'VERB:I'), ('VERB:I', 'VERB:C'), ('VERB:P', 'VERB:IC'), ('VERB:IC', 'VERB:P')]:
+            if perm[0] in aspect2indexes and perm[1] not in aspect2indexes:
+                hits += [(index, f"missing:{perm[1]}") for index in aspect2indexes[perm[0]]]
+    return hits
+
+
+def _nom_paradigm_completion_well_formedness_check(lexicon_index):
+    hits = []
+    for rows in lexicon_index.lemma2rows.values():
+        noms = [(analysis, index) for analysis, index in rows if analysis.startswith('NOUN:')]
+        analyses = {analysis for analysis, _ in noms}
+        if 'NOUN:PL' in analyses and not {'NOUN:MS', 'NOUN:FS'} & analyses:
+            indexes = [index for _, index in noms]
+            hits += [(index, f"missing-singular:{lexicon_index.ref(indexes[0])}") for index in indexes]
+    return hits
+
+
+def _lemma_form_well_formedness_check(lexicon_index):
+    hits = []
+    for lemma, rows in lexicon_index.lemma2rows.items():
+        if lemma not in lexicon_index.lemma2forms[lemma]:
+            indexes = [index for _, index in rows]
+            hits += [(index, f"missing-lemma-form:{lexicon_index.ref(indexes[0])}") for index in indexes]
+    return hits
+
+
+def _scan_diacritization(text):
+    hits = 0
+    for match in diacritization_scanner.finditer(text):
+        hits |= DIACRITIZATION_PATTERN_BITS[match.lastgroup]
+    return hits
+
+
+def _diacritization_checks(text, caphi, is_phrase):
+    # Every distinct text is scanned once, the rules are then combinations of the pattern hits
+    codes, uniques = pd.factorize(text)
+    hits = np.array([_scan_diacritization(t) for t in uniques], dtype=np.int64)[codes]
+    hit = {name: pd.Series((hits & bit) != 0, index=text.index)
+           for name, bit in DIACRITIZATION_PATTERN_BITS.items()}
+    ya, waw = hit['defective_ya'] | hit['ya'], hit['defective_waw'] | hit['waw']
+
+    checks = pd.DataFrame(index=text.index)
+    checks['more-than-2-consec-cons'] = hit['consec_cons']
+    #TODO: fix so that it works on two letter sequences like $w
+    checks['consecutive-diacritics'] = hit['consec_diac']
+    checks['defective-no-diac'] = (hit['defective_ya'] | hit['defective_waw']) & ~hit['ay'] & ~hit['aw']
+    checks['hamzat-wasl'] = hit['hamzat_wasl']
+    checks['oo-possible-mistake'] = ~is_phrase & caphi.str.contains('oo', regex=False) & waw & ~hit['aw']
+    checks['ee-possible-mistake'] = ~is_phrase & caphi.str.contains('ee', regex=False) & (
+        ya & ~hit['ay'] | hit['alif'] & ~hit['iA'])
+    checks['possible-final-gem-missing'] = ~is_phrase & (text.str[-1] != shadda_ar) & \
+        caphi.str.match(r'.*?([^ ]+) \1$')
+    return checks
 
 
 def _diacritization_check(text, field, caphi, is_phrase):
-    message = ''
-    if re.search(f'[{consonants_no_def_madda_ar}][{consonants_no_def_madda_ar}]', text):
-        message += (' ' if message else '') + f'{field}:more-than-2-consec-cons'
-    #TODO: fix so that it works on two letter sequences like $w
-    if re.search(f'[{diacritics_no_gem_ar}][{diacritics_no_gem_ar}]', text):
-        message += (' ' if message else '') + f'{field}:consecutive-diacritics'
-    if re.search(f"(?<!{diacritics_no_gem_ar[diacritics_no_gem_bw.index('i')]})[ي][{consonants_no_def_ar}]", text) or \
-       re.search(f"(?<!{diacritics_no_gem_ar[diacritics_no_gem_bw.index('u')]})[و][{consonants_no_def_ar}]", text):
-        if not ee_regex_ay.search(text) and not oo_regex.search(text):
-            message += (' ' if message else '') + f'{field}:defective-no-diac'
-    if re.search(f"^{hamzat_wasl_ar}", text):
-        message += (' ' if message else '') + f'{field}:hamzat-wasl'
-    if not is_phrase and 'oo' in caphi and 'و' in text and not oo_regex.search(text):
-        message += (' ' if message else '') + f'{field}:oo-possible-mistake'
-    if not is_phrase and 'ee' in caphi and ('ي' in text and not ee_regex_ay.search(text) or 'ا' in text and not ee_regex_iA.search(text)):
-        message += (' ' if message else '') + f'{field}:ee-possible-mistake'
-    if not is_phrase and text[-1] != shadda_ar and re.search(r'([^ ]+) \1$', caphi):
-        message += (' ' if message else '') + f'{field}:possible-final-gem-missing'
-    
-    return message
-
-
-def _duplicates_check(lexicon_split, status_split):
-    entry2indexes_caphi = {}
-    for i, row in lexicon_split.iterrows():
-        analysis = ':'.join(x.strip() for x in row['ANALYSIS'].split(':'))
-        entry2indexes_caphi.setdefault((analysis, row['LEMMA'], row['FORM']), []).append((i, row['CAPHI++']))
-    
-    for entry, indexes_caphi in entry2indexes_caphi.items():
-        if len(indexes_caphi) > 1:
-            caphi2indexes = {}
-            for index, caphi in indexes_caphi:
-                caphi2indexes.setdefault(caphi, []).append(index)
-            
-            for caphi, indexes in {caphi: indexes for caphi, indexes in caphi2indexes.items() if len(indexes) > 1}.items():
-                for index in indexes:
-                    status_split[index] += (' ' if status_split[index] else '') + f"possible-duplicates:{indexes[0]}"
-            
-            key = next(iter(caphi2indexes))
-            index_select = caphi2indexes[key][0]
-            for caphi, indexes in {caphi: indexes for caphi, indexes in caphi2indexes.items() if len(indexes) == 1}.items():
-                for index in indexes:
-                    status_split[index] += (' ' if status_split[index] else '') + f"possible-caphi-duplicates:{index_select}"
+    checks = _diacritization_checks(pd.Series([text]), pd.Series([caphi]), pd.Series([is_phrase]))
+    return ' '.join(f'{field}:{code}' for code in DIACRITIZATION_RULES if checks[code].iloc[0])
+
+
+def _add_initial_diacritics(text, field, analysis):
+    #TODO: at some point debug without these
+    first, second = text.str[0], text.str[1]
+    text = text.copy()
+    alif_hamza_above = (first == 'أ') & (second != 'َ') & (second != 'ُ')
+    alif_hamza_below = ~alif_hamza_above & (first == 'إ') & (second != 'ِ')
+    text[alif_hamza_above] = 'أَ' + text[alif_hamza_above].str[1:]
+    text[alif_hamza_below] = 'إِ' + text[alif_hamza_below].str[1:]
+    if field == 'form':
+        imperfective_ya = ~alif_hamza_above & ~alif_hamza_below & (analysis == 'VERB:I') & \
+            (first == 'ي') & ~second.isin(list('َُِْ'))
+        text[imperfective_ya] = 'يْ' + text[imperfective_ya].str[1:]
+    return text
+
+
+def _duplicates_check(lexicon_index, duplicate_index, near_duplicates=True):
+    hits = duplicate_index.exact_duplicates() + duplicate_index.normalized_duplicates()
+    if near_duplicates:
+        hits += duplicate_index.near_duplicates()
+    return [(index, f"{code}:{lexicon_index.ref(ref)}") for index, code, ref in hits]
+
+
+# Runs the row-local rules column-wise over the whole sheet, returns a rows x rule codes boolean matrix
+def row_checks(lexicon_split, root=True, caphi=True, diacritics=True):
+    checks = []
+    if root:
+        checks.append(_root_well_formedness_checks(lexicon_split['ROOT'], lexicon_split['LEMMA_NORM']))
+    if caphi:
+        checks.append(_caphi_well_formedness_checks(lexicon_split['CAPHI++']))
+
+    analysis = lexicon_split['ANALYSIS']
+    checks.append(pd.DataFrame({'faulty-analysis': ~analysis.str.split(':').str[0].isin(POS)}))
+    checks.append(pd.DataFrame({f'missing-{c}': lexicon_split[c].str.strip() == '' for c in essential_columns}))
+
+    is_phrase = analysis.str.contains('PHRASE', regex=False)
+    for f in ['form', 'lemma']:
+        text = lexicon_split[f.upper()]
+        checked = ~is_phrase if f == 'form' else pd.Series(True, index=text.index)
+        checks.append(pd.DataFrame({f'{f}-missing': checked & (text == '')}))
+        if diacritics:
+            checked &= text != ''
+            diacritization = _diacritization_checks(
+                _add_initial_diacritics(text, f, analysis), lexicon_split['CAPHI++'], is_phrase)
+            checks.append(diacritization.where(checked, False).add_prefix(f'{f}:'))
+
+    return pd.concat(checks, axis=1)
+
+
+# Renders the STATUS messages from the boolean matrix and the (index, code) hits of the cross-row rules
+def render_status(checks, hits=()):
+    status = pd.Series('', index=checks.index, dtype=object)
+    for code, check in checks.items():
+        status[check] += f'{code} '
+    index2codes = {}
+    for index, code in hits:
+        if code.split(':', 1)[0] not in REPORT_ONLY_CODES:
+            index2codes.setdefault(index, []).append(code)
+    if index2codes:
+        status += pd.Series({index: ' '.join(codes) for index, codes in index2codes.items()},
+                            dtype=object).reindex(checks.index, fill_value='')
+    return status.str.strip().tolist()
+
+
+# Runs the rules over a lexicon, returns the boolean matrix of the row-local rules and the (index, code) hits
+# of the cross-row rules, which render_status() turns into the STATUS messages
+def run_checks(lexicon,
+               lexicon_index=None,
+               root=True,
+               caphi=True,
+               diacritics=True,
+               aspect_paradigm=True,
+               nom_paradigm=True,
+               lemma_form=True,
+               duplicates=True,
+               near_duplicates=True):
+    checks = row_checks(lexicon, root=root, caphi=caphi, diacritics=diacritics)
+    if lexicon_index is None:
+        lexicon_index = LexiconIndex(lexicon)
+    hits = cross_row_checks(lexicon, lexicon_index, aspect_paradigm=aspect_paradigm, nom_paradigm=nom_paradigm,
+                            lemma_form=lemma_form, duplicates=duplicates, near_duplicates=near_duplicates)
+    return checks, hits
+
+
+def cross_row_checks(lexicon,
+                     lexicon_index,
+                     aspect_paradigm=True,
+                     nom_paradigm=True,
+                     lemma_form=True,
+                     duplicates=True,
+                     near_duplicates=True):
+    hits = []
+    if aspect_paradigm:
+        hits += _aspect_paradigm_completion_well_formedness_check(lexicon_index)
+    if nom_paradigm:
+        hits += _nom_paradigm_completion_well_formedness_check(lexicon_index)
+    if lemma_form:
+        hits += _lemma_form_well_formedness_check(lexicon_index)
+    if duplicates:
+        hits += _duplicates_check(lexicon_index, DuplicateIndex(lexicon), near_duplicates=near_duplicates)
+    return hits
+
+
+def check_lexicon(lexicon, lexicon_index=None, **kwargs):
+    return render_status(*run_checks(lexicon, lexicon_index, **kwargs))
+
+
+# Worker processes do not inherit the resources when they are spawned rather than forked
+def init_worker(msa_roots_, caphi_inventory_):
+    global msa_roots, caphi_inventory, caphi_transducer
+    msa_roots, caphi_inventory = msa_roots_, caphi_inventory_
+    caphi_transducer = CaphiTransducer(caphi2type=caphi_inventory) if caphi_inventory is not None else None
+
+
+# Shards of a lexicon: its sheets if it is the concatenation of several, else `n_shards` chunks of rows
+def split_lexicon(lexicon, n_shards):
+    if isinstance(lexicon.index, pd.MultiIndex):
+        return [shard for _, shard in lexicon.groupby(level=0, sort=False)]
+    return [lexicon.iloc[chunk] for chunk in np.array_split(np.arange(len(lexicon.index)), n_shards) if len(chunk)]
+
+
+def run_checks_sharded(lexicon, lexicon_index=None, jobs=None, n_shards=None, **kwargs):
+    """Same as `run_checks`, with the row-local rules run over shards of the lexicon (see `split_lexicon`)
+    in a process pool. The cross-row rules need the whole lexicon, they are run here in the meantime
+    and their hits reduced with the concatenated check matrices of the shards."""
+    jobs = jobs or os.cpu_count()
+    row_kwargs = {group: kwargs.pop(group) for group in ROW_RULE_GROUPS if group in kwargs}
+    shards = split_lexicon(lexicon, n_shards or jobs)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(msa_roots, caphi_inventory)) as executor:
+        # Largest shards first so that the pool is not left waiting on a large one at the end
+        futures = {i: executor.submit(row_checks, shard, **row_kwargs)
+                   for i, shard in sorted(enumerate(shards), key=lambda x: -len(x[1].index))}
+        if lexicon_index is None:
+            lexicon_index = LexiconIndex(lexicon)
+        hits = cross_row_checks(lexicon, lexicon_index, **kwargs)
+        checks = pd.concat([futures[i].result() for i in range(len(shards))])
+    return checks, hits
+
+
+# Rows are fingerprinted by ID. Repeated IDs (e.g., the 'Auto' rows of add_entries.py) are completed with
+# the fingerprint of the row, so that their keys do not depend on the other rows with the same ID.
+def row_keys(lexicon, fingerprints):
+    ids = lexicon['ID'] if 'ID' in lexicon.columns else pd.Series('', index=lexicon.index)
+    keys = ids.where(~ids.duplicated(keep=False), ids + '#' + pd.Series(fingerprints, index=ids.index).astype(str))
+    occurrence = keys.groupby(keys, sort=False).cumcount()
+    return keys.where(occurrence == 0, keys + '#' + occurrence.astype(str)).tolist()
+
+
+def row_fingerprints(lexicon):
+    columns = [c for c in FINGERPRINT_COLUMNS if c in lexicon.columns]
+    return pd.util.hash_pandas_object(lexicon[columns], index=False).tolist()
+
+
+# Groups the cross-row rules work in: the normalized lemma (paradigm, lemma form, exact and normalized
+# duplicates rules) and the (analysis, normalized root) block (near duplicates rule)
+def group_keys(lexicon):
+    roots, analyses = blocking_columns(lexicon)
+    return normalize_keys(lexicon['LEMMA']), analyses + '\t' + normalize_keys(roots)
+
+
+# Rows left out of a longest increasing subsequence of their previous positions, i.e., the rows which moved
+def _moved_rows(positions):
+    tails, tail_rows, previous = [], [], [-1] * len(positions)
+    for i, position in enumerate(positions):
+        j = bisect_left(tails, position)
+        if j == len(tails):
+            tails.append(position)
+            tail_rows.append(i)
+        else:
+            tails[j], tail_rows[j] = position, i
+        previous[i] = tail_rows[j - 1] if j else -1
+    moved = np.ones(len(positions), dtype=bool)
+    i = tail_rows[-1] if tail_rows else -1
+    while i != -1:
+        moved[i] = False
+        i = previous[i]
+    return moved
+
+
+def _fingerprints_config(rules):
+    return hashlib.md5(repr((RULES_VERSION, sorted(rules.items()), sorted(msa_roots),
+                             sorted((caphi_inventory or {}).items()))).encode('utf-8')).hexdigest()
+
+
+def load_fingerprints(path, config):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        store = json.load(f)
+    # Rows checked with other rules or resources are all checked again
+    return store if store.get('config') == config else {}
+
+
+def save_fingerprints(path, store):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(json.dumps(store, ensure_ascii=False))
+    os.replace(f'{path}.tmp', path)
+
+
+def run_checks_incremental(lexicon, fingerprints_path, **kwargs):
+    """Same as `run_checks`, but only the rows which changed since the last run are checked again.
+
+    The store at `fingerprints_path` holds, for every row of the last run (see `row_keys`), a hash of its
+    checked columns, its groups (see `group_keys`) and its results. New and changed rows go through the
+    row-local rules, and the cross-row rules are run over the groups holding a new, changed, deleted or
+    moved row (references name the first row of a group); the results of the other rows come from the
+    store, which is then updated. Everything is checked again when the rules or the resources changed.
+    Also returns the number of rows checked by the row-local and by the cross-row rules.
+    """
+    rules = {group: kwargs.get(group, True) for group in ROW_RULE_GROUPS + CROSS_ROW_RULE_GROUPS}
+    config = _fingerprints_config(rules)
+    fingerprints = row_fingerprints(lexicon)
+    keys = row_keys(lexicon, fingerprints)
+    lemma_keys, blocks = group_keys(lexicon)
+    store = load_fingerprints(fingerprints_path, config)
+
+    key2position = {key: position for position, key in enumerate(store.get('keys', []))}
+    positions = np.array([key2position.get(key, -1) for key in keys], dtype=np.int64)
+    unchanged = np.array([position >= 0 and store['fingerprints'][position] == fingerprint
+                          for position, fingerprint in zip(positions, fingerprints)], dtype=bool)
+    changed = ~unchanged
+    stale = np.ones(len(key2position), dtype=bool)
+    stale[positions[unchanged]] = False
+    moved = np.zeros(len(keys), dtype=bool)
+    moved[unchanged] = _moved_rows(positions[unchanged])
+    lemma_rows = lemma_keys.isin(set(lemma_keys[changed | moved]) |
+                                 {store['lemma_keys'][position] for position in np.flatnonzero(stale)}).values
+    block_rows = blocks.isin(set(blocks[changed | moved]) |
+                             {store['blocks'][position] for position in np.flatnonzero(stale)}).values
+
+    checks_changed = row_checks(lexicon[changed], **{group: rules[group] for group in ROW_RULE_GROUPS})
+    code2column = {code: j for j, code in enumerate(checks_changed.columns)}
+    checks = np.zeros((len(keys), len(code2column)), dtype=bool)
+    checks[changed] = checks_changed.values
+    cached = [(i, code2column[code]) for i in np.flatnonzero(unchanged) for code in store['codes'][positions[i]]]
+    if cached:
+        checks[tuple(np.array(cached).T)] = True
+
+    lexicon_lemmas, lexicon_blocks = lexicon[lemma_rows], lexicon[block_rows]
+    lemma_hits = cross_row_checks(lexicon_lemmas, LexiconIndex(lexicon_lemmas), near_duplicates=False, **{
+        group: rules[group] for group in CROSS_ROW_RULE_GROUPS if group != 'near_duplicates'})
+    block_hits = []
+    if rules['duplicates'] and rules['near_duplicates']:
+        block_hits = [(index, f"{code}:{LexiconIndex.ref(ref)}")
+                      for index, code, ref in DuplicateIndex(lexicon_blocks).near_duplicates()]
+
+    # Cross-row hits are stored with the keys of the rows they reference, as the row indexes shift
+    ref2key = {LexiconIndex.ref(index): key for index, key in zip(lexicon.index, keys)}
+    key2ref = {key: ref for ref, key in ref2key.items()}
+    def store_code(code):
+        name, _, ref = code.partition(':')
+        return f'{name}:{ref2key[ref]}' if name in REF_CODES else code
+    def load_code(code):
+        name, _, key = code.partition(':')
+        return f'{name}:{key2ref[key]}' if name in REF_CODES else code
+
+    labels = lexicon.index.tolist()
+    index2i = {index: i for i, index in enumerate(labels)}
+    hits, stored_hits = [], {}
+    for rows, hits_split, field in [(lemma_rows, lemma_hits, 'lemma_hits'), (block_rows, block_hits, 'block_hits')]:
+        codes = [[] for _ in keys]
+        for index, code in hits_split:
+            codes[index2i[index]].append(store_code(code))
+        cached = np.flatnonzero(~rows)
+        for i in cached:
+            codes[i] = store[field][positions[i]]
+        hits_split += [(labels[i], load_code(code)) for i in cached for code in codes[i]]
+        hits += hits_split
+        stored_hits[field] = codes
+
+    if changed.any() or keys != store.get('keys'):
+        row2codes = [[] for _ in keys]
+        for i, j in zip(*np.nonzero(checks)):
+            row2codes[i].append(checks_changed.columns[j])
+        save_fingerprints(fingerprints_path, {'config': config, 'keys': keys, 'fingerprints': fingerprints,
+                                              'lemma_keys': lemma_keys.tolist(), 'blocks': blocks.tolist(),
+                                              'codes': row2codes, **stored_hits})
+
+    checks = pd.DataFrame(checks, index=lexicon.index, columns=checks_changed.columns)
+    return checks, hits, (int(changed.sum()), int((lemma_rows | block_rows).sum()))
+
+
+class StatusUploader:
+    """Writes STATUS columns back from a background thread, so that the network round trips overlap
+    with the checks of the next sheets. Writes are done one at a time (the quota is shared anyway),
+    and leaving the `with` block waits for them and raises the first error, if any. If the block
+    itself raised, the pending writes are cancelled and the exception is left to propagate."""
+    def __init__(self, spreadsheet) -> None:
+        self.spreadsheet = spreadsheet
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+
+    def submit(self, lexicon_split, sheet, messages):
+        self.futures.append(self.executor.submit(
+            utils.add_check_mark_online, lexicon_split, self.spreadsheet, sheet, write='overwrite',
+            messages=messages, status_col_name='STATUS_CHRIS'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is not None:
+            # The write in progress cannot be cancelled, its error (if any) is dropped
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            return None
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        return None
 
 
 def well_formedness(lexicon_split,
                     spreadsheet,
                     sheet,
-                    root=False,
-                    caphi=True,
-                    diacritics=True,
-                    aspect_paradigm=True,
-                    nom_paradigm=True,
-                    lemma_form=True,
-                    duplicates=True,
-                    write_status=True):
-    status_split = []
-    for _, row in lexicon_split.iterrows():
-        message = ''
-        root, lemma_norm = row['ROOT'], row['LEMMA_NORM']
-        caphi = row['CAPHI++']
-        if root:
-            message += _root_well_formedness_check(root, lemma_norm)
-        if caphi:
-            message += (' ' if message else '') + _caphi_well_formedness_check(caphi)
-        
-        if row['ANALYSIS'].split(':')[0] not in POS:
-            message += (' ' if message else '') + 'faulty-analysis'
-        for c in essential_columns:
-            if row[c].strip() == '':
-                message += (' ' if message else '') + f'missing-{c}'
-        
-        for f in ['form', 'lemma']:
-            is_phrase = 'PHRASE' in row['ANALYSIS']
-            if f == 'form' and is_phrase:
-                continue
-            text = row[f.upper()]
-            if not text:
-                message += (' ' if message else '') + f'{f}-missing'
-                continue
-
-            if diacritics:
-                #TODO: at some point debug without these
-                if text[0] == 'أ' and text[1] != 'َ' and text[1] != 'ُ':
-                    text = re.sub(r'^أ', 'أَ', text)
-                elif text[0] == 'إ' and text[1] != 'ِ':
-                    text = re.sub(r'^إ', 'إِ', text)
-                elif f =='form' and row['ANALYSIS'] == 'VERB:I' and text[0] == 'ي' and text[1] not in 'َُِْ':
-                    text = re.sub(r'^ي', 'يْ', text)
-                
-                message += (' ' if message else '') + _diacritization_check(text, f, caphi, is_phrase)
-        
-        status_split.append(message)
-
-    if aspect_paradigm:
-        _aspect_paradigm_completion_well_formedness_check(lexicon_split, status_split)
-    if nom_paradigm:
-        _nom_paradigm_completion_well_formedness_check(lexicon_split, status_split)
-    if lemma_form:
-        _lemma_form_well_formedness_check(lexicon_split, status_split)
-    if duplicates:
-        _duplicates_check(lexicon_split, status_split)
-    
+                    write_status=True,
+                    jobs=1,
+                    fingerprints=None,
+                    **kwargs):
+    if fingerprints is not None:
+        checks, hits, (n_row, n_cross_row) = run_checks_incremental(lexicon_split, fingerprints, **kwargs)
+        print(f'{len(lexicon_split.index)} rows: {n_row} checked by the row rules, '
+              f'{n_cross_row} by the cross-row rules')
+        status_split = render_status(checks, hits)
+    elif jobs > 1:
+        status_split = render_status(*run_checks_sharded(lexicon_split, jobs=jobs, **kwargs))
+    else:
+        status_split = check_lexicon(lexicon_split, **kwargs)
     if write_status:
         utils.add_check_mark_online(lexicon_split, spreadsheet, sheet, write='overwrite',
                                     messages=status_split, status_col_name='STATUS_CHRIS')
-    pass
-
-def get_caphi_symbols_inventory():
-    caphi_inventory = pd.read_csv('caphi_table.csv')
+    return status_split
+
+
+# Checks several sheets independently from each other (each one with its own cross-row rules) in a
+# process pool, the status of every sheet being written back as soon as it is available
+def well_formedness_per_sheet(sheet2lexicon,
+                              spreadsheet,
+                              write_status=True,
+                              jobs=None,
+                              **kwargs):
+    sheet2status = {}
+    with StatusUploader(spreadsheet) as uploader, \
+            ProcessPoolExecutor(max_workers=jobs or os.cpu_count(), initializer=init_worker,
+                                initargs=(msa_roots, caphi_inventory)) as executor:
+        futures = {executor.submit(check_lexicon, lexicon, **kwargs): sheet_name
+                   for sheet_name, lexicon in sorted(sheet2lexicon.items(), key=lambda x: -len(x[1].index))}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            sheet_name = futures[future]
+            sheet2status[sheet_name] = future.result()
+            if write_status:
+                uploader.submit(sheet2lexicon[sheet_name], spreadsheet.worksheet(sheet_name), sheet2status[sheet_name])
+    return {sheet_name: sheet2status[sheet_name] for sheet_name in sheet2lexicon}
+
+
+# Checks several sheets as one lexicon (one shared index), so that the cross-row rules also
+# catch paradigms and duplicates spread over different sheets
+def well_formedness_sheets(sheet2lexicon,
+                           spreadsheet,
+                           write_status=True,
+                           jobs=1,
+                           **kwargs):
+    lexicon = pd.concat(sheet2lexicon)
+    if jobs > 1:
+        checks, hits = run_checks_sharded(lexicon, LexiconIndex(lexicon), jobs=jobs, **kwargs)
+    else:
+        checks, hits = run_checks(lexicon, LexiconIndex(lexicon), **kwargs)
+    status = pd.Series(render_status(checks, hits), index=lexicon.index)
+    sheet2status = {}
+    with StatusUploader(spreadsheet) as uploader:
+        for sheet_name, lexicon_split in sheet2lexicon.items():
+            sheet2status[sheet_name] = status.loc[sheet_name].tolist()
+            if write_status:
+                uploader.submit(lexicon_split, spreadsheet.worksheet(sheet_name), sheet2status[sheet_name])
+    return sheet2status
+
+
+def get_caphi_symbols_inventory(path=CAPHI_TABLE_PATH):
+    caphi_inventory = pd.read_csv(path)
     caphi_consonants = ['Q', 'D', 'J', 'Z', 'T', 'S', 'Z.', 'D.', 'K'] + \
                         caphi_inventory['CAPHI'][caphi_inventory['Type'] == 'consonant'].values.tolist()
     caphi_consonants_set = set(caphi_consonants)
@@ -283,6 +669,36 @@ def get_caphi_symbols_inventory():
     type2caphi.update({'c': caphi_consonants_set, 'v': caphi_vowels_set, '#':'#'})
     return caphi2type, type2caphi
 
+
+# Reads the roots table, or the roots of a morphology index built by morph_index.py
+def load_msa_roots(path=MSA_ROOTS_PATH):
+    if is_morph_index(path):
+        return set(MorphIndex(path).roots)
+    msa_roots = pd.read_csv(path)
+    msa_roots = msa_roots.replace(nan, '', regex=True)
+    return set(msa_roots['ROOT'].values.tolist())
+
+
+# Sets the resources used by the root and CAPHI++ rules, `roots` can be given instead of the MSA roots table.
+# Without a CAPHI table (e.g., the CAPHI++ rules are skipped), the CAPHI++ rules cannot be run.
+def load_resources(msa_roots_path=MSA_ROOTS_PATH, caphi_table_path=CAPHI_TABLE_PATH, roots=None):
+    global msa_roots, caphi_inventory, caphi_transducer
+    msa_roots = set(roots) if roots is not None else load_msa_roots(msa_roots_path)
+    if caphi_table_path:
+        caphi_inventory, _ = get_caphi_symbols_inventory(caphi_table_path)
+        caphi_transducer = CaphiTransducer(caphi2type=caphi_inventory)
+    else:
+        caphi_inventory, caphi_transducer = None, None
+
+
+# Hamzas normalized to a bare hamza (and so is an initial alif), as expected by the root rules.
+# Every distinct lemma is normalized once.
+def normalize_lemmas(lemma):
+    codes, uniques = pd.factorize(lemma)
+    normalized = [text.translate(hamza_normalize_map) for text in uniques]
+    normalized = [bw2ar("'") + text[1:] if text[:1] == Alif_ar else text for text in normalized]
+    return pd.Series(np.array(normalized, dtype=object)[codes], index=lemma.index)
+
 if __name__ == "__main__":
     # lexicon_sheets = [
     #     ('PACL-Alif-Kha-Group-1', 'Alif-Kha'),
@@ -290,27 +706,38 @@ if __name__ == "__main__":
     #     ('PACL-Sad-Qaf-Group-3','Sad-Qaf'),
     #     ('PACL-Kaf-Ya-Group-4', 'Kaf-Ya')
     # ]
-    msa_roots = pd.read_csv(
-        '/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/camel_morph/misc_files/Roots.csv')
-    msa_roots = msa_roots.replace(nan, '', regex=True)
-    msa_roots = set(msa_roots['ROOT'].values.tolist())
-
-    caphi_inventory, _ = get_caphi_symbols_inventory()
-
-    sa = gspread.service_account("/Users/chriscay/.config/gspread/service_account.json")
+    # The roots table is read instead if the morphology index was not built (see morph_index.py)
+    if os.path.exists(MORPH_INDEX_PATH):
+        load_resources(MORPH_INDEX_PATH)
+    else:
+        print(f'No morphology index at {MORPH_INDEX_PATH}, reading the MSA roots from {MSA_ROOTS_PATH}')
+        load_resources(MSA_ROOTS_PATH)
+
+    sa = sheets_client.service_account("/Users/chriscay/.config/gspread/service_account.json")
     # sh = sa.open('PACL-Letter-Split')
     # sheet_names = utils.sheet_names
     sh = sa.open('Maknuune-WIP')
     sheet_names = ['Maknuune-v1.1']
     # sheet_names = ['Maknuune-WIP-Add']
 
-    for sheet_name in tqdm(sheet_names):
-        sheet = sh.worksheet(sheet_name)
-        lexicon = pd.DataFrame(sheet.get_all_records()).astype(str)
-        lexicon = lexicon.replace(nan, '', regex=True)
-        lexicon['LEMMA_NORM'] = lexicon.apply(
-            lambda row: re.sub(f'[{hamzas_ar}]', bw2ar("'"), row['LEMMA']), axis=1)
-        lexicon['LEMMA_NORM'] = lexicon.apply(
-            lambda row: re.sub(f"^{bw2ar('A')}", bw2ar("'"), row['LEMMA_NORM']), axis=1)
-        utils.try_google_api_until_succeded(well_formedness, lexicon, sh, sheet)
+    # Check all the sheets as a single lexicon, e.g., the 28 letter sheets of PACL-Letter-Split
+    cross_sheet = False
+    # Processes running the checks, over the sheets (or over chunks of rows if there is only one)
+    jobs = 1
 
+    sheet2lexicon = {}
+    for sheet_name in tqdm(sheet_names):
+        lexicon = utils.read_sheet_as_df(sh, sheet_name, strip=False)
+        lexicon['LEMMA_NORM'] = normalize_lemmas(lexicon['LEMMA'])
+        sheet2lexicon[sheet_name] = lexicon
+
+    if cross_sheet:
+        well_formedness_sheets(sheet2lexicon, sh, jobs=jobs)
+    elif len(sheet2lexicon) > 1 and jobs > 1:
+        well_formedness_per_sheet(sheet2lexicon, sh, jobs=jobs)
+    else:
+        for sheet_name, lexicon in sheet2lexicon.items():
+            # Only the rows changed since the last run are checked again
+            well_formedness(lexicon, sh, sh.worksheet(sheet_name), jobs=jobs,
+                            fingerprints=os.path.join(FINGERPRINT_DIR, f'{sh.id}-{sheet_name}.json'))
+    print(sheets_client.default_client.summary())
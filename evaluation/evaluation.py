@@ -6,12 +6,9 @@ import random
 random.seed(42)
 
 import pandas as pd
-from numpy import nan
-import gspread
 
 from camel_tools.morphology.utils import strip_lex
 from camel_tools.utils.charmap import CharMapper
-from camel_tools.morphology.database import MorphologyDB
 
 bw2ar = CharMapper.builtin_mapper('bw2ar')
 ar2bw = CharMapper.builtin_mapper('ar2bw')
@@ -21,6 +18,8 @@ RE_POS = re.compile(r'pos:(\S+)')
 
 sys.path.insert(0, '/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/palestinian_lexicon')
 import utils
+import sheets_client
+from morph_index import MORPH_INDEX_PATH, MorphIndex
 
 # import gspread
 
@@ -127,13 +126,9 @@ def perform_eval(lexicon_ref,
                 i += 1
 
 if __name__ == "__main__":
-    sa = gspread.service_account("/Users/chriscay/.config/gspread/service_account.json")
+    sa = sheets_client.service_account("/Users/chriscay/.config/gspread/service_account.json")
     sh = sa.open('Maknuune-Release-Camera-Ready')
-    sheet = sh.worksheet('Maknuune-v1.0')
-    pacl = pd.DataFrame(sheet.get_all_records()).astype(str)
-    pacl_obj = pacl.select_dtypes(['object'])
-    pacl[pacl_obj.columns] = pacl_obj.apply(lambda x: x.str.strip())
-    pacl = pacl.replace(nan, '', regex=True)
+    pacl = utils.read_sheet_as_df(sh, 'Maknuune-v1.0')
     
     lexpostype_pacl = [utils.lexpos2lexpostype((preprocessing(ar2bw(l)).strip(), pos.split(':')[0].strip()))
                             for l, pos in pacl[['LEMMA', 'ANALYSIS']].values.tolist()]
@@ -147,15 +142,15 @@ if __name__ == "__main__":
     #                 for l, postype, tag in bank[['Curras LEX', 'Curras POS type', "LEX' Exists in PACL"]].values.tolist()}
     perform_eval(curras, lexpostype_uniq_pacl, lexpostype_dediac_uniq_pacl, 'evaluation_sheet_curras_corpus.tsv', 0.1)
 
+    # Lexicons of the CALIMA MSA and EGY databases, see code/morph_index.py to build the index
+    morph_index = MorphIndex(MORPH_INDEX_PATH)
+
     # MSA Lex Eval
-    db_msa = MorphologyDB('/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/camel_morph/eval_files/calima-msa-s31_0.4.2.utf8.db', flags='g')
-    msa_lex = pd.DataFrame([[ar2bw(a['lex']), a['pos']] for analyses in db_msa.lemma_hash.values() for a in analyses], columns=['Lemma', 'POS'])
+    msa_lex = pd.DataFrame([[ar2bw(lex), pos] for lex, pos in morph_index.lex_pos('msa')], columns=['Lemma', 'POS'])
     perform_eval(msa_lex, lexpostype_uniq_pacl, lexpostype_dediac_uniq_pacl, 'evaluation_sheet_msa_lex.tsv', 0.02)
 
     # EGY Lex Eval
-    db_egy = MorphologyDB('/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/camel_morph/eval_files/calima-egy-c044_0.2.0.utf8.db', flags='g')
-    egy_lex = pd.DataFrame([[ar2bw(a['lex']), a['pos']] for analyses in db_egy.lemma_hash.values() for a in analyses if a['gloss'].endswith('_[CALIMA]')],
-                           columns=['Lemma', 'POS'])
+    egy_lex = pd.DataFrame([[ar2bw(lex), pos] for lex, pos in morph_index.lex_pos('egy')], columns=['Lemma', 'POS'])
     perform_eval(egy_lex, lexpostype_uniq_pacl, lexpostype_dediac_uniq_pacl, 'evaluation_sheet_egy_lex.tsv', 0.02)
 
     # MSA Corpus Eval
@@ -2,12 +2,11 @@ from camel_tools.morphology.utils import strip_lex
 from camel_tools.utils.charmap import CharMapper
 
 import pandas as pd
-from numpy import nan
-import gspread
 
 import utils
+import sheets_client
 
-sa = gspread.service_account("/Users/chriscay/.config/gspread/service_account.json")
+sa = sheets_client.service_account("/Users/chriscay/.config/gspread/service_account.json")
 
 # db = MorphologyDB('/Users/chriscay/Library/Mobile Documents/com~apple~CloudDocs/NYUAD/camel_morph/eval_files/calima-msa-s31_0.4.2.utf8.db', flags='g')
 
@@ -259,11 +258,7 @@ def pos_dist3(pacl, curras):
 # pacl = utils.read_pacl_as_df()
 # pacl_dfs = utils.read_pacl_as_dfs()
 sh = sa.open('Maknuune-Release-Camera-Ready')
-sheet = sh.worksheet('Maknuune-v1.0')
-pacl = pd.DataFrame(sheet.get_all_records()).astype(str)
-pacl_obj = pacl.select_dtypes(['object'])
-pacl[pacl_obj.columns] = pacl_obj.apply(lambda x: x.str.strip())
-pacl = pacl.replace(nan, '', regex=True)
+pacl = utils.read_sheet_as_df(sh, 'Maknuune-v1.0')
 
 sh = sa.open('PACL-Letter-Split')
         